@@ -4,9 +4,12 @@
 
 echo '#The following are aliases to each MuTools utility.' >> ~/.bashrc
 echo "alias multimutect=$(pwd)/multimutect/multimutect.py" >> ~/.bashrc
+echo "alias workqueue=$(pwd)/multimutect/workqueue.py" >> ~/.bashrc
+echo "alias accounting=$(pwd)/multimutect/accounting.py" >> ~/.bashrc
 for i in $( echo premutect/*.py ); do
    base=$(basename $i .py)
-   if [ "$base" = "__init__" ]
+   if [ "$base" = "__init__" ] || [ "$base" = "executor" ] \
+      || [ "$base" = "buildstate" ]
       then continue
    else
       echo "alias $base=$(pwd)/$i" >> ~/.bashrc
@@ -14,3 +17,4 @@ for i in $( echo premutect/*.py ); do
 done
 echo "alias combine=$(pwd)/postmutect/combine.py" >> ~/.bashrc
 echo "alias catenate=$(pwd)/postmutect/catenate.py" >> ~/.bashrc
+echo "alias mutools=$(pwd)/mutools.py" >> ~/.bashrc
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+"""
+    "accounting.py", by Sean Soderman
+    Records the resources each MuTect process used, as reaped by the
+    scheduler, in a file of JSON lines (multimutect's --statistics), and
+    summarizes them: throughput, CPU efficiency and the slowest shards.
+
+    Each attempt of each job is a line of type "job", holding its pair,
+    shard and intervals, the bases and (estimated) input bytes it covers,
+    its wall time, user and system CPU seconds, peak resident set size (in
+    megabytes), exit status and retry number. A line of type "run" closes
+    each run with the number of slots, the cores available and the run's
+    wall time. Runs are appended to the file, each tagged with the time
+    it started.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+"""
+Returns the total size of the given files, leaving out those that do not
+exist.
+"""
+def file_bytes(paths):
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+class Accounting(object):
+    """
+    An append-only file of JSON records, one per MuTect process reaped and
+    one per run. run identifies the run the records belong to (by default,
+    the time the file was opened).
+    """
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run if run is not None else int(time.time())
+        self.accounts = open(path, 'a')
+
+    def write(self, record):
+        record['run'] = self.run
+        self.accounts.write(json.dumps(record, sort_keys=True) + '\n')
+        self.accounts.flush()
+
+    """
+    Records a finished attempt of a job: tid is its job id, slot the
+    scheduler slot it ran in, started the time it started (in seconds since
+    the epoch), heap the Java heap it ran with, status its exit status and
+    usage the resource usage of its process, as returned by os.wait4 (None
+    if it isn't known). retried is whether the job will be run again.
+    """
+    def record(self, tid, job, slot, started, heap, status, usage,
+               retried=False):
+        record = {'type': 'job', 'tid': tid, 'pair': list(job.pair),
+                  'shard': job.name, 'intervals': job.intervals,
+                  'bases': job.bases,
+                  'input_bytes': int(file_bytes(job.inputs) * job.share),
+                  'heap': heap, 'slot': slot, 'start': started,
+                  'wall': job.wall, 'user': None, 'sys': None,
+                  'maxrss': None, 'status': status,
+                  'retry': job.attempts - 1, 'retried': retried}
+        if usage is not None:
+            record['user'] = usage.ru_utime
+            record['sys'] = usage.ru_stime
+            #Linux reports the peak RSS in kilobytes.
+            record['maxrss'] = usage.ru_maxrss // 1024
+        self.write(record)
+
+    """
+    Records the end of the run: the number of slots MuTect processes ran
+    in, the cores they could use, its wall time and the bytes of the BAM
+    files it read.
+    """
+    def finish(self, slots, cores, wall, input_bytes):
+        self.write({'type': 'run', 'slots': slots, 'cores': cores,
+                    'wall': wall, 'input_bytes': input_bytes})
+
+    def close(self):
+        self.accounts.close()
+
+
+"""
+Reads the records of a file written by Accounting. Returns a list of
+(run, job records, run record or None) tuples in the order the runs
+started. Lines cut short by a crash are ignored.
+"""
+def load(path):
+    jobs = {}
+    ends = {}
+    with open(path, 'r') as accounts:
+        for line in accounts:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('type') == 'run':
+                ends[record['run']] = record
+            else:
+                jobs.setdefault(record['run'], []).append(record)
+    return [(run, jobs.get(run, []), ends.get(run))
+            for run in sorted(set(jobs) | set(ends))]
+
+
+"""
+Divides, or returns None when there is nothing to divide by.
+"""
+def ratio(numerator, denominator):
+    if not denominator:
+        return None
+    return numerator / float(denominator)
+
+
+"""
+Summarizes the job records of a run (and its run record, if the run
+finished). Returns a dictionary of: the number of jobs, of those that
+failed and of the attempts retried; the run's wall time (from the run
+record, or else from the first start to the last end); the bases and
+input bytes of the jobs that succeeded, and their rates per second of the
+run; the CPU seconds all attempts used, the cores they kept busy on
+average and, with the run record, the fraction of the available cores
+that is; and the slowest attempts, slowest first.
+"""
+def summarize(jobs, end=None, slowest=5):
+    final = [j for j in jobs if not j['retried']]
+    done = [j for j in final if j['status'] == 0]
+    walls = [j for j in jobs if j['wall'] is not None]
+    wall = end['wall'] if end is not None else None
+    if wall is None and walls:
+        wall = (max(j['start'] + j['wall'] for j in walls)
+                - min(j['start'] for j in walls))
+    cpu = sum((j['user'] or 0) + (j['sys'] or 0) for j in jobs)
+    bases = sum(j['bases'] or 0 for j in done)
+    read = sum(j['input_bytes'] or 0 for j in done)
+    busy = ratio(cpu, wall)
+    return {'jobs': len(final), 'failed': len(final) - len(done),
+            'retried': len(jobs) - len(final), 'wall': wall,
+            'bases': bases, 'bases_per_sec': ratio(bases, wall),
+            'input_bytes': read, 'bytes_per_sec': ratio(read, wall),
+            'cpu': cpu, 'busy_cores': busy,
+            'efficiency': (ratio(busy, end['cores'])
+                           if end is not None and busy is not None
+                           else None),
+            'slowest': sorted(walls, key=lambda j: j['wall'],
+                              reverse=True)[:slowest]}
+
+
+"""
+Formats a number, or a dash for one that isn't known.
+"""
+def show(value, form='{:.1f}'):
+    return '-' if value is None else form.format(value)
+
+
+"""
+Writes the summary of a run (see summarize) to out.
+"""
+def report(run, summary, out=sys.stdout):
+    out.write('Run {}: {} jobs, {} failed, {} attempts retried, {}s\n'
+              .format(run, summary['jobs'], summary['failed'],
+                      summary['retried'], show(summary['wall'])))
+    out.write('  Throughput: {} bases/s, {} MB/s of input\n'.format(
+        show(summary['bases_per_sec'], '{:.0f}'),
+        show(summary['bytes_per_sec'] and
+             summary['bytes_per_sec'] / 1048576.0, '{:.2f}')))
+    out.write('  CPU: {}s, {} cores busy on average ({} of the cores)\n'
+              .format(show(summary['cpu']), show(summary['busy_cores']),
+                      show(summary['efficiency'] and
+                           100 * summary['efficiency'], '{:.0f}%')))
+    if summary['slowest']:
+        out.write('  Slowest shards:\n')
+    for job in summary['slowest']:
+        cpu = None
+        if job['user'] is not None:
+            cpu = job['user'] + job['sys']
+        out.write('    {:>8}s  {} {}  cpu {}s  rss {}m  status {}{}\n'
+                  .format(show(job['wall']),
+                          ':'.join(job['pair']).rstrip(':'), job['shard'],
+                          show(cpu), show(job['maxrss'], '{}'), job['status'],
+                          ' (retry {})'.format(job['retry'])
+                          if job['retry'] else ''))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=('Summarizes the resources'
+                                                  ' used by MuTect jobs'))
+    parser.add_argument('statfile', type=str,
+                        help='The file written by multimutect --statistics')
+    parser.add_argument('-n', '--slowest', type=int, default=5,
+                        help=('The number of slowest shards listed.'
+                              ' Default: 5'))
+    parser.add_argument('--all', action='store_true',
+                        help='Summarize every run, not just the last one.')
+    args = parser.parse_args()
+    runs = load(args.statfile)
+    if not runs:
+        sys.stderr.write('No records in {}\n'.format(args.statfile))
+        sys.exit(1)
+    for run, jobs, end in (runs if args.all else runs[-1:]):
+        report(run, summarize(jobs, end, args.slowest))
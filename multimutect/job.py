@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+    "job.py", by Sean Soderman
+    Describes a single MuTect invocation, as built by Synchrom and run by
+    the scheduler (locally, or by a worker through a spool directory).
+"""
+import os
+import re
+from sharder import Batch
+
+
+class Job(object):
+    """
+    A single MuTect invocation: its command line, the tumor:normal pair it
+    belongs to, the paths of its input BAMs and output VCF, and the shard
+    (or batch) it covers, if any. scale is the weight of the shard relative
+    to the heaviest of its pair, which the scheduler uses to size the Java
+    heap (heap, in megabytes). Until a heap is set, the command's own -Xmx
+    is used. attempts counts the times the job has been run, timed_out is
+    set if it was stopped for running too long, and wall is the wall time
+    (in seconds) of its last run. siblings is the number of jobs (itself
+    included) that make up its pair, and share the part of the pair's work
+    (by weight) the job does. bases and intervals are those of its shard,
+    or None for whole BAM jobs.
+    """
+    def __init__(self, cmd, pair, inputs, vcf, shard=None, scale=1.0,
+                 siblings=1, share=1.0):
+        self.cmd = cmd
+        self.pair = pair
+        self.inputs = inputs
+        self.vcf = vcf
+        self.shard = shard
+        self.scale = scale
+        self.siblings = siblings
+        self.share = share
+        self.bases = None
+        self.intervals = None
+        if isinstance(shard, Batch):
+            self.bases = shard.length
+            self.intervals = [s.interval for s in shard.shards]
+        elif shard is not None:
+            self.bases = shard.length
+            self.intervals = [shard.interval]
+        self.heap = None
+        self.attempts = 0
+        self.timed_out = False
+        self.wall = None
+
+    """
+    The log file MuTect's output goes to, next to the output VCF.
+    """
+    @property
+    def log(self):
+        return re.sub(r'\.vcf$', '', self.vcf) + '.log'
+
+    """
+    The name of the job's VCF fragment (or whole VCF), sans extension.
+    """
+    @property
+    def name(self):
+        return re.sub(r'\.vcf$', '', os.path.basename(self.vcf))
+
+    """
+    The contigs the job's records may lie on, or None for whole BAM jobs
+    (and jobs rebuilt from a record, whose shard isn't carried along).
+    """
+    @property
+    def contigs(self):
+        if self.shard is None:
+            return None
+        if isinstance(self.shard, Batch):
+            return set(s.contig for s in self.shard.shards)
+        return set([self.shard.contig])
+
+    """
+    Returns a dictionary describing the job, suitable for JSON, from which
+    from_record can rebuild it (sans shard, but with its bases and
+    intervals) in another process.
+    """
+    def to_record(self):
+        return {'cmd': self.cmd, 'pair': list(self.pair),
+                'inputs': self.inputs, 'vcf': self.vcf, 'scale': self.scale,
+                'share': self.share, 'bases': self.bases,
+                'intervals': self.intervals}
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(record['cmd'], tuple(record['pair']), record['inputs'],
+                  record['vcf'], scale=record['scale'],
+                  share=record.get('share', 1.0))
+        job.bases = record.get('bases')
+        job.intervals = record.get('intervals')
+        return job
+
+    """
+    Returns the command as an argument list, ready for subprocess.
+    """
+    def argv(self):
+        argv = self.cmd.split()
+        if self.heap is not None:
+            argv = ['-Xmx{}m'.format(self.heap) if a.startswith('-Xmx')
+                    else a for a in argv]
+        return argv
+
+    def __str__(self):
+        return ' '.join(self.argv())
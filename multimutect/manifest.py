@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+    "manifest.py", by Sean Soderman
+    Keeps a durable record of every MuTect job run into an output directory,
+    so that an interrupted run can be resumed without redoing finished work.
+"""
+import hashlib
+import json
+import os
+import sys
+try:
+    from fragments import validate
+except ImportError as I:
+    sys.stderr.write('Make sure the postmutect directory is present: {}\n'
+                     .format(I))
+    sys.exit(1)
+
+
+"""
+Returns a list of [path, size, mtime] fingerprints of the given files.
+Files that do not exist are fingerprinted as [path, None, None].
+"""
+def fingerprint(paths):
+    prints = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            prints.append([path, stat.st_size, int(stat.st_mtime)])
+        except OSError:
+            prints.append([path, None, None])
+    return prints
+
+
+"""
+Returns the MD5 checksum of a file, read in large blocks.
+"""
+def checksum(path, blocksize=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as infile:
+        block = infile.read(blocksize)
+        while block:
+            md5.update(block)
+            block = infile.read(blocksize)
+    return md5.hexdigest()
+
+
+class Manifest(object):
+    """
+    An append-only file of JSON records, one per finished job (pair x
+    interval), keyed by the job's output VCF. Each record holds the
+    command, the fingerprints of the job's inputs, its exit status and
+    the size and checksum of its output. Later records for the same output
+    supersede earlier ones.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, 'r') as manifest:
+                for line in manifest:
+                    #A record cut short by a crash is simply ignored.
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[record['vcf']] = record
+        self.manifest = open(path, 'a')
+
+    """
+    Records a finished job. The output of a successful job is validated
+    first, so a fragment truncated despite a zero exit status still gets
+    rerun. Each record is flushed to disk before returning.
+    Returns the record.
+    """
+    def record(self, job, status):
+        record = {'vcf': job.vcf, 'command': job.cmd,
+                  'inputs': fingerprint(job.inputs), 'status': status,
+                  'problem': None, 'size': None, 'checksum': None}
+        if status == 0:
+            record['problem'] = validate(job.vcf, job.contigs)
+            if record['problem'] is None:
+                record['size'] = os.path.getsize(job.vcf)
+                record['checksum'] = checksum(job.vcf)
+        self.records[job.vcf] = record
+        self.manifest.write(json.dumps(record, sort_keys=True) + '\n')
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        return record
+
+    """
+    Whether a job has already been completed: it succeeded with the same
+    command on unchanged inputs, and its output is still intact.
+    """
+    def done(self, job):
+        record = self.records.get(job.vcf)
+        if record is None or record['status'] != 0 or record['problem']:
+            return False
+        if record['command'] != job.cmd:
+            return False
+        if record['inputs'] != fingerprint(job.inputs):
+            return False
+        if validate(job.vcf, job.contigs) is not None:
+            return False
+        if os.path.getsize(job.vcf) != record['size']:
+            return False
+        return checksum(job.vcf) == record['checksum']
+
+    def close(self):
+        self.manifest.close()
@@ -3,19 +3,26 @@
     'multimutect.py', by Sean Soderman
     Parallelizer for MuTect.
 """
-from itertools import izip
-from synchrom import Synchrom
-from time import time
 import argparse
 import multiprocessing
 import os
-import re
+import shutil
 import subprocess
 import sys
-try:
-    from concurrent.futures import ThreadPoolExecutor
-except ImportError as I:
-    sys.stderr.write("Please import the required modules: {}\n".format(I))
+import tempfile
+#The postprocessing tools live in a sibling directory.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'postmutect'))
+from accounting import Accounting, file_bytes, load, summarize
+from accounting import report as report_run
+from itertools import izip
+from manifest import Manifest
+from pipeline import Catenator
+from scheduler import Scheduler, allowed_cpus, partition, prefetch
+from synchrom import Synchrom
+from time import time
+from tracing import RESULTS, SETUP, Tracer, span
+from workqueue import Coordinator
 
 
 """
@@ -28,6 +35,65 @@ def diagnostic(synchrom):
         print('My command is {}'.format(item))
 
 
+"""
+Measures the fixed cost of a MuTect job (JVM startup, reference indexing,
+BAM header parsing) and its cost per base, by timing MuTect on a single
+base and on a larger region of the first pair. Synchrom uses these to pick
+the number of intervals per job. Takes a Synchrom object and returns None.
+"""
+def calibrate(synchrom):
+    probedir = tempfile.mkdtemp(prefix='multimutect_probe')
+    timings = []
+    try:
+        overhead_cmd, work_cmd, bases = synchrom.probe_commands(probedir)
+        for cmd in (overhead_cmd, work_cmd):
+            start = time()
+            subprocess.check_output(cmd.split())
+            timings.append(time() - start)
+    except subprocess.CalledProcessError as cpe:
+        sys.stderr.write(('Could not calibrate the batch size, running one'
+                          ' interval per job: {}\n').format(cpe))
+        synchrom.intervals_per_job = 1
+        return
+    finally:
+        shutil.rmtree(probedir)
+    overhead, work = timings
+    synchrom.job_overhead = overhead
+    synchrom.base_cost = max(work - overhead, 0) / float(bases)
+    print('Measured {:.1f}s of overhead per MuTect job'.format(overhead))
+
+
+"""
+Argument type for --intervals_per_job: a positive integer or 'auto'.
+"""
+def per_job_type(value):
+    if value == 'auto':
+        return value
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer or"
+                                         " 'auto', not {}".format(value))
+    return number
+
+
+"""
+Filters out the jobs the manifest records as already completed, when
+resuming a run. Skipped jobs still count towards their pair's catenation,
+if there is a catenator.
+"""
+def unfinished(jobs, manifest, catenator=None):
+    for job in jobs:
+        if job is not None and manifest.done(job):
+            print('Skipping completed job: {}'.format(job.vcf))
+            if catenator is not None:
+                catenator.finished(job)
+            continue
+        yield job
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='MuTect parallelizer')
     #Create a group for both the file of bamfiles and cmd line
@@ -72,36 +138,158 @@ if __name__ == '__main__':
 
     parser.add_argument('--numthreads', type=int, 
                         default=multiprocessing.cpu_count() // 4,
-                        help=('The number of threads that will fork mutect'
-                              ' processes. Default: The # of cores on your'
-                              ' computer / 4, rounded down.'))
+                        help=('The maximum number of MuTect processes run'
+                              ' at once, memory permitting. Default: The #'
+                              ' of cores on your computer / 4, rounded'
+                              ' down.'))
 
     parser.add_argument('--mem', type=int, default=3,
                         help=('The max amount of memory each forked MuTect'
                               ' process can allocate on the Java heap'
+                              ' Default: 3'))
+
+    parser.add_argument('--min_mem', type=int, default=1,
+                        help=('The Java heap (in gigabytes) given to the'
+                              ' lightest shards. Heaps grow with shard'
+                              ' weight up to --mem. Default: 1'))
+
+    parser.add_argument('--max_mem', type=int,
+                        help=('The largest Java heap (in gigabytes) a job'
+                              ' that ran out of memory is retried with.'
+                              ' Default: twice --mem'))
+
+    parser.add_argument('--retries', type=int, default=2,
+                        help=('How many times a job that ran out of memory'
+                              ' is retried, doubling its heap each time.'
                               ' Default: 2'))
 
+    parser.add_argument('--timeout', type=int,
+                        help=('Stop any MuTect process running longer than'
+                              ' this many seconds.'))
+
+    parser.add_argument('--jvm_threads', type=int, default=0,
+                        help=('Caps the garbage collector and JIT compiler'
+                              ' threads of each JVM. Default: the # of cores'
+                              ' on your computer / --numthreads.'))
+
+    parser.add_argument('--pin_cpus', action='store_true',
+                        help=('Pin the MuTect processes of each of the'
+                              ' --numthreads slots to their own set of'
+                              ' cores.'))
+
+    parser.add_argument('--numa', action='store_true',
+                        help=('Like --pin_cpus, but no slot\'s set of cores'
+                              ' crosses a NUMA node boundary.'))
+
     parser.add_argument('--process_whole_bam', action='store_true',
                         help=('Process the entire BAM file at once instead '
                               'of single chromosomes at a time'))
+    #Group for the two ways of controlling how finely the genome is split.
+    shard_group = parser.add_mutually_exclusive_group(required=False)
+
+    shard_group.add_argument('--shard_size', type=int,
+                             help=('Split contigs into shards of roughly this'
+                                   ' many bases (at mean coverage). Smaller'
+                                   ' shards balance load better but pay more'
+                                   ' JVM startup overhead.'))
+
+    shard_group.add_argument('--target_shards', type=int,
+                             help=('Split each pair into roughly this many'
+                                   ' shards of equal weight. Default: one'
+                                   ' shard per contig.'))
+
+    parser.add_argument('--pack_size', type=int, default=5000000,
+                        help=('Whole contigs smaller than this many bases'
+                              ' (at mean coverage) are packed together with'
+                              ' their neighbours into a single MuTect job.'
+                              ' The pieces --shard_size or --target_shards'
+                              ' cut contigs into are never packed.'
+                              ' 0 disables packing. Default: 5000000'))
+
+    parser.add_argument('--intervals_per_job', type=per_job_type, default=1,
+                        help=('The number of shards each MuTect process'
+                              ' runs, through an interval list file. "auto"'
+                              ' picks it from the measured overhead of a'
+                              ' MuTect job. Default: 1'))
+
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help=('The number of commands prepared ahead of the'
+                              ' running MuTect processes. Default: twice'
+                              ' --numthreads.'))
+
+    parser.add_argument('--resume', action='store_true',
+                        help=('Resume an interrupted run into the same'
+                              ' output directory, only rerunning jobs that'
+                              ' are missing, failed, or whose inputs,'
+                              ' command or output changed since.'))
+
+    parser.add_argument('--spool', type=str,
+                        help=('Instead of running MuTect here, queue the'
+                              ' jobs in this directory (on a filesystem'
+                              ' shared with the worker machines) for'
+                              ' workqueue.py workers to run.'))
+
+    parser.add_argument('--lease', type=int, default=300,
+                        help=('With --spool, seconds after which a job'
+                              ' whose worker stopped renewing its lease is'
+                              ' given to another worker. Default: 300'))
+
+    parser.add_argument('--catenate', action='store_true',
+                        help=('Catenate each pair\'s VCF fragments (as'
+                              ' catenate.py does) as soon as all of its'
+                              ' jobs have finished, in a low priority'
+                              ' process alongside MuTect.'))
+
+    parser.add_argument('--delete_fragments', action='store_true',
+                        help=('With --catenate, delete each pair\'s'
+                              ' fragments once they have been catenated.'))
+
+    parser.add_argument('-z', '--compress', action='store_true',
+                        help=('With --catenate, write each pair\'s VCF'
+                              ' bgzipped and tabix indexed, as a .vcf.gz.'))
+
+    parser.add_argument('--cache_dir', type=str,
+                        help=('The directory BAM headers and index'
+                              ' statistics are cached in between runs.'
+                              ' Default: $MUTOOLS_CACHE, or'
+                              ' ~/.cache/mutools'))
+
     parser.add_argument('--statistics', type=str,
-                        help=('Report statistics on execution time and '
-                               ' threads used.'))
+                        help=('Append the resources each MuTect process'
+                              ' used (wall and CPU time, peak memory...)'
+                              ' to this file, as JSON lines, and summarize'
+                              ' them at the end of the run. See'
+                              ' accounting.py.'))
+
+    parser.add_argument('--trace', type=str,
+                        help=('Write a timeline of the run to this file,'
+                              ' as Chrome trace events (for'
+                              ' chrome://tracing or ui.perfetto.dev): a'
+                              ' track per slot with a span per MuTect'
+                              ' process, along with the building of'
+                              ' commands and the post-processing.'))
     args = parser.parse_args()
     if not os.path.exists(args.mupath):
         sys.stderr.write('Error: path to {} does not exist. cwd: {}\n'
                          .format(args.mupath, os.getcwd()))
         sys.exit(1)
-    #Create the threads and the parent output directory.
-    numthreads = args.numthreads
-    #Mini function: execute the command, surround in try except.
-    def procfun(dtuple):
-        tid, cmd = dtuple
-        try:
-            cmdlist = cmd.split()
-            val = subprocess.check_output(cmdlist)
-            print('tid: {}, the cmd is: {}'.format(tid, cmd))
-        except subprocess.CalledProcessError as cpe:
+    if args.catenate and args.process_whole_bam:
+        sys.stderr.write('Error: --catenate has nothing to do with'
+                         ' --process_whole_bam\n')
+        sys.exit(1)
+    numthreads = max(1, args.numthreads)
+    #Give each slot its own cores, and size the JVMs' threads to them.
+    cpusets = None
+    if args.pin_cpus or args.numa:
+        cpusets = partition(numthreads, args.numa)
+    if args.jvm_threads < 1:
+        if cpusets is not None:
+            args.jvm_threads = min(len(c) for c in cpusets)
+        else:
+            args.jvm_threads = max(1, len(allowed_cpus()) // numthreads)
+    #Mini function: report on a finished command.
+    def report(tid, job, status):
+        if status != 0:
             errfilepath = ''
             if not os.path.exists('errors'):
                 try:
@@ -111,6 +299,9 @@ if __name__ == '__main__':
                                      format(O, os.linesep))
             errfilepath = os.path.join('errors', 
                                        'thread{}.err'.format(tid))
+            problem = 'exit status {}'.format(status)
+            if job.timed_out:
+                problem = 'running past the --timeout'
             #Log error to a file rather than write to stderr.
             with open(errfilepath, 'w') as errfile:
                 errfile.write(('I crashed with the command line:{}'
@@ -120,10 +311,13 @@ if __name__ == '__main__':
                                ' or a command line '
                                ' accomodating more '
                                ' memory for the Java heap.'
-                               ' The specific problem was {}\n'
-                               ).format(os.linesep, cmd, os.linesep, cpe))
-            return 'Thread {} executed unsuccessfully'.format(tid)
-        return 'Thread {} executed successfully'.format(tid)
+                               ' The specific problem was {}, after {}'
+                               ' attempt(s). MuTect\'s output is in {}\n'
+                               ).format(os.linesep, job, os.linesep, problem,
+                                        job.attempts, job.log))
+            return 'Job {} executed unsuccessfully'.format(tid)
+        print('tid: {}, the cmd is: {}'.format(tid, job))
+        return 'Job {} executed successfully'.format(tid)
 
     #Mini function #2: Generator function for infinite numeric sequence.
     def infinigen():
@@ -132,43 +326,65 @@ if __name__ == '__main__':
             yield i
             i += 1
 
-    synchrom = Synchrom(args)
-    infinity = infinigen()
-    start_time = 0
-    end_time = 0
-    with ThreadPoolExecutor(max_workers=numthreads) as threader:
-        results = threader.map(procfun, izip(infinity, synchrom.commands))
-        start_time = time()
-        for i in results:
-            print i
-        end_time = time()
+    tracer = None
+    if args.trace is not None:
+        tracer = Tracer(args.trace)
+    synchrom = Synchrom(args, tracer)
+    if not os.path.exists(args.outputdir):
+        os.makedirs(args.outputdir)
+    manifest = Manifest(os.path.join(args.outputdir, 'manifest.jsonl'))
+    if args.intervals_per_job == 'auto' and not args.process_whole_bam:
+        with span(tracer, 'calibrate', SETUP, 'setup'):
+            calibrate(synchrom)
+    accounting = None
     if args.statistics is not None:
-        statfile = args.statistics
-        bam_gigs = 0
-        cpu_cores = multiprocessing.cpu_count()
-        #Gather data for initial run.
-        if not os.path.exists(statfile):
-            bams = []
-            if args.bamlistfile is not None:
-                with open(args.bamlistfile, 'r') as blf:
-                    bams = [re.split('\s+', b.strip()) for b in blf
-                            if re.search('.*bam', b)]
-            else:
-                bams = [b.split(':') for b in args.pairs]
-            #Flatten the list and remove empty strings.
-            bams = [i for pair in bams for i in pair if i != '']
-            #Prepend input directory name to each bam filename in the list.
-            bams = [os.path.join(args.inputdir, b) for b in bams]
-            #Attain the size (in bytes) of the processed BAM data.
-            bam_gigs = sum([os.stat(b).st_size for b in bams])
-        #stats.txt is opened in append mode, as it will take mult.
-        #runs to get data for thread performance.
-        with open(statfile, 'a') as filestats:
-            #Initialize the file if it is of size zero.
-            if os.stat(statfile).st_size == 0:
-                filestats.write('CPU cores: {}\n'.format(cpu_cores))
-                filestats.write('Total BAM data processed: {}\n'
-                                .format(bam_gigs))
-                filestats.write('Threads\tTime\n')
-            thread_and_time = '{}\t{}\n'.format(numthreads, end_time - start_time)
-            filestats.write(thread_and_time)
+        accounting = Accounting(args.statistics)
+    scheduler = Scheduler(numthreads, args.mem, args.min_mem,
+                          cpusets=cpusets, timeout=args.timeout,
+                          retries=args.retries, max_mem=args.max_mem,
+                          accounting=accounting, tracer=tracer)
+    infinity = infinigen()
+    start_time = time()
+    #Commands are built lazily, at most a window's worth ahead of the jobs
+    #being run, so setup I/O is spread over the run.
+    window = args.prefetch if args.prefetch > 0 else 2 * numthreads
+    #With a spool, the jobs are run by workers, at most a window at a time.
+    if args.spool is not None:
+        scheduler = Coordinator(args.spool, window, args.lease)
+    #The catenation process is forked before any other thread starts.
+    catenator = None
+    if args.catenate:
+        catenator = Catenator(args.fasta,
+                              delete_fragments=args.delete_fragments,
+                              compress=args.compress, tracer=tracer)
+    commands = synchrom.commands
+    if args.resume:
+        commands = unfinished(commands, manifest, catenator)
+    commands = prefetch(izip(infinity, commands), window)
+    #The BAM files read, for the statistics.
+    inputs = set()
+    for tid, job, status in scheduler.run(commands):
+        inputs.update(job.inputs)
+        with span(tracer, 'record', RESULTS, 'postprocess',
+                  {'job': tid, 'vcf': job.vcf}):
+            record = manifest.record(job, status)
+        if status == 0 and record['problem'] is not None:
+            sys.stderr.write('Job {} left a bad fragment, {} is {}\n'
+                             .format(tid, job.vcf, record['problem']))
+            status = -1
+        print report(tid, job, status)
+        if catenator is not None:
+            catenator.finished(job, status == 0)
+    manifest.close()
+    if catenator is not None:
+        catenator.close()
+    end_time = time()
+    if tracer is not None:
+        tracer.close()
+    if accounting is not None:
+        accounting.finish(numthreads, len(allowed_cpus()),
+                          end_time - start_time, file_bytes(inputs))
+        accounting.close()
+        for run, jobs, end in load(args.statistics):
+            if run == accounting.run:
+                report_run(run, summarize(jobs, end))
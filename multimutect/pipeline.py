@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+    "pipeline.py", by Sean Soderman
+    Overlaps post-processing with MuTect: each pair's fragments are
+    catenated (and optionally cleaned up) as soon as its last job finishes,
+    while the other pairs are still being called.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from tracing import CATENATION, timed
+try:
+    from catenate import catenate_pair
+except ImportError as I:
+    sys.stderr.write('Make sure the postmutect directory is present: {}\n'
+                     .format(I))
+    sys.exit(1)
+
+
+"""
+Returns the directory of a job's output, and the directory containing it.
+"""
+def pair_dir(job):
+    d_path = os.path.dirname(job.vcf)
+    return os.path.dirname(d_path), os.path.basename(d_path)
+
+
+class Catenator(object):
+    """
+    Catenates a pair's fragments with catenate.catenate_pair once all of
+    its jobs have finished, the same way catenate.py would afterwards
+    (natively, without CatVariants), bgzipped and indexed with compress.
+    Catenation runs in a single worker process of lowered priority
+    (niceness), so it only takes up cores MuTect leaves idle.
+    Pairs with a failed job are left alone, to be rerun with --resume.
+    Each catenation is a span of tracer (see tracing.Tracer), if given.
+    """
+    def __init__(self, reference, listfile='chrs.list',
+                 delete_fragments=False, niceness=19, compress=False,
+                 tracer=None):
+        self.options = (reference, None, listfile, delete_fragments)
+        self.compress = compress
+        self.tracer = tracer
+        self.pool = multiprocessing.Pool(1, initializer=os.nice,
+                                         initargs=(niceness,))
+        #Maps a pair's output directory: the # of its jobs left to finish.
+        self.remaining = {}
+        self.failed = set()
+        #(output directory, async result) tuples of submitted catenations.
+        self.results = []
+        #Jobs skipped on resume are reported from the prefetch thread.
+        self.lock = threading.Lock()
+
+    """
+    Notes that a job has finished (ok is False if it failed), and starts
+    the catenation of its pair if it was the pair's last job.
+    """
+    def finished(self, job, ok=True):
+        dirpath, dir = pair_dir(job)
+        with self.lock:
+            key = (dirpath, dir)
+            left = self.remaining.get(key, job.siblings) - 1
+            self.remaining[key] = left
+            if not ok:
+                self.failed.add(key)
+            if left > 0:
+                return
+            del self.remaining[key]
+            if key in self.failed:
+                sys.stderr.write('Not catenating {}: some of its jobs'
+                                 ' failed\n'.format(os.path.join(*key)))
+                return
+            print('Catenating {}'.format(os.path.join(*key)))
+            #The worker times the catenation, for the trace.
+            self.results.append((os.path.join(*key), self.pool.apply_async(
+                timed, (catenate_pair, key + self.options,
+                        {'compress': self.compress}))))
+
+    """
+    Waits for the outstanding catenations to finish.
+    """
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for d_path, result in self.results:
+            try:
+                start, end, _ = result.get()
+            except Exception as E:
+                sys.stderr.write('Could not catenate {}: {}\n'
+                                 .format(d_path, E))
+                continue
+            if self.tracer is not None:
+                self.tracer.complete('catenate', start, end, CATENATION,
+                                     'postprocess', {'pair': d_path})
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+"""
+    "scheduler.py", by Sean Soderman
+    Runs MuTect jobs, admitting a new process only when both a CPU slot and
+    enough physical memory for its Java heap are free.
+"""
+from collections import namedtuple
+import glob
+import math
+import multiprocessing
+import os
+import subprocess
+import threading
+import time
+from tracing import SLOTS
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+"""
+Memory (in megabytes) a JVM uses beyond its heap: metaspace, code cache,
+thread stacks and garbage collector bookkeeping.
+"""
+JVM_OVERHEAD = 512
+
+"""
+Heaps are rounded up to a multiple of this many megabytes.
+"""
+HEAP_STEP = 256
+
+
+"""
+Parses /proc/meminfo. Returns a dictionary of field: size in megabytes.
+"""
+def meminfo():
+    info = {}
+    with open('/proc/meminfo', 'r') as mem:
+        for line in mem:
+            field, value = line.split(':', 1)
+            info[field] = int(value.split()[0]) // 1024
+    return info
+
+
+"""
+Returns the physical memory (in megabytes) available to new processes
+without swapping. Kernels older than 3.14 have no MemAvailable, so the
+free, buffer and page cache memory is used instead.
+"""
+def available_memory():
+    info = meminfo()
+    if 'MemAvailable' in info:
+        return info['MemAvailable']
+    return info['MemFree'] + info.get('Buffers', 0) + info.get('Cached', 0)
+
+
+"""
+Returns the resident set size (in megabytes) of a live process, or 0 if it
+has already exited.
+"""
+def rss(pid):
+    try:
+        with open('/proc/{}/status'.format(pid), 'r') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    return 0
+
+
+"""
+Parses a kernel CPU list such as "0-3,8-11". Returns a list of CPU numbers.
+"""
+def parse_cpulist(cpulist):
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part != '':
+            cpus.append(int(part))
+    return cpus
+
+
+"""
+Returns the CPUs this process may run on, in order.
+"""
+def allowed_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith('Cpus_allowed_list:'):
+                    return parse_cpulist(line.split(':', 1)[1])
+    except IOError:
+        pass
+    return list(range(multiprocessing.cpu_count()))
+
+
+"""
+Returns the CPUs of each NUMA node, as listed under /sys/devices/system/node.
+Machines without NUMA information are treated as a single node.
+"""
+def numa_nodes():
+    nodes = []
+    for path in sorted(glob.glob('/sys/devices/system/node/node*/cpulist')):
+        with open(path, 'r') as cpulist:
+            nodes.append(parse_cpulist(cpulist.read()))
+    return nodes
+
+
+"""
+Splits a list of CPUs into n near-equal disjoint sets. If there are fewer
+CPUs than sets, CPUs are shared round robin.
+"""
+def split_cpus(cpus, n):
+    if len(cpus) < n:
+        return [[cpus[i % len(cpus)]] for i in range(n)]
+    size, extra = divmod(len(cpus), n)
+    sets = []
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(cpus[start:end])
+        start = end
+    return sets
+
+
+"""
+Partitions the CPUs this process may use into one set per scheduler slot.
+With numa, slots are dealt out across NUMA nodes and no set spans a node
+boundary.
+"""
+def partition(slots, numa=False):
+    allowed = allowed_cpus()
+    groups = [allowed]
+    if numa:
+        nodes = [[c for c in node if c in allowed] for node in numa_nodes()]
+        nodes = [node for node in nodes if node]
+        if nodes:
+            groups = nodes
+    per_group = [slots // len(groups) + (1 if i < slots % len(groups) else 0)
+                 for i in range(len(groups))]
+    sets = []
+    for group, count in zip(groups, per_group):
+        if count > 0:
+            sets.extend(split_cpus(group, count))
+    return sets
+
+
+"""
+Returns JVM options capping the garbage collector and JIT compiler threads
+of a JVM confined to the given number of CPUs. Left to itself, every JVM
+sizes these to all of the machine's cores.
+"""
+def jvm_caps(threads):
+    return '-XX:ParallelGCThreads={} -XX:CICompilerCount={}'.format(
+        max(1, threads), max(2, threads // 2))
+
+
+"""
+Pulls items from an iterable in a background thread, keeping at most
+window of them ready. The iterable's own work (for Synchrom.commands,
+creating output directories and reading BAM indices) then overlaps with
+the running jobs instead of stalling the scheduler, while the number of
+jobs held in memory stays bounded however large the cohort is.
+Exceptions raised by the iterable are re-raised by the generator.
+"""
+def prefetch(iterable, window):
+    queue = Queue(maxsize=max(1, window))
+    done = object()
+
+    def fill():
+        try:
+            for item in iterable:
+                queue.put((item, None))
+        except Exception as E:
+            queue.put((done, E))
+            return
+        queue.put((done, None))
+
+    filler = threading.Thread(target=fill)
+    filler.daemon = True
+    filler.start()
+    while True:
+        item, error = queue.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
+"""
+Signs in a MuTect log that the JVM ran out of heap.
+"""
+OOM_SIGNS = ('java.lang.OutOfMemoryError', 'GC overhead limit exceeded')
+
+"""
+How much of the end of an attempt's log is searched for OOM_SIGNS.
+"""
+LOG_TAIL = 65536
+
+"""
+Seconds a timed out process is given to exit before it is killed.
+"""
+GRACE = 10
+
+
+"""
+Whether a finished MuTect process ran out of memory: either the JVM
+reported an OutOfMemoryError in its log, or the process was SIGKILLed
+(exit status 137 from a shell, -9 from Popen), as the kernel's OOM
+killer does. Logs are appended to by every attempt of a job, so only the
+output past offset, where the process's attempt started, is searched.
+"""
+def out_of_memory(status, logpath, offset=0):
+    if status in (137, -9):
+        return True
+    try:
+        with open(logpath, 'rb') as log:
+            log.seek(0, os.SEEK_END)
+            log.seek(max(offset, log.tell() - LOG_TAIL))
+            tail = log.read().decode('ascii', 'replace')
+    except IOError:
+        return False
+    return any(sign in tail for sign in OOM_SIGNS)
+
+
+"""
+Collects a process if it has exited, without waiting for it. Returns None
+if it is still running, or else its exit status (negated signal number if
+it was killed by one, as Popen does) and its resource usage, as reported
+by os.wait4.
+"""
+def collect(proc):
+    try:
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+    except OSError:
+        #Somebody else reaped it; there is no usage left to report.
+        status = proc.poll()
+        return None if status is None else (status, None)
+    if pid == 0:
+        return None
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, usage
+
+
+"""
+A job that is currently running, along with the memory it was admitted
+for, the slot it occupies, when it started, its log file and the offset
+in the log at which this attempt's output starts.
+"""
+Running = namedtuple('Running', ['tid', 'job', 'proc', 'footprint', 'slot',
+                                 'started', 'log', 'log_start'])
+
+
+class Scheduler(object):
+    """
+    Admission-control scheduler and supervisor for MuTect processes. At
+    most slots processes run at once, and a new one is only started when
+    the memory available, less the heap that running JVMs have yet to grow
+    into, leaves room for its heap, JVM_OVERHEAD and reserve megabytes on
+    top. Heaps are sized between min_mem and mem gigabytes by the relative
+    weight of each job's shard. If cpusets (one list of CPUs per slot, see
+    partition) is given, each process is pinned to the CPUs of its slot.
+
+    Each process writes its output to the job's log file rather than into
+    Python's memory. Processes running longer than timeout seconds are
+    stopped, and jobs that run out of memory are retried up to retries
+    times, doubling their heap each time up to max_mem gigabytes. If
+    accounting (see accounting.Accounting) is given, the resources each
+    process used are recorded there as it is reaped, and if tracer (see
+    tracing.Tracer) is, each process is a span on its slot's track.
+    """
+    def __init__(self, slots, mem, min_mem=1, reserve=1024, poll=0.5,
+                 cpusets=None, timeout=None, retries=2, max_mem=None,
+                 accounting=None, tracer=None):
+        self.slots = max(1, slots)
+        self.mem = mem * 1024
+        self.min_mem = min(min_mem * 1024, self.mem)
+        self.max_mem = max(self.mem, (max_mem or 2 * mem) * 1024)
+        self.reserve = reserve
+        self.poll = poll
+        self.cpusets = cpusets
+        self.timeout = timeout
+        self.retries = retries
+        self.accounting = accounting
+        self.tracer = tracer
+        #Slots that never run anything still show up in the trace.
+        if tracer is not None:
+            for slot in range(self.slots):
+                tracer.name_track((SLOTS, slot))
+        self.free_slots = list(range(self.slots))
+        #Jobs waiting to be retried, ahead of any new ones.
+        self.retry_queue = []
+        #Maps pid: Running tuple.
+        self.running = {}
+
+    """
+    Sizes the Java heap (in megabytes) of a job by the weight of its shard.
+    """
+    def heap_size(self, job):
+        heap = self.min_mem + (self.mem - self.min_mem) * job.scale
+        heap = int(math.ceil(heap / float(HEAP_STEP))) * HEAP_STEP
+        return max(self.min_mem, min(self.mem, heap))
+
+    """
+    Returns the memory (in megabytes) a job will need once its heap is full.
+    """
+    def footprint(self, job):
+        return job.heap + JVM_OVERHEAD
+
+    """
+    Whether a job can be started now. A job is always admitted when nothing
+    else is running, so that a single oversized job cannot stall the run.
+    Without a job, tells whether one with the smallest heap could be.
+    """
+    def admissible(self, job=None):
+        if not self.running:
+            return True
+        if not self.free_slots:
+            return False
+        #Running JVMs will keep growing until they reach their footprint.
+        pending = sum(max(0, r.footprint - rss(pid))
+                      for pid, r in self.running.items())
+        free = available_memory() - pending - self.reserve
+        if job is None:
+            return free >= self.min_mem + JVM_OVERHEAD
+        return free >= self.footprint(job)
+
+    """
+    Starts a job in a free slot, pinned to the slot's CPUs if there are
+    CPU sets, with its output going to the job's log file.
+    Returns the Popen object.
+    """
+    def launch(self, tid, job):
+        slot = self.free_slots.pop(0)
+        argv = job.argv()
+        preexec = None
+        if self.cpusets:
+            cpus = self.cpusets[slot]
+            if hasattr(os, 'sched_setaffinity'):
+                preexec = lambda: os.sched_setaffinity(0, cpus)
+            else:
+                argv = ['taskset', '-c', ','.join(map(str, cpus))] + argv
+        log = open(job.log, 'a')
+        log.write('Attempt {}: {}\n'.format(job.attempts + 1, job))
+        log.flush()
+        #Taken before the process shares the file, and moves its offset.
+        start = log.tell()
+        proc = subprocess.Popen(argv, stdout=log, stderr=subprocess.STDOUT,
+                                preexec_fn=preexec)
+        self.running[proc.pid] = Running(tid, job, proc, self.footprint(job),
+                                         slot, time.time(), log, start)
+        return proc
+
+    """
+    Stops processes that have run past the timeout: first asking them to
+    exit, then killing them if they haven't after GRACE seconds.
+    """
+    def enforce_timeouts(self):
+        if not self.timeout:
+            return
+        now = time.time()
+        for r in self.running.values():
+            elapsed = now - r.started
+            if elapsed > self.timeout + GRACE:
+                r.proc.kill()
+            elif elapsed > self.timeout and not r.job.timed_out:
+                r.job.timed_out = True
+                r.proc.terminate()
+
+    """
+    Stops the process of a job, if it is running. Returns whether it was.
+    """
+    def stop(self, tid):
+        for r in list(self.running.values()):
+            if r.tid == tid:
+                r.proc.terminate()
+                return True
+        return False
+
+    """
+    Whether a finished job should be run again with a bigger heap, which is
+    the case when it ran out of memory, has retries left and the heap can
+    still grow. If so, the job's heap is doubled (up to max_mem). log_start
+    is where the attempt's output starts in the job's log.
+    """
+    def retry(self, job, status, log_start=0):
+        if job.timed_out or job.attempts > self.retries:
+            return False
+        if (job.heap >= self.max_mem
+                or not out_of_memory(status, job.log, log_start)):
+            return False
+        job.heap = min(self.max_mem, 2 * job.heap)
+        return True
+
+    """
+    Collects the jobs that have finished, queueing those that ran out of
+    memory to be retried, and accounts for every process collected. Returns
+    a list of (job id, job, exit status) tuples for the rest.
+    """
+    def reap(self):
+        done = []
+        for pid, r in list(self.running.items()):
+            finished = collect(r.proc)
+            if finished is None:
+                continue
+            status, usage = finished
+            del self.running[pid]
+            self.free_slots.append(r.slot)
+            r.log.close()
+            r.job.attempts += 1
+            ended = time.time()
+            r.job.wall = ended - r.started
+            #A retry grows the heap, so the one it ran with is kept.
+            heap = r.job.heap
+            retried = status != 0 and self.retry(r.job, status,
+                                                 r.log_start)
+            if self.accounting is not None:
+                self.accounting.record(r.tid, r.job, r.slot, r.started, heap,
+                                       status, usage, retried)
+            if self.tracer is not None:
+                self.tracer.complete(r.job.name, r.started, ended,
+                                     (SLOTS, r.slot), 'mutect',
+                                     {'job': r.tid, 'pair': list(r.job.pair),
+                                      'intervals': r.job.intervals,
+                                      'heap': heap, 'status': status,
+                                      'attempt': r.job.attempts,
+                                      'retried': retried})
+            if retried:
+                print('Job {} ran out of memory, retrying with a {}m heap'
+                      .format(r.tid, r.job.heap))
+                self.retry_queue.append((r.tid, r.job))
+                continue
+            done.append((r.tid, r.job, status))
+        return done
+
+    """
+    Runs every job from an iterable of (job id, job) tuples, such as
+    izip(count(), synchrom.commands). The iterable is consumed lazily, one
+    job at a time as they are admitted. A job of None is skipped, which also
+    lets an iterable with nothing to offer yet hand back control so that
+    running jobs keep being supervised.
+    Yields (job id, job, exit status) tuples as jobs finish for good.
+    """
+    def run(self, jobs):
+        jobs = iter(jobs)
+        waiting = None
+        exhausted = False
+        while (not exhausted or waiting is not None or self.running
+               or self.retry_queue):
+            if waiting is None and self.retry_queue:
+                waiting = self.retry_queue.pop(0)
+            elif waiting is None and not exhausted:
+                try:
+                    waiting = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    continue
+                #Synchrom yields None for pairs it could not handle, and a
+                #worker when there is no work to hand out yet.
+                if waiting[1] is None:
+                    waiting = None
+                else:
+                    waiting[1].heap = self.heap_size(waiting[1])
+            if waiting is not None and self.admissible(waiting[1]):
+                self.launch(*waiting)
+                waiting = None
+                continue
+            self.enforce_timeouts()
+            for result in self.reap():
+                yield result
+            time.sleep(self.poll)
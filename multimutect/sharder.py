@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+    "sharder.py", by Sean Soderman
+    Splits a reference into near-equal units of MuTect work ("shards"),
+    using contig lengths and the mapped read counts kept in BAM indices.
+"""
+from collections import namedtuple
+import math
+import os
+
+
+class Shard(namedtuple('Shard', ['name', 'contig', 'start', 'end', 'weight'])):
+    """
+    A 1-based, inclusive region of a single contig along with an estimate
+    of how much work MuTect will need to do on it. name is the name of the
+    shard's VCF fragment, sans extension.
+    """
+    __slots__ = ()
+
+    @property
+    def length(self):
+        return self.end - self.start + 1
+
+    @property
+    def interval(self):
+        """The region in the form accepted by --intervals."""
+        return '{}:{}-{}'.format(self.contig, self.start, self.end)
+
+
+class Batch(namedtuple('Batch', ['name', 'shards', 'listfile'])):
+    """
+    Several consecutive shards run by a single MuTect process through an
+    interval list file (listfile), producing a single VCF fragment.
+    """
+    __slots__ = ()
+
+    @property
+    def weight(self):
+        return sum(s.weight for s in self.shards)
+
+    @property
+    def length(self):
+        return sum(s.length for s in self.shards)
+
+    @property
+    def interval(self):
+        """Interval lists are passed to --intervals in place of a region."""
+        return self.listfile
+
+
+"""
+Sums several contig: count dictionaries (e.g. tumor and normal), ignoring
+any that are None. Returns None if no counts were available at all.
+"""
+def merge_counts(*counts):
+    merged = None
+    for count in counts:
+        if count is None:
+            continue
+        if merged is None:
+            merged = {}
+        for contig, mapped in count.items():
+            merged[contig] = merged.get(contig, 0) + mapped
+    return merged
+
+
+"""
+Estimates the work for each contig. MuTect pays both for walking the
+reference and for every read it piles up, so a contig's weight blends its
+length with its share of mapped reads, scaled so that a contig at the
+genome-wide mean read density weighs exactly its length in bases.
+Without read counts the weight is simply the length.
+"""
+def contig_weights(contigs, lengths, mapped=None):
+    total_len = float(sum(lengths))
+    total_reads = sum(mapped.get(c, 0) for c in contigs) if mapped else 0
+    if total_reads == 0 or total_len == 0:
+        return list(map(float, lengths))
+    mean_density = total_reads / total_len
+    weights = []
+    for contig, length in zip(contigs, lengths):
+        reads = mapped.get(contig, 0)
+        weights.append((length + reads / mean_density) / 2.0)
+    return weights
+
+
+"""
+Splits the reference into shards of roughly equal weight.
+contigs and lengths are parallel sequences, as in AlignmentFile.references
+and AlignmentFile.lengths; mapped is an optional contig: mapped reads dict.
+The target weight of a shard is shard_size (in bases at mean coverage), or
+the total weight divided by target_shards. If neither is given, each
+contig becomes a single shard.
+Returns the shards in reference order.
+"""
+def plan(contigs, lengths, mapped=None, shard_size=None, target_shards=None):
+    weights = contig_weights(contigs, lengths, mapped)
+    target = None
+    if shard_size:
+        target = float(shard_size)
+    elif target_shards:
+        target = sum(weights) / target_shards
+    shards = []
+    for contig, length, weight in zip(contigs, lengths, weights):
+        pieces = 1
+        if target and length > 0:
+            pieces = min(length, max(1, int(math.ceil(weight / target))))
+        #Whole contigs keep their plain name as a fragment name.
+        if pieces == 1:
+            shards.append(Shard(contig, contig, 1, length, weight))
+            continue
+        step = int(math.ceil(length / float(pieces)))
+        for start in range(1, length + 1, step):
+            end = min(start + step - 1, length)
+            name = '{}_{}-{}'.format(contig, start, end)
+            shards.append(Shard(name, contig, start, end,
+                                weight * (end - start + 1) / length))
+    return shards
+
+
+"""
+Separates shards on contigs without a single mapped read from the rest,
+as MuTect has nothing to call there. Nothing is skipped when there are no
+read counts to go by.
+Returns a tuple of (kept shards, skipped shards), both in reference order.
+"""
+def skip_empty(shards, mapped=None):
+    if mapped is None:
+        return list(shards), []
+    kept, skipped = [], []
+    for shard in shards:
+        if mapped.get(shard.contig, 0) > 0:
+            kept.append(shard)
+        else:
+            skipped.append(shard)
+    return kept, skipped
+
+
+"""
+Merges consecutive units (shards or batches) into a single batch whose
+interval list is placed in filedir. A lone unit is returned as is.
+"""
+def merge(units, filedir):
+    if len(units) == 1:
+        return units[0]
+    shards = []
+    for unit in units:
+        shards.extend(unit.shards if isinstance(unit, Batch) else [unit])
+    name = '{}..{}'.format(shards[0].name, shards[-1].name)
+    return Batch(name, tuple(shards), os.path.join(filedir, name + '.intervals'))
+
+
+"""
+Whether a shard covers its whole contig, rather than being a piece plan
+cut from a larger one.
+"""
+def whole_contig(shard):
+    return shard.name == shard.contig
+
+
+"""
+Coalesces runs of consecutive whole contigs lighter than pack_size into
+batches of at most pack_size total weight, so that small contigs (decoys,
+alts, unplaced scaffolds...) share one JVM instead of each paying its
+startup. The pieces of split contigs are never packed, so a shard_size or
+target_shards below pack_size still takes effect. Only neighbouring shards
+are packed together, which keeps each batch's fragment in reference order
+for catenation. Interval list files for the batches are placed in
+filedir, but are not written here.
+Returns a list of shards and batches in reference order.
+"""
+def pack(shards, pack_size, filedir):
+    units = []
+    run = []
+    run_weight = 0.0
+    for shard in shards:
+        if (not pack_size or shard.weight >= pack_size
+                or not whole_contig(shard)):
+            if run:
+                units.append(merge(run, filedir))
+                run = []
+            units.append(shard)
+            continue
+        if run and run_weight + shard.weight > pack_size:
+            units.append(merge(run, filedir))
+            run = []
+        if not run:
+            run_weight = 0.0
+        run.append(shard)
+        run_weight += shard.weight
+    if run:
+        units.append(merge(run, filedir))
+    return units
+
+
+"""
+Groups every per_job consecutive units (shards or packed batches) into a
+batch run by a single MuTect process, amortizing the JVM startup,
+reference indexing and BAM header parsing across them.
+Returns a list of shards and batches in reference order.
+"""
+def group(units, per_job, filedir):
+    if per_job <= 1:
+        return list(units)
+    return [merge(units[i:i + per_job], filedir)
+            for i in range(0, len(units), per_job)]
+
+
+"""
+Picks the number of units per job that keeps the fixed cost of a MuTect
+job (overhead, in seconds) at or below fraction of the job's runtime,
+given the measured cost in seconds of a base at mean coverage.
+"""
+def auto_per_job(units, overhead, base_cost, fraction=0.05):
+    if not units or base_cost <= 0:
+        return 1
+    mean_weight = sum(u.weight for u in units) / float(len(units))
+    unit_time = mean_weight * base_cost
+    if unit_time <= 0:
+        return len(units)
+    needed = overhead * (1 - fraction) / (fraction * unit_time)
+    return max(1, min(len(units), int(math.ceil(needed))))
+
+
+"""
+Writes the interval list file of a batch, one region per line.
+"""
+def write_intervals(batch):
+    with open(batch.listfile, 'w') as listfile:
+        listfile.write(os.linesep.join(s.interval for s in batch.shards))
+        listfile.write(os.linesep)
+
+
+"""
+Orders shards (or batches) heaviest first, so that the longest-running
+jobs start early and the small ones fill in the gaps at the end of a run.
+"""
+def longest_first(shards):
+    return sorted(shards, key=lambda s: s.weight, reverse=True)
@@ -7,17 +7,15 @@
 import os
 import re
 import sys
-#Same as in mapqto0.py: Check for any package problems concerning pysam.
-for i in range(0, len(sys.path)):
-    traversed = []
-    for dirpath, dirnames, filenames in os.walk(sys.path[i]):
-        for dir in dirnames:
-            if 'pysam' == dir and not dirpath.endswith('site-packages'):
-                if dirpath not in traversed:
-                    sys.path.append(sys.path.pop(i))
-                    traversed.append(dirpath)
 try:
-    from pysam import AlignmentFile
+    from fragments import validate
+    from job import Job
+    from scheduler import jvm_caps
+    from seqcache import SeqCache, order_problem
+    from sharder import (Batch, auto_per_job, group, longest_first,
+                         merge_counts, pack, plan, skip_empty,
+                         write_intervals)
+    from tracing import SETUP, span
 except ImportError as I:
     sys.stderr.write('Please install the required modules: {}'
                      .format(I))
@@ -28,7 +26,8 @@ class Synchrom():
     Standard command template utilized when processing a chromosome at a time
     (using threads).
     """
-    cmd_template = ('java -Xmx{mem}g -jar {mupath} --analysis_type MuTect'
+    cmd_template = ('java -Xmx{mem}g {jvmopts} -jar {mupath}'
+    ' --analysis_type MuTect'
     ' --showFullBamList --reference_sequence {fasta} {{normal}} {{tumor}}'
     ' --intervals %s -vcf {{filedir}}%s {mutectopts}')
 
@@ -36,10 +35,39 @@ class Synchrom():
     Nonstandard command template used when processing entire BAM files at 
     a time. As such, omits the --intervals option.
     """
-    ntcmd_template = ('java -Xmx{mem}g -jar {mupath} --analysis_type MuTect'
+    ntcmd_template = ('java -Xmx{mem}g {jvmopts} -jar {mupath}'
+    ' --analysis_type MuTect'
     ' --showFullBamList --reference_sequence {fasta} {{normal}} {{tumor}}'
     ' -vcf {{filepath}} {mutectopts}')
 
+    """
+    Sharding parameters: the target weight of a single shard, or the number
+    of shards each pair's genome should be split into. See sharder.plan.
+    """
+    shard_size = None
+    target_shards = None
+
+    """
+    Shards lighter than this are packed together with their neighbours
+    into batches run by a single MuTect process. See sharder.pack.
+    """
+    pack_size = 0
+
+    """
+    The number of shards (or packed batches) run by each MuTect process,
+    or 'auto' to pick it for each pair from job_overhead, the measured
+    fixed cost of a job in seconds, and base_cost, the measured cost in
+    seconds of a single base. See sharder.group and sharder.auto_per_job.
+    """
+    intervals_per_job = 1
+    job_overhead = 0.0
+    base_cost = 0.0
+
+    """
+    The source of the tumor:normal pairs, as arguments to get_pairs.
+    """
+    sample_pairs = ()
+
     """
     The name of the directory that will contain the output directories.
     Also, the name of the directory containing the input files.
@@ -48,12 +76,25 @@ class Synchrom():
     outputdir = str()
 
     """
-    Generator that retrieves commands by reading tumor:normal
-    pairs.
+    Whether an interrupted run is being resumed. Pairs whose catenated VCF
+    is already complete are then left alone.
+    """
+    resume = False
+
+    """
+    Generator that retrieves commands (as Job objects) by reading
+    tumor:normal pairs.
     """
     commands = object()
 
-    def __init__(self, cmd_args):
+    """
+    The tracer (see tracing.Tracer) the building of commands and the BAM
+    files opened for it are timed with, if any.
+    """
+    tracer = None
+
+    def __init__(self, cmd_args, tracer=None):
+        self.tracer = tracer
         fasta = cmd_args.fasta
         mu_opts = ''
         if cmd_args.conf != '':
@@ -71,85 +112,88 @@ class Synchrom():
         mupath = cmd_args.mupath
         mem = cmd_args.mem
         #Insert the stuff that won't change into the cmd template.
+        #JVM thread caps, so concurrent MuTects don't each size their
+        #garbage collector and compiler to the whole machine.
+        jvmopts = jvm_caps(cmd_args.jvm_threads)
         self.cmd_template = self.cmd_template.format(mem=mem,
+                                                     jvmopts=jvmopts,
                                                      fasta=fasta, 
                                                      mutectopts=mu_opts,
                                                      mupath=mupath)
         self.ntcmd_template = self.ntcmd_template.format(mem=mem,
+                                                         jvmopts=jvmopts,
                                                          fasta=fasta, 
                                                          mutectopts=mu_opts,
                                                          mupath=mupath)
         self.outputdir = cmd_args.outputdir
         self.inputdir = cmd_args.inputdir
+        self.shard_size = cmd_args.shard_size
+        self.target_shards = cmd_args.target_shards
+        self.pack_size = cmd_args.pack_size
+
+        self.intervals_per_job = cmd_args.intervals_per_job
+        self.resume = cmd_args.resume
+        #BAM headers and index statistics, kept between runs.
+        self.cache = SeqCache(cmd_args.cache_dir)
+        with span(tracer, 'reference', SETUP, 'setup', {'path': fasta}):
+            self.reference = self.cache.reference(fasta)
 
         if cmd_args.bamlistfile is not None:
-            self.commands = self.get_command(cmd_args.bamlistfile, 
-                                             cmd_args.process_whole_bam,
-                                             infile=True)
+            self.sample_pairs = (cmd_args.bamlistfile, True)
         else:
-            self.commands = self.get_command(cmd_args.pairs, 
-                                            cmd_args.process_whole_bam)
+            self.sample_pairs = (cmd_args.pairs, False)
+        self.commands = self.get_command(self.sample_pairs[0],
+                                         cmd_args.process_whole_bam,
+                                         infile=self.sample_pairs[1])
         #Create generator for default case if processing files 
         #by chromosome segments at a time.
         if not cmd_args.process_whole_bam:
-            cmd_copy = self.commands
-            tumorbam = ''
-            line = ''
-            #Get the path to the tumor BAM file so protogen can create
-            #a list of chromosomes.
-            if cmd_args.bamlistfile is not None:
-                with open(cmd_args.bamlistfile) as listfile:
-                    line = listfile.readline().strip()
-                    #Skip any header lines
-                    while not re.search('.*bam', line):
-                        line = listfile.readline().strip()
-                    tumorbam = line.split()[0]
-            else:
-                tumorbam = cmd_args.pairs[0].split(':')[0]
-
-            tumorbam = os.path.join(self.inputdir, tumorbam)
-            self.commands = self.protogen(tumorbam, cmd_copy)
+            self.commands = self.protogen(self.commands)
 
     """
     Generator for default case. Creates n commands for each file, where
-    n = the number of chromosomes * the number of files.
-    Currently, composes the generator from get_command. May not
-    need to do this, but right now it feels natural..
-    """
-    def protogen(self, tumorbam, cmdgen):
-        chrlist = None
-        with AlignmentFile(tumorbam, 'rb') as bamfile:
-            chrlist = bamfile.references
-        cont = True
-        cmd = ''
-        while cont:
-            try:
-                cmd = cmdgen.next()
-            except StopIteration:
-                cont = False
+    n = the number of shards (or batches of them) planned for that
+    tumor:normal pair.
+    Composes the generator from get_command, which yields each pair's
+    command template along with its shards. Shards are emitted heaviest
+    first so the stragglers start early.
+    """
+    def protogen(self, cmdgen):
+        for built in cmdgen:
+            #get_command yields None for pairs it could not handle.
+            if built is None:
                 continue
-            for i in range(0, len(chrlist)):
-                yield cmd % (chrlist[i], chrlist[i] + '.vcf')
+            (cmd, pair, filedir), shards = built
+            shards = longest_first(shards)
+            heaviest = shards[0].weight if shards else 0
+            total = sum(s.weight for s in shards)
+            for shard in shards:
+                scale = shard.weight / heaviest if heaviest else 1.0
+                share = shard.weight / total if total else 1.0
+                vcf = shard.name + '.vcf'
+                yield Job(cmd % (shard.interval, vcf), pair,
+                          self.input_paths(pair), filedir + vcf, shard, scale,
+                          len(shards), share)
 
     """
-    Parses a file or cmd line list into tumor:normal pairs. 
-    Returns a single command. Must be surrounded in a StopIteration
-    try/except. Returns None when a file isn't found or there is no
-    tumor sample in the pair.
+    Parses a file or cmd line list into tumor:normal pairs.
+    Yields (tumor, normal) tuples, or None when a file isn't found or there
+    is no tumor sample in the pair.
     """
-    def get_command(self, sample_pairs, whole, infile=False):
+    def get_pairs(self, sample_pairs, infile=False):
         err_str = 'Error: argument|line {} has no tumor filename.\n'
         line_number = 0
         pairsep = ':'
         if infile == True:
             try:
                 sample_pairs = open(sample_pairs, 'r')
-                pairsep = '\s+'
+                pairsep = r'\s+'
             except IOError:
-                sys.stderr.write(('get_command' 
+                sys.stderr.write(('get_pairs' 
                                   ' could not open file {}\n'
                                  ).format(sample_pairs))
                 yield None
+                return
         for pair in sample_pairs:
             #Skip header line
             if not re.search('.*bam', pair):
@@ -161,14 +205,71 @@ class Synchrom():
                 sys.stderr.write(err_str.format(line_number))
                 yield None
             line_number += 1
-            if not whole:
-                yield self.build_command( (tumor, normal) )
-            else:
-                yield self.build_ntcommand( (tumor, normal))
+            yield (tumor, normal)
         #Once all samples have been processed, close the listing file.
         if infile == True:
             sample_pairs.close()
 
+    """
+    Turns each tumor:normal pair into work for it, a pair at a time. With
+    whole, yields a Job per pair; otherwise yields build_command's
+    (command template, pair, output directory) and shards, which protogen
+    turns into a Job per shard. Yields None for pairs get_pairs could not
+    handle, for pairs already catenated when resuming and for pairs whose
+    BAM files don't match the reference. Consumers skip the Nones and
+    simply stop when the generator ends.
+    """
+    def get_command(self, sample_pairs, whole, infile=False):
+        for pair in self.get_pairs(sample_pairs, infile):
+            if pair is None:
+                yield None
+            elif not whole:
+                with span(self.tracer, 'build_command', SETUP, 'setup',
+                          {'pair': list(pair)}):
+                    built = self.build_command(pair)
+                yield built
+            else:
+                with span(self.tracer, 'build_ntcommand', SETUP, 'setup',
+                          {'pair': list(pair)}):
+                    cmd, outfile = self.build_ntcommand(pair)
+                yield Job(cmd, pair, self.input_paths(pair), outfile)
+
+    """
+    Returns the paths of the input BAM files of a tumor:normal pair.
+    """
+    def input_paths(self, sample_pair):
+        return [os.path.join(self.inputdir, os.path.basename(bam))
+                for bam in sample_pair if bam != '']
+
+    """
+    Builds the two commands used to calibrate the automatic batch size,
+    using the first tumor:normal pair: one running MuTect on a single base
+    (measuring the fixed cost of a job) and one running it on probe_bases
+    bases from the middle of the longest contig. Output goes to probedir.
+    Returns the two commands and the number of bases in the second.
+    """
+    def probe_commands(self, probedir, probe_bases=1000000):
+        tumor, normal = next(p for p in self.get_pairs(*self.sample_pairs)
+                             if p is not None)
+        tumor = os.path.join(self.inputdir, os.path.basename(tumor))
+        if normal != '':
+            normal = os.path.join(self.inputdir, os.path.basename(normal))
+            normal = '--input_file:normal ' + normal
+        tumbam = self.open_bam(tumor)
+        longest = max(range(len(tumbam.lengths)),
+                      key=lambda i: tumbam.lengths[i])
+        contig = tumbam.references[longest]
+        length = tumbam.lengths[longest]
+        start = max(1, length // 2)
+        end = min(length, start + probe_bases - 1)
+        cmd = self.cmd_template.format(normal=normal,
+                                       tumor='--input_file:tumor ' + tumor,
+                                       filedir=os.path.join(probedir, ''))
+        overhead_cmd = cmd % ('{}:{}-{}'.format(contig, start, start),
+                              'overhead.vcf')
+        work_cmd = cmd % ('{}:{}-{}'.format(contig, start, end), 'work.vcf')
+        return overhead_cmd, work_cmd, end - start + 1
+
     """
     Retrieves a single command corresponding to the tumor:normal
     pair fetched from the file or command line with get_pair.
@@ -178,7 +279,14 @@ class Synchrom():
     them a part of the original command.
 
     Side effects: Creates an output directory for each BAM file pair.
-    Also creates a file 'chrs.list' in the output directory.
+    Also creates a file 'chrs.list' in the output directory, listing the
+    pair's VCF fragments in reference order, an interval list file for
+    each batch of packed or grouped shards and a 'skipped.list' of empty
+    contigs.
+    Returns the command, the pair and its output directory, along with the
+    pair's shards. When resuming, returns None for a pair whose fragments
+    were already catenated (and cleaned up). Also returns None for a pair
+    whose BAM files don't follow the reference's contigs (see mismatch).
     """
     def build_command(self, sample_pair):
         tumor, normal = sample_pair
@@ -186,6 +294,7 @@ class Synchrom():
         #creation.
         tumor_dir, normal_dir = map(os.path.basename, sample_pair)
         filedir = ""
+        normbam = None
         #The directory of vcf files is <tumorbasename>_<normalbasename>,
         #within the parent output directory
         tumdir, normdir = (tumor_dir.split('.bam')[0],
@@ -195,23 +304,84 @@ class Synchrom():
             filedir = os.path.join(self.outputdir, (tumdir + '_' + normdir), '')
             if self.inputdir is not None:
                 normal = os.path.join(self.inputdir, normal_dir)
+            normbam = self.open_bam(normal)
             normal = '--input_file:normal ' + normal
         else:
             filedir = os.path.join(self.outputdir, tumdir, '')
-        os.makedirs(filedir.strip('/'))
+        catenated = [filedir.rstrip(os.sep) + ext
+                     for ext in ('.vcf', '.vcf.gz')]
+        if self.resume and not os.path.isdir(filedir):
+            for path in catenated:
+                if validate(path) is None:
+                    print('Skipping catenated pair: {}'.format(path))
+                    return None
         #No possibility for tumor to equal '' as the calling function
         #handles this case and returns None as a result.
         if self.inputdir is not None:
             tumor = os.path.join(self.inputdir, tumor_dir)
-        #Write the chromosome list to the output directory.
-        with AlignmentFile(tumor, 'rb') as tumbam:
-            with open(os.path.join(filedir, 'chrs.list'), 'w') as chrlist:
-                map(chrlist.write, os.linesep.join(tumbam.references))
+        tumbam = self.open_bam(tumor)
+        if self.mismatch(tumor, tumbam, normbam):
+            return None
+        #The directory is left from an earlier run when resuming.
+        if not os.path.isdir(filedir):
+            os.makedirs(filedir.strip('/'))
+        #Plan the shards and write their fragment names to the output
+        #directory, in the order catenate.py should stitch them back.
+        #Contigs without reads in either sample are left out entirely,
+        #but recorded in 'skipped.list'.
+        mapped = merge_counts(tumbam.mapped,
+                              normbam.mapped if normbam else None)
+        shards = plan(tumbam.references, tumbam.lengths, mapped,
+                      self.shard_size, self.target_shards)
+        shards, skipped = skip_empty(shards, mapped)
+        shards = pack(shards, self.pack_size, filedir)
+        per_job = self.intervals_per_job
+        if per_job == 'auto':
+            per_job = auto_per_job(shards, self.job_overhead, self.base_cost)
+        shards = group(shards, per_job, filedir)
+        for batch in shards:
+            if isinstance(batch, Batch):
+                write_intervals(batch)
+        with open(os.path.join(filedir, 'chrs.list'), 'w') as chrlist:
+            chrlist.write(os.linesep.join(s.name for s in shards))
+        if skipped:
+            with open(os.path.join(filedir, 'skipped.list'), 'w') as skiplist:
+                skiplist.write(os.linesep.join(s.name for s in skipped))
             
         tumor = '--input_file:tumor ' + tumor
         cmd = self.cmd_template.format(normal=normal, tumor=tumor, 
                                        filedir=filedir)
-        return cmd
+        return (cmd, sample_pair, filedir), shards
+
+    """
+    Returns the contigs, lengths and mapped read counts of a BAM file,
+    from the cache if it is up to date.
+    """
+    def open_bam(self, path):
+        with span(self.tracer, 'open ' + os.path.basename(path), SETUP,
+                  'bam', {'path': path}):
+            return self.cache.bam(path)
+
+    """
+    Checks the contigs of a pair's BAM files (SeqInfo tuples from the
+    cache) against the reference's index, or the normal's against the
+    tumor's when the reference has none. MuTect would otherwise fail on
+    every shard of the pair. Returns whether they mismatch, saying why.
+    """
+    def mismatch(self, tumor, tumbam, normbam):
+        problems = []
+        if self.reference is not None:
+            problems.append(order_problem(tumbam, self.reference))
+            if normbam is not None:
+                problems.append(order_problem(normbam, self.reference))
+        elif normbam is not None:
+            problems.append(order_problem(normbam, tumbam))
+        problems = [p for p in problems if p is not None]
+        if problems:
+            sys.stderr.write('Skipping pair of {}: {}. Reorder the BAM files'
+                             ' with reorder_all.py.\n'
+                             .format(tumor, '; '.join(problems)))
+        return bool(problems)
 
     """
     Builds a command intended for the processing of an entire
@@ -219,6 +389,7 @@ class Synchrom():
 
     Side effect: Creates the output directory specified for the vcf
     outputs.
+    Returns the command along with the path of its output VCF.
     """
     def build_ntcommand(self, sample_pair):
         tumor, normal = sample_pair
@@ -241,5 +412,6 @@ class Synchrom():
         if normal != '':
             normal = os.path.join(self.inputdir, normal)
             normal = '--input_file:normal ' + normal
-        return self.ntcmd_template.format(normal=normal, tumor=tumor,
-                                        filepath=outfile)
+        cmd = self.ntcmd_template.format(normal=normal, tumor=tumor,
+                                         filepath=outfile)
+        return cmd, outfile
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+    "tracing.py", by Sean Soderman
+    Writes a timeline of a run (multimutect's --trace) as Chrome trace
+    events, which chrome://tracing and the Perfetto UI can load. Each
+    scheduler slot is a track with a span for every MuTect process it ran,
+    and further tracks hold the building of commands (and the BAM files
+    opened for it) and the post-processing of finished jobs, so idle slots,
+    stragglers and gaps between the stages show up directly.
+"""
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+"""
+The tracks of a trace, as (process, thread) ids: the scheduler's slots
+(a thread per slot), the building of commands, the checking of finished
+jobs' output and the catenation of pairs.
+"""
+SLOTS = 1
+SETUP = (2, 0)
+RESULTS = (3, 0)
+CATENATION = (3, 1)
+
+"""
+The names the tracks are shown with.
+"""
+PROCESS_NAMES = {1: 'MuTect slots', 2: 'Setup', 3: 'Post-processing'}
+THREAD_NAMES = {SETUP: 'Commands', RESULTS: 'Results',
+                CATENATION: 'Catenation'}
+
+
+class Tracer(object):
+    """
+    Collects the spans of a run, from any thread, and writes them to path
+    as a JSON trace once closed. Times are given in seconds since the epoch
+    (as time.time returns them), so spans timed in other processes line up
+    with the rest, and are shown relative to the tracer's creation.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.origin = time.time()
+        self.lock = threading.Lock()
+        self.events = []
+        self.named = set()
+        for pid, name in PROCESS_NAMES.items():
+            self.events.append({'ph': 'M', 'name': 'process_name',
+                                'pid': pid, 'tid': 0, 'args': {'name': name}})
+
+    """
+    Converts a time in seconds since the epoch to the microseconds since
+    the tracer's creation that trace events are timed in.
+    """
+    def micros(self, when):
+        return int(round((when - self.origin) * 1e6))
+
+    """
+    Names a track, the first time it is used.
+    """
+    def name_track(self, track):
+        if track in self.named:
+            return
+        self.named.add(track)
+        name = THREAD_NAMES.get(track)
+        if name is None and track[0] == SLOTS:
+            name = 'Slot {}'.format(track[1])
+        self.events.append({'ph': 'M', 'name': 'thread_name',
+                            'pid': track[0], 'tid': track[1],
+                            'args': {'name': name or str(track[1])}})
+
+    """
+    Adds a span that ran from start to end (in seconds since the epoch) on
+    a track, with a category and a dictionary of details (args) shown when
+    it is selected.
+    """
+    def complete(self, name, start, end, track, category, args=None):
+        event = {'ph': 'X', 'name': name, 'cat': category,
+                 'pid': track[0], 'tid': track[1],
+                 'ts': self.micros(start),
+                 'dur': max(0, self.micros(end) - self.micros(start))}
+        if args:
+            event['args'] = args
+        with self.lock:
+            self.name_track(track)
+            self.events.append(event)
+
+    """
+    Writes the trace, atomically.
+    """
+    def close(self):
+        temp = self.path + '.tmp'
+        with self.lock:
+            with open(temp, 'w') as tracefile:
+                json.dump({'traceEvents': self.events,
+                           'displayTimeUnit': 'ms'}, tracefile)
+        os.rename(temp, self.path)
+
+
+"""
+Times the code in a with block as a span of a tracer (see
+Tracer.complete). Does nothing if tracer is None, so callers needn't
+check.
+"""
+@contextmanager
+def span(tracer, name, track, category, args=None):
+    if tracer is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        tracer.complete(name, start, time.time(), track, category, args)
+
+
+"""
+Calls a function, for a worker process, returning the time it started and
+ended along with its result, so the caller can add the span to its trace.
+"""
+def timed(function, args=(), kwargs=None):
+    start = time.time()
+    result = function(*args, **(kwargs or {}))
+    return start, time.time(), result
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+"""
+    "workqueue.py", by Sean Soderman
+    Spreads multimutect's jobs over several machines through a spool
+    directory on a shared filesystem. multimutect (with --spool) is the
+    coordinator, queueing jobs and collecting their results; this script is
+    the worker run on each machine, which claims queued jobs and runs them
+    with its own scheduler.
+
+    Layout of the spool directory:
+        settings.json       the coordinator's working directory.
+        queue/TID.json      a job waiting for a worker, with its
+                            generation: the number of times it was
+                            requeued.
+        leased/TID.W.json   a job claimed by worker W, who keeps touching
+                            the file. A lease left untouched for too long
+                            is moved back to the queue, as the job's next
+                            generation.
+        done/TID.json       the result of a job, and how long it took.
+        finished            created once every job has a result.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+from accounting import Accounting
+from job import Job
+from scheduler import Scheduler, allowed_cpus, partition
+
+
+"""
+Returns the paths of the spool's subdirectories and files.
+"""
+def spool_paths(spool):
+    return {'queue': os.path.join(spool, 'queue'),
+            'leased': os.path.join(spool, 'leased'),
+            'done': os.path.join(spool, 'done'),
+            'settings': os.path.join(spool, 'settings.json'),
+            'finished': os.path.join(spool, 'finished')}
+
+
+"""
+Writes a JSON record so that readers never see it half written.
+"""
+def write_record(path, record):
+    temp = path + '.tmp'
+    with open(temp, 'w') as recfile:
+        json.dump(record, recfile)
+    os.rename(temp, path)
+
+
+"""
+Returns the job ids of the records (*.json) in a spool subdirectory,
+along with their file names, lowest id first.
+"""
+def records(directory):
+    names = [n for n in os.listdir(directory) if n.endswith('.json')]
+    return sorted((int(n.split('.')[0]), n) for n in names)
+
+
+class Coordinator(object):
+    """
+    Queues jobs in a spool directory and collects the results workers
+    report, keeping at most window jobs queued or running at once. Jobs
+    whose lease hasn't been renewed for lease seconds are requeued, as a
+    new generation of the job: results reported for an earlier generation
+    (by a worker that went quiet, then finished after all) are discarded,
+    so a pair is never catenated while the requeued copy still runs.
+    Can be used in place of a Scheduler.
+    """
+    def __init__(self, spool, window, lease=300, poll=1.0):
+        self.paths = spool_paths(spool)
+        self.window = max(1, window)
+        self.lease = lease
+        self.poll = poll
+        #Maps job id: job, for jobs without a result yet.
+        self.jobs = {}
+        #Maps job id: the generation of the job whose result is awaited.
+        self.generations = {}
+        #Start from a clean spool, in case an earlier run left anything.
+        for key in ('queue', 'leased', 'done'):
+            directory = self.paths[key]
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            for name in os.listdir(directory):
+                os.unlink(os.path.join(directory, name))
+        if os.path.exists(self.paths['finished']):
+            os.unlink(self.paths['finished'])
+        write_record(self.paths['settings'], {'cwd': os.getcwd()})
+
+    def submit(self, tid, job):
+        self.jobs[tid] = job
+        self.generations[tid] = 0
+        path = os.path.join(self.paths['queue'], '{}.json'.format(tid))
+        write_record(path, {'tid': tid, 'job': job.to_record(),
+                            'generation': 0})
+
+    """
+    Moves the jobs of workers that stopped renewing their leases back to
+    the queue.
+    """
+    def expire(self):
+        now = time.time()
+        for tid, name in records(self.paths['leased']):
+            lease = os.path.join(self.paths['leased'], name)
+            try:
+                if now - os.path.getmtime(lease) <= self.lease:
+                    continue
+                #Out of the worker's reach (and no worker can claim it,
+                #without the .json) while its generation is bumped.
+                expired = lease + '.expired'
+                os.rename(lease, expired)
+            except OSError:
+                #The worker finished (or renewed) the job in the meantime.
+                continue
+            with open(expired, 'r') as recfile:
+                record = json.load(recfile)
+            record['generation'] = self.generations.get(tid, 0) + 1
+            self.generations[tid] = record['generation']
+            write_record(os.path.join(self.paths['queue'],
+                                      '{}.json'.format(tid)), record)
+            os.unlink(expired)
+            sys.stderr.write('Lease on job {} expired ({}), requeueing it\n'
+                             .format(tid, name.split('.', 1)[1][:-5]))
+
+    """
+    Collects the results workers have reported. Returns a list of
+    (job id, job, exit status) tuples.
+    """
+    def collect(self):
+        done = []
+        for tid, name in records(self.paths['done']):
+            path = os.path.join(self.paths['done'], name)
+            with open(path, 'r') as resfile:
+                result = json.load(resfile)
+            os.unlink(path)
+            if (tid not in self.jobs or result.get('generation', 0)
+                    != self.generations[tid]):
+                #Late, from a lease that expired; the requeued copy counts.
+                sys.stderr.write('Discarding a late result for job {} from'
+                                 ' {}\n'.format(tid, result['worker']))
+                continue
+            job = self.jobs.pop(tid)
+            del self.generations[tid]
+            for key in ('attempts', 'heap', 'wall', 'timed_out'):
+                setattr(job, key, result[key])
+            print('Job {} ran on {} in {:.1f}s'.format(tid, result['worker'],
+                                                        result['wall']))
+            done.append((tid, job, result['status']))
+        return done
+
+    """
+    Queues every job from an iterable of (job id, job) tuples, as
+    Scheduler.run does. Yields (job id, job, exit status) tuples as
+    workers report them.
+    """
+    def run(self, jobs):
+        jobs = iter(jobs)
+        exhausted = False
+        while not exhausted or self.jobs:
+            while not exhausted and len(self.jobs) < self.window:
+                try:
+                    tid, job = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if job is not None:
+                    self.submit(tid, job)
+            self.expire()
+            for result in self.collect():
+                yield result
+            time.sleep(self.poll)
+        open(self.paths['finished'], 'w').close()
+
+
+class Worker(object):
+    """
+    Claims jobs from a spool directory and runs them with a Scheduler,
+    renewing the leases on its jobs every third of lease seconds and
+    reporting their results back. If a lease is lost (the coordinator
+    gave the job to another worker), the job is stopped, its result
+    discarded and its partial output deleted.
+    """
+    def __init__(self, spool, scheduler, lease=300):
+        self.paths = spool_paths(spool)
+        self.scheduler = scheduler
+        self.lease = lease
+        self.name = '{}-{}'.format(socket.gethostname(), os.getpid())
+        #Maps job id: lease file, for the jobs this worker holds.
+        self.held = {}
+        #Maps job id: the generation of the job held (see Coordinator).
+        self.generations = {}
+        self.lost = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    """
+    Claims the first queued job, by renaming it into the leased directory.
+    Returns a (job id, job) tuple, or None if the queue is empty.
+    """
+    def claim(self):
+        for tid, name in records(self.paths['queue']):
+            lease = os.path.join(self.paths['leased'],
+                                 '{}.{}.json'.format(tid, self.name))
+            try:
+                os.rename(os.path.join(self.paths['queue'], name), lease)
+                #Renaming keeps the mtime of the queued file.
+                os.utime(lease, None)
+            except OSError:
+                #Another worker got there first.
+                continue
+            with open(lease, 'r') as recfile:
+                record = json.load(recfile)
+            with self.lock:
+                self.held[tid] = lease
+                self.generations[tid] = record.get('generation', 0)
+                self.lost.discard(tid)
+            return tid, Job.from_record(record['job'])
+        return None
+
+    """
+    Generator of jobs for the scheduler. Only claims a job when the
+    scheduler has room to start it, so that it never sits leased here
+    while other workers are idle. Yields (None, None) when there is no room
+    or nothing to claim, and stops once the coordinator has finished.
+    """
+    def jobs(self):
+        while True:
+            if self.scheduler.retry_queue or not self.scheduler.admissible():
+                yield None, None
+                continue
+            claimed = self.claim()
+            if claimed is not None:
+                yield claimed
+            elif (os.path.exists(self.paths['finished'])
+                  and not records(self.paths['queue'])):
+                return
+            else:
+                yield None, None
+
+    def heartbeat(self):
+        while not self.stopping.wait(self.lease / 3.0):
+            with self.lock:
+                held = list(self.held.items())
+            for tid, lease in held:
+                try:
+                    os.utime(lease, None)
+                except OSError:
+                    sys.stderr.write('Lost the lease on job {}, stopping it\n'
+                                     .format(tid))
+                    self.lost.add(tid)
+                    self.scheduler.stop(tid)
+
+    """
+    Deletes the partial output of a job whose lease was lost, unless
+    another worker has already claimed (or finished) the requeued copy,
+    which writes to the same file.
+    """
+    def discard(self, tid, job):
+        prefix = '{}.'.format(tid)
+        if any(name.startswith(prefix)
+               for key in ('leased', 'done')
+               for name in os.listdir(self.paths[key])):
+            return
+        if os.path.exists(job.vcf):
+            os.unlink(job.vcf)
+            print('Deleted the partial output of job {}, {}'
+                  .format(tid, job.vcf))
+
+    """
+    Reports the result of a job and releases its lease.
+    """
+    def report(self, tid, job, status):
+        with self.lock:
+            lease = self.held.pop(tid)
+            generation = self.generations.pop(tid)
+        if tid in self.lost:
+            self.discard(tid, job)
+            return
+        result = {'tid': tid, 'status': status, 'attempts': job.attempts,
+                  'heap': job.heap, 'wall': job.wall,
+                  'timed_out': job.timed_out, 'worker': self.name,
+                  'generation': generation}
+        write_record(os.path.join(self.paths['done'], '{}.json'.format(tid)),
+                     result)
+        try:
+            os.unlink(lease)
+        except OSError:
+            pass
+        print('Job {} finished with exit status {}'.format(tid, status))
+
+    """
+    Waits for the coordinator to set up the spool, moves to its working
+    directory (so relative paths in the commands work) and runs jobs until
+    the coordinator has finished.
+    """
+    def run(self, poll=1.0):
+        while not os.path.exists(self.paths['settings']):
+            time.sleep(poll)
+        with open(self.paths['settings'], 'r') as setfile:
+            os.chdir(json.load(setfile)['cwd'])
+        beat = threading.Thread(target=self.heartbeat)
+        beat.daemon = True
+        beat.start()
+        try:
+            for tid, job, status in self.scheduler.run(self.jobs()):
+                self.report(tid, job, status)
+        finally:
+            self.stopping.set()
+            beat.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=('Worker running'
+                                                  ' multimutect jobs from a'
+                                                  ' spool directory'))
+    parser.add_argument('spool', type=str,
+                        help=('The spool directory given to multimutect'
+                              ' with --spool.'))
+    parser.add_argument('--numthreads', type=int,
+                        default=multiprocessing.cpu_count() // 4,
+                        help=('The maximum number of MuTect processes run'
+                              ' at once, memory permitting. Default: The #'
+                              ' of cores on this computer / 4, rounded'
+                              ' down.'))
+    parser.add_argument('--mem', type=int, default=3,
+                        help=('The max amount of memory each forked MuTect'
+                              ' process can allocate on the Java heap'
+                              ' Default: 3'))
+    parser.add_argument('--min_mem', type=int, default=1,
+                        help=('The Java heap (in gigabytes) given to the'
+                              ' lightest shards. Default: 1'))
+    parser.add_argument('--max_mem', type=int,
+                        help=('The largest Java heap (in gigabytes) a job'
+                              ' that ran out of memory is retried with.'
+                              ' Default: twice --mem'))
+    parser.add_argument('--retries', type=int, default=2,
+                        help=('How many times a job that ran out of memory'
+                              ' is retried. Default: 2'))
+    parser.add_argument('--timeout', type=int,
+                        help=('Stop any MuTect process running longer than'
+                              ' this many seconds.'))
+    parser.add_argument('--pin_cpus', action='store_true',
+                        help='Pin the MuTect processes of each slot to its'
+                             ' own set of cores.')
+    parser.add_argument('--numa', action='store_true',
+                        help=('Like --pin_cpus, but no slot\'s set of cores'
+                              ' crosses a NUMA node boundary.'))
+    parser.add_argument('--lease', type=int, default=300,
+                        help=('Seconds after which the coordinator gives a'
+                              ' job to another worker if this one stops'
+                              ' renewing its lease. Must match the'
+                              ' coordinator\'s --lease. Default: 300'))
+    parser.add_argument('--statistics', type=str,
+                        help=('Append the resources each MuTect process'
+                              ' this worker ran used to this file, as'
+                              ' multimutect\'s --statistics does.'))
+    args = parser.parse_args()
+    numthreads = max(1, args.numthreads)
+    cpusets = None
+    if args.pin_cpus or args.numa:
+        cpusets = partition(numthreads, args.numa)
+    accounting = None
+    if args.statistics is not None:
+        accounting = Accounting(args.statistics)
+    scheduler = Scheduler(numthreads, args.mem, args.min_mem,
+                          cpusets=cpusets, timeout=args.timeout,
+                          retries=args.retries, max_mem=args.max_mem,
+                          accounting=accounting)
+    start_time = time.time()
+    try:
+        Worker(args.spool, scheduler, args.lease).run()
+    finally:
+        if accounting is not None:
+            accounting.finish(numthreads, len(allowed_cpus()),
+                              time.time() - start_time, None)
+            accounting.close()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+    "mutools.py", by Sean Soderman
+    A single entry point to the tools of the suite: mutools <tool> [args],
+    where the arguments are those of the tool's own script. Only the
+    script of the tool asked for is loaded, so the others' imports (pysam
+    among them) cost nothing.
+"""
+import os
+import runpy
+import sys
+
+"""
+Maps each tool to its script, relative to this file, and a summary of it.
+"""
+TOOLS = {
+    'multimutect': ('multimutect/multimutect.py', 'Runs MuTect in parallel'),
+    'workqueue': ('multimutect/workqueue.py',
+                  'Runs spooled multimutect jobs on this machine'),
+    'accounting': ('multimutect/accounting.py',
+                   'Summarizes the resources used by MuTect jobs'),
+    'addgroups': ('premutect/addgroups.py', 'Adds read groups to BAM files'),
+    'reorder_all': ('premutect/reorder_all.py',
+                    'Orders the contigs of BAM files as in a reference'),
+    'reindex': ('premutect/reindex.py', 'Indexes BAM files'),
+    'mapqto0': ('premutect/mapqto0.py',
+                'Sets the MAPQ of unmapped reads to 0'),
+    'prepare': ('premutect/prepare.py',
+                'Does all of the premutect steps in one pass per BAM file'),
+    'catenate': ('postmutect/catenate.py',
+                 'Catenates the VCF fragments of each pair'),
+    'combine': ('postmutect/combine.py',
+                'Combines the VCF files of several pairs into one'),
+}
+
+
+def usage(out):
+    out.write('Usage: mutools <tool> [args]\n\nTools:\n')
+    for tool in sorted(TOOLS):
+        out.write('  {:<13}{}\n'.format(tool, TOOLS[tool][1]))
+    out.write('\nRun mutools <tool> -h for the options of a tool.\n')
+
+
+"""
+Runs a tool's script as if it had been run directly, with the given
+arguments.
+"""
+def run_tool(tool, args):
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                          TOOLS[tool][0])
+    #The scripts import their neighbours, as when run directly.
+    sys.path.insert(0, os.path.dirname(script))
+    sys.argv = [script] + args
+    runpy.run_path(script, run_name='__main__')
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        usage(sys.stdout)
+        sys.exit(0 if len(sys.argv) >= 2 else 1)
+    if sys.argv[1] not in TOOLS:
+        sys.stderr.write('Unknown tool: {}\n\n'.format(sys.argv[1]))
+        usage(sys.stderr)
+        sys.exit(1)
+    run_tool(sys.argv[1], sys.argv[2:])
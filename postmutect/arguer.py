@@ -7,12 +7,20 @@ add more arguments if it desires.
 """
 import argparse
 
-def makeparser(description):
+"""
+With vcf_files, the vcf files may also be given on the command line
+(-v) instead of a directory.
+"""
+def makeparser(description, vcf_files=False):
     parser = argparse.ArgumentParser(description=description)
     input_group = parser.add_mutually_exclusive_group(required=True)
 
     input_group.add_argument('-d', '--directory', type=str,
                         help='The input directory containing vcf files',)
+    if vcf_files:
+        input_group.add_argument('-v', '--vcf_files', type=str, nargs='*',
+                                 help=('A list of vcfs on the command line'
+                                       ' to combine'))
     parser.add_argument('-r', '--reference', type=str,
                         help='The reference genome for the BAM files',
                         required=True)
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+    "bgzf.py", by Sean Soderman
+    Reads and writes BGZF (blocked gzip) files, the format of bgzip
+    compressed, tabix indexed VCFs. Blocks are compressed by several
+    threads at once (zlib lets go of the interpreter while it works), and
+    compressed VCFs can be concatenated block by block, recompressing only
+    the block where each header ends. Indexing requires pysam.
+"""
+import gzip
+import os
+import struct
+import sys
+import zlib
+from multiprocessing.pool import ThreadPool
+from pysampath import resolve_pysam
+
+"""
+The most uncompressed data put in a single block, as bgzip does.
+"""
+MAX_BLOCK = 0xff00
+
+"""
+The empty block ending every BGZF file. A file without it was cut short.
+"""
+EOF_BLOCK = (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43'
+             b'\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+"""
+The fixed part of a block's gzip header, up to and including XLEN.
+"""
+HEADER = struct.Struct('<4BI2BH')
+
+
+"""
+Whether a file is gzip (and so presumably BGZF) compressed.
+"""
+def is_gzip(path):
+    with open(path, 'rb') as infile:
+        return infile.read(2) == b'\x1f\x8b'
+
+
+"""
+Compresses up to MAX_BLOCK bytes of data into a single BGZF block.
+"""
+def compress_block(data, level=6):
+    deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = deflate.compress(data) + deflate.flush()
+    #BSIZE is the size of the whole block, minus one.
+    header = HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6) + struct.pack(
+        '<2BHH', 66, 67, 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<2I', zlib.crc32(data) & 0xffffffff,
+                                        len(data))
+
+
+"""
+Reads the next block of a BGZF file. Returns the block as it is on disk,
+and the offset of its compressed data within it, or None at the end of
+the file. Raises a ValueError if the file isn't BGZF.
+"""
+def read_block(infile):
+    fixed = infile.read(HEADER.size)
+    if not fixed:
+        return None
+    magic1, magic2, method, flags, mtime, xfl, os_id, xlen = \
+        HEADER.unpack(fixed)
+    extra = infile.read(xlen)
+    bsize = None
+    position = 0
+    #Look for the BC subfield holding the size of the block.
+    while position + 4 <= len(extra):
+        si1, si2, slen = struct.unpack('<2BH', extra[position:position + 4])
+        if (si1, si2, slen) == (66, 67, 2):
+            bsize = struct.unpack('<H', extra[position + 4:position + 6])[0]
+        position += 4 + slen
+    if (magic1, magic2) != (31, 139) or not flags & 4 or bsize is None:
+        raise ValueError('{} is not BGZF compressed'.format(infile.name))
+    rest = infile.read(bsize + 1 - HEADER.size - xlen)
+    return fixed + extra + rest, HEADER.size + xlen
+
+
+"""
+Returns the uncompressed contents of a block read by read_block.
+"""
+def inflate(block, start):
+    return zlib.decompress(block[start:-8], -15)
+
+
+"""
+Returns the uncompressed size of a block read by read_block.
+"""
+def block_size(block):
+    return struct.unpack('<I', block[-4:])[0]
+
+
+class BgzfWriter(object):
+    """
+    A file object writing BGZF. Data is gathered into batches of blocks,
+    which are compressed by threads threads at once. Already compressed
+    blocks can be added with write_block.
+    """
+    def __init__(self, path, threads=1, level=6):
+        self.name = path
+        self.outfile = open(path, 'wb')
+        self.level = level
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.batch = MAX_BLOCK * 4 * max(1, threads)
+        self.pending = []
+        self.size = 0
+
+    def write(self, data):
+        self.pending.append(data)
+        self.size += len(data)
+        if self.size >= self.batch:
+            self.flush_blocks(False)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    """
+    Compresses the pending data, leaving the end that doesn't fill a
+    block for later unless final is set.
+    """
+    def flush_blocks(self, final=True):
+        data = b''.join(self.pending)
+        end = len(data) if final else len(data) // MAX_BLOCK * MAX_BLOCK
+        chunks = [data[i:i + MAX_BLOCK] for i in range(0, end, MAX_BLOCK)]
+        compress = lambda chunk: compress_block(chunk, self.level)
+        if self.pool is not None:
+            blocks = self.pool.map(compress, chunks)
+        else:
+            blocks = map(compress, chunks)
+        self.outfile.write(b''.join(blocks))
+        self.pending = [data[end:]]
+        self.size = len(data) - end
+
+    """
+    Adds a block read by read_block as it is, after the data written so
+    far.
+    """
+    def write_block(self, block):
+        self.flush_blocks()
+        self.outfile.write(block)
+
+    def close(self):
+        if self.outfile.closed:
+            return
+        self.flush_blocks()
+        self.outfile.write(EOF_BLOCK)
+        self.outfile.close()
+        if self.pool is not None:
+            self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+"""
+Opens a VCF for reading, decompressing it if it is gzipped. Plain files
+are read through a buffer of the given size.
+"""
+def open_vcf(path, buffering=-1):
+    if is_gzip(path):
+        return gzip.open(path, 'rb')
+    return open(path, 'r', buffering)
+
+
+"""
+Opens a VCF for writing, compressing it with threads threads if its name
+ends with .gz. Plain files are written through a buffer of the given
+size.
+"""
+def open_output(path, threads=1, buffering=-1):
+    if path.endswith('.gz'):
+        return BgzfWriter(path, threads)
+    return open(path, 'w', buffering)
+
+
+"""
+Builds the tabix index (path.tbi) of a compressed VCF. Returns whether it
+did; without pysam, says so and leaves the file unindexed. pysam is only
+imported here, as most uses of this module don't need it.
+"""
+def index(path):
+    resolve_pysam()
+    try:
+        import pysam
+    except ImportError:
+        sys.stderr.write('pysam is not installed, not indexing {}\n'
+                         .format(path))
+        return False
+    pysam.tabix_index(path, preset='vcf', force=True)
+    return True
+
+
+"""
+Returns whether a BGZF file ends with the end of file block, that is,
+whether it was written to the end.
+"""
+def complete(path):
+    size = os.path.getsize(path)
+    if size < len(EOF_BLOCK):
+        return False
+    with open(path, 'rb') as infile:
+        infile.seek(size - len(EOF_BLOCK))
+        return infile.read() == EOF_BLOCK
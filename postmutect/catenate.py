@@ -3,119 +3,238 @@
     "catenate.py", by Sean Soderman
     Concatenates all vcfs under a directory in an order 
     according to the chrs.list file within the directory.
+    Natively by default (see vcfcat.py), or with GATK's CatVariants.
 """
-import argparse
+import multiprocessing
 import os
 import re
 import sys
 from subprocess import check_output, CalledProcessError
 try:
     from arguer import makeparser
+    from fragments import validate
+    from vcfcat import concatenate
 except ImportError as I:
     sys.stderr.write('Make sure arguer.py is in my working directory: {}'
                          .format(I))
 
-parser = makeparser(('Concatenates the vcf files within the subdirectories'
-                     ' created by multimutect.'))
-parser.add_argument('--delete_fragments', action='store_true',
-                    help='Delete files utilized for catenation')
-parser.add_argument('-l', '--listfile', type=str,
-                    help=('A list specifying the samples to'
-                          'concatenate. Useful if the BAM files used'
-                          'for the analysis were created on a per-'
-                          'chromosome basis. Uses chrs.list by default.'),
-                    default='chrs.list')
-args = parser.parse_args()
-"""
-Validates the list of chromosome vcf file fragments. Removes paths that
-lead to files of size zero, or that do not exist.
+
+"""
+The CatVariants command template, for --use_catvariants.
+"""
+catvariants = ('java -cp {gatk} org.broadinstitute.gatk.tools.CatVariants'
+               ' -assumeSorted -R {ref} -out {{out}} {{vcfs}}')
+
+"""
+Validates the list of chromosome vcf file fragments. Returns a list of
+(path, problem) tuples for the fragments that are missing, empty or
+truncated (for instance by a MuTect process that was killed).
 """
 def chr_validate(chrlist):
-    fil_func = lambda x: os.stat(x).st_size != 0 and os.path.exists(x)
-    return filter(fil_func, chrlist)
+    problems = [(c, validate(c)) for c in chrlist]
+    return [(c, p) for c, p in problems if p is not None]
+
+"""
+Reports the invalid fragments of an output that won't be catenated.
+"""
+def report_invalid(outpath, invalid):
+    for path, problem in invalid:
+        sys.stderr.write('Not creating {}: {} is {}.\n'
+                         .format(outpath, path, problem))
+    sys.stderr.write('Rerun multimutect with --resume to redo them.\n')
+
+"""
+Returns the path of a vcf fragment, given its path without an extension:
+the compressed fragment if there is one, else the plain one.
+"""
+def fragment_path(base):
+    if os.path.exists(base + '.vcf.gz'):
+        return base + '.vcf.gz'
+    return base + '.vcf'
+
+"""
+Concatenates the vcf fragments in chrlist, in that order, into outpath:
+natively, or with CatVariants if use_catvariants is set. Returns whether
+it succeeded. Natively, outpath is compressed (by threads threads) and
+indexed if its name ends with .gz.
+"""
+def concatenate_vcfs(chrlist, outpath, reference, gatkpath,
+                     use_catvariants=False, threads=1):
+    if not use_catvariants:
+        try:
+            concatenate(chrlist, outpath, threads)
+        except (IOError, OSError, ValueError) as E:
+            sys.stderr.write('Problem: {}\n'.format(E))
+            return False
+        return True
+    cmd = catvariants.format(gatk=gatkpath, ref=reference)
+    #The list of vcfs to concatenate, each prepended by
+    #-V.
+    vseries = "".join(['-V ' + c + ' ' for c in chrlist])
+    final_cmd = cmd.format(out=outpath, vcfs=vseries)
+    try:
+        check_output(final_cmd.split())
+    except CalledProcessError as cpe:
+        sys.stderr.write('Problem: {}\n'.format(cpe))
+        return False
+    return True
+
+"""
+Deletes the given vcf files, along with their indices.
+"""
+def delete_vcfs(vcfs):
+    map(os.unlink, vcfs)
+    map(os.unlink, filter(os.path.exists, [v + ext for v in vcfs
+                                           for ext in ('.idx', '.tbi')]))
+
+"""
+Moves a finished vcf (and its index, if any) from its temporary name into
+place.
+"""
+def move_vcf(partial, outpath):
+    os.rename(partial, outpath)
+    if os.path.exists(partial + '.tbi'):
+        os.rename(partial + '.tbi', outpath + '.tbi')
 
 """
-Concatenates all vcfs under a directory or on a command line.
-"""
-def vcf_catenate(directory, reference, gatkpath, listfile, delete_fragments):
-    cmd = ('java -cp {gatk} org.broadinstitute.gatk.tools.CatVariants'
-           ' -assumeSorted -R' 
-           ' {ref} -out {{out}} {{vcfs}}').format(gatk=gatkpath, 
-                                                ref=reference)
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for dir in dirnames:
-            d_path = os.path.join(dirpath, dir)
-            listing = os.path.join(d_path, listfile)
-            result_name = dir + '.vcf'
-            outpath = os.path.join(dirpath, result_name)
-            #Make sure the listing file exists and that this isn't the
-            #status directory.
-            if os.path.exists(listing):
-                with open(listing, 'r') as chrfile:
-                    chrlist = [os.path.join(d_path, c.strip()) + '.vcf' 
-                               for c in chrfile]
-                    #Keep original chrlist for deletions of possibly empty
-                    #VCF files.
-                    realchrs = chr_validate(chrlist)
-                    #The list of vcfs to concatenate, each prepended by
-                    #-V.
-                    vseries = "".join(['-V ' + c + ' ' for c in realchrs])
-                    final_cmd = cmd.format(out=outpath, vcfs=vseries)
-                    try:
-                        check_output(final_cmd.split())
-                    except CalledProcessError as cpe:
-                        sys.stderr.write('Problem: {}\n'.format(cpe))
-                    #Clean up leftover files after combining them.
-                    #Also cleans up .idx files and directories.
-                    if delete_fragments == True:
-                        map(os.unlink, chrlist)
-                        #No index file is created for empty vcfs.
-                        map(lambda x: os.unlink(x + '.idx'), realchrs)
-                        os.unlink(listing)
-                        os.rmdir(d_path)
-            else:
-                print("I don't exist: {}".format(listing))
+Concatenates the vcf fragments of a single pair's directory, dir (within
+dirpath), in the order of its listing file. The result is written next to
+the directory, under a temporary name until it is complete. With
+compress, it is a bgzipped and tabix indexed .vcf.gz.
+"""
+def catenate_pair(dirpath, dir, reference, gatkpath, listfile,
+                  delete_fragments, use_catvariants=False, compress=False,
+                  threads=1):
+    d_path = os.path.join(dirpath, dir)
+    listing = os.path.join(d_path, listfile)
+    extension = '.vcf.gz' if compress else '.vcf'
+    result_name = dir + extension
+    outpath = os.path.join(dirpath, result_name)
+    partial = os.path.join(dirpath, dir + '.partial' + extension)
+    #Make sure the listing file exists and that this isn't the
+    #status directory.
+    if not os.path.exists(listing):
+        print("I don't exist: {}".format(listing))
+        return
+    with open(listing, 'r') as chrfile:
+        chrlist = [fragment_path(os.path.join(d_path, c.strip()))
+                   for c in chrfile]
+    #Truncated fragments must be rerun, not catenated.
+    invalid = chr_validate(chrlist)
+    if invalid:
+        report_invalid(outpath, invalid)
+        return
+    if not concatenate_vcfs(chrlist, partial, reference, gatkpath,
+                            use_catvariants, threads):
+        #Keep the fragments around to try again.
+        if os.path.exists(partial):
+            os.unlink(partial)
+        return
+    move_vcf(partial, outpath)
+    #Clean up leftover files after combining them.
+    #Also cleans up .idx files and directories.
+    if delete_fragments == True:
+        delete_vcfs(chrlist)
+        #Interval lists of packed shards, MuTect logs and
+        #the list of skipped contigs are left behind by
+        #multimutect.
+        leftovers = [re.sub(r'\.vcf(\.gz)?$', ext, c)
+                     for c in chrlist
+                     for ext in ('.intervals', '.log')]
+        leftovers.append(os.path.join(d_path, 'skipped.list'))
+        map(os.unlink, filter(os.path.exists, leftovers))
+        os.unlink(listing)
+        os.rmdir(d_path)
+
+"""
+Concatenates all vcfs under a directory or on a command line. With more
+than one job, several pair directories are catenated at once.
+"""
+def vcf_catenate(directory, reference, gatkpath, listfile, delete_fragments,
+                 use_catvariants=False, jobs=1, compress=False, threads=1):
+    pairs = [(dirpath, dir) for dirpath, dirnames, filenames
+             in os.walk(directory) for dir in dirnames]
+    options = (reference, gatkpath, listfile, delete_fragments,
+               use_catvariants, compress, threads)
+    if jobs <= 1:
+        for pair in pairs:
+            catenate_pair(*(pair + options))
+        return
+    pool = multiprocessing.Pool(jobs)
+    results = [pool.apply_async(catenate_pair, pair + options)
+               for pair in pairs]
+    pool.close()
+    pool.join()
+    map(lambda r: r.get(), results)
 """
 Smaller concatenation function for the case of a single directory with
 VCFs generated from BAM files each representing single chromosomes.
 """
-def minicat(directory, reference, gatkpath, listfile, delete_fragments):
-    cmd = ('java -cp {gatk} org.broadinstitute.gatk.tools.CatVariants'
-           ' -assumeSorted -R' 
-           ' {ref} -out {{out}} {{vcfs}}').format(gatk=gatkpath, 
-                                                ref=reference)
+def minicat(directory, reference, gatkpath, listfile, delete_fragments,
+            use_catvariants=False, jobs=1, compress=False, threads=1):
     file_list = []
     if os.path.exists(directory) and os.path.exists(listfile):
         with open(listfile, 'r') as lfile:
-            #Convert .bam extension to .vcf.
-            file_vcfs = [re.sub('\.bam', '.vcf', bam) for bam in lfile]
-            file_list = [os.path.join(directory, 
-                                      os.path.basename(vcf.strip()))
+            #Convert .bam extension to .vcf (or .vcf.gz).
+            file_vcfs = [re.sub(r'\.bam', '', bam) for bam in lfile]
+            file_list = [fragment_path(os.path.join(directory, 
+                                       os.path.basename(vcf.strip())))
                         for vcf in file_vcfs]
     else:
         sys.stderr.write(('Error: {} or {} do not exist.'
                          ' Please check your command'
                          ' line').format(directory, listfile))
         sys.exit(1)
-    #Create series of VCFs to concatenate
-    vseries = "".join(['-V ' + vcf + ' ' for vcf in file_list])
-    outfile = directory + '.vcf'
-    final_cmd = cmd.format(out=outfile, vcfs=vseries)
-    check_output(final_cmd.split())
+    invalid = chr_validate(file_list)
+    if invalid:
+        report_invalid(directory + '.vcf', invalid)
+        sys.exit(1)
+    outfile = directory + ('.vcf.gz' if compress else '.vcf')
+    if not concatenate_vcfs(file_list, outfile, reference, gatkpath,
+                            use_catvariants, threads):
+        sys.exit(1)
     
     if delete_fragments == True:
-        map(os.unlink, file_list)
-        map(lambda x: os.unlink(x + '.idx'), file_list)
+        delete_vcfs(file_list)
 
-cat_func = vcf_catenate
-if args.listfile != 'chrs.list':
-    cat_func = minicat
+if __name__ == '__main__':
+    parser = makeparser(('Concatenates the vcf files within the subdirectories'
+                         ' created by multimutect.'))
+    parser.add_argument('--delete_fragments', action='store_true',
+                        help='Delete files utilized for catenation')
+    parser.add_argument('-l', '--listfile', type=str,
+                        help=('A list specifying the samples to'
+                              'concatenate. Useful if the BAM files used'
+                              'for the analysis were created on a per-'
+                              'chromosome basis. Uses chrs.list by default.'),
+                        default='chrs.list')
+    parser.add_argument('--use_catvariants', action='store_true',
+                        help=('Concatenate with GATK\'s CatVariants instead'
+                              ' of natively.'))
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help=('The number of pair directories catenated at'
+                              ' once. Default: 1'))
+    parser.add_argument('-z', '--compress', action='store_true',
+                        help=('Write bgzipped, tabix indexed .vcf.gz files.'
+                              ' Compressed fragments are always read.'))
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help=('The number of threads compressing each'
+                              ' output. Default: 1'))
+    args = parser.parse_args()
+    if args.compress and args.use_catvariants:
+        sys.stderr.write('--compress does not work with --use_catvariants\n')
+        sys.exit(1)
+    cat_func = vcf_catenate
+    if args.listfile != 'chrs.list':
+        cat_func = minicat
 
-if os.path.exists(args.gatkpath):
-    cat_func(**vars(args))
-#Try again with the default.
-elif os.path.exists('gatk.jar'):
-    cat_func(**vars(args))
-else:
-    sys.stderr.write('Please provide an existent gatk jar filepath.')
-    sys.exit(1)
+    if not args.use_catvariants:
+        cat_func(**vars(args))
+    elif os.path.exists(args.gatkpath):
+        cat_func(**vars(args))
+    #Try again with the default.
+    elif os.path.exists('gatk.jar'):
+        cat_func(**vars(args))
+    else:
+        sys.stderr.write('Please provide an existent gatk jar filepath.')
+        sys.exit(1)
@@ -1,54 +1,54 @@
 #!/usr/bin/env python
 """
 "combine.py", by Sean Soderman
-Combines all vcfs *in* a directory using the GATK tool CombineVariants.
+Combines all vcfs *in* a directory using the GATK tool CombineVariants,
+or natively with a streaming merge (see vcfmerge.py).
 
 To accomodate the case of only a few VCF files needing combining,
 the user may also specify VCFs directly on the command line.
 """
+import multiprocessing
 import os
 import re
 import sys
 import subprocess as sp
 try:
     from arguer import makeparser
+    from vcfmerge import merge, scatter_merge, vname
+    from vcfproject import project
 except ImportError as I:
     sys.stderr.write('Make sure arguer.py is in my working directory: {}'
                      .format(I))
 
 
-parser = makeparser('Combines all vcfs in a directory with CombineVariants')
-parser.add_argument('-v', '--vcf_files', type=str, nargs='*',
-                         help='A list of vcfs on the command line to combine')
-parser.add_argument('-o', '--outfile', type=str,
-                    help='The resulting combined output file',
-                    default='outfile.vcf')
-parser.add_argument('-D', '--delete_input_vcfs', action='store_true',
-                    help=('If this is supplied, delete all vcfs in the'
-                    ' directory'))
-parser.add_argument('-l', '--listing', type=str,
-                    help=('If this is supplied, combine VCF files in the order'
-                    ' given in the listing file.'))
-parser.add_argument('-w', '--without_nonecol', action='store_true',
-                    help=('If this option is specified, the column containing'
-                          ' "none" will be omitted.'))
 
-args = parser.parse_args()
+"""
+The columns of tumor only samples' missing normals: "none" as
+CombineVariants names them, "none.<vcf name>" as the native merge does.
+"""
+NONE_COLUMNS = ['none', 'none.*']
 
 """
 Contains a little too much to be contained in a lambda expression.
 Returns an argument string with the hyphens replaced by underscores.
 """
 def vformat(filename): 
-    base_filename = os.path.basename(filename).split('.')[0]
-    no_hyphen_filename = re.sub('-', '_', base_filename)
-    return '-V:{} '.format(no_hyphen_filename)
+    return '-V:{} '.format(vname(filename))
 
 """
-Combines all vcfs in a directory with CombineVariants.
+Leaves out the plain x.vcf of each pair that also has an x.vcf.gz (as
+catenate.py --compress leaves behind when the plain one was there before),
+so that no pair is combined twice.
 """
-def vcf_combine(directory, vcf_files, reference, outfile, gatkpath, 
-                delete_input_vcfs, listing, without_nonecol):
+def prefer_compressed(names):
+    present = set(names)
+    return [x for x in names if x + '.gz' not in present]
+
+"""
+Returns the paths of the vcfs to combine: those named after the pairs of a
+listing file, those in a directory, or those given on the command line.
+"""
+def input_vcfs(directory, vcf_files, listing):
     if listing is not None and vcf_files is not None:
         sys.stderr.write(("You don't need a listing when you have specified"
                          "VCFS on the command line"))
@@ -56,15 +56,10 @@ def vcf_combine(directory, vcf_files, reference, outfile, gatkpath,
     #Use the cwd if VCF files are specified on the command line.
     if directory is None:
         directory = '.'
-    cmd = ('java -jar {gatk} -T CombineVariants -R {ref}' 
-           ' -nt 4 {{vcfs}} -o {outfile}'
-           ' -dt NONE --genotypemergeoption UNSORTED')
-    cmd = cmd.format(gatk=gatkpath, ref=reference, outfile=outfile)
-    
     vcfs = []
     if listing is not None:
         with open(listing, 'r') as bamlist:
-            bamonly = [x for x in bamlist if re.search('\.bam\s*$', x)]
+            bamonly = [x for x in bamlist if re.search(r'\.bam\s*$', x)]
             #Make respective tumors/normals lists.
             tumors, normals = zip(*[x.split() for x in bamonly])
             #Substitute .bam in the tumor element for an underscore
@@ -75,55 +70,134 @@ def vcf_combine(directory, vcf_files, reference, outfile, gatkpath,
                        if not normal.isspace() 
                        else re.sub('.bam', '.vcf', tumor)), tumors, normals)
             vcfs = [x.strip() for x in vcfs]
+            #catenate.py --compress names them .vcf.gz.
+            vcfs = [x + '.gz' if os.path.exists(os.path.join(directory,
+                                                             x + '.gz'))
+                    else x for x in vcfs]
     elif directory != '.':
-        vcfs = filter(lambda x: x.endswith('.vcf'), os.listdir(directory))
+        vcfs = prefer_compressed([x for x in os.listdir(directory)
+                                  if x.endswith(('.vcf', '.vcf.gz'))])
     else: #VCF files were specified on the cmd line.
         vcfs = filter(lambda x: os.path.exists(x), vcf_files)
 
-    path_vcfs = [os.path.join(directory, s) for s in vcfs]
-    #Use the basenames of the vcf files for more descriptive 'set='
-    #areas in the output VCF file.
-    vstring = ' '.join(map(lambda x: vformat(x) + x, path_vcfs))
-    try:
-        sp.check_output(cmd.format(vcfs=vstring).split())
-    except sp.CalledProcessError as cpe:
-        sys.stderr.write('CombineVariants ran into a problem: {}\n'
-                         .format(cpe))
-        sys.exit(1)
+    return [os.path.join(directory, s) for s in vcfs]
+
+"""
+Combines all vcfs in a directory with CombineVariants, using numthreads
+threads, or natively if native is set. The native merge is split by
+contig over numthreads processes, merging at most fan_in vcfs at once
+(see vcfmerge.scatter_merge).
+The sample columns of the result are then kept or dropped by pattern, and
+sites without genotypes dropped (see vcfproject.Projection): inline with
+the native merge, or in a single pass over CombineVariants' output.
+If outfile ends with .gz, it is bgzipped (by numthreads threads) and tabix
+indexed.
+"""
+def vcf_combine(directory, vcf_files, reference, outfile, gatkpath, 
+                delete_input_vcfs, listing, without_nonecol, native=False,
+                numthreads=multiprocessing.cpu_count(), fan_in=0,
+                keep_columns=None, drop_columns=None, drop_missing=False):
+    path_vcfs = input_vcfs(directory, vcf_files, listing)
+    drop_columns = list(drop_columns or [])
+    if without_nonecol:
+        drop_columns.extend(NONE_COLUMNS)
+    select = None
+    if keep_columns or drop_columns or drop_missing:
+        select = (keep_columns, drop_columns, drop_missing)
+    if native:
+        try:
+            if numthreads > 1 or fan_in > 1:
+                scatter_merge(path_vcfs, outfile, reference, select=select,
+                              jobs=numthreads, fan_in=fan_in)
+            else:
+                merge(path_vcfs, outfile, reference, select=select,
+                      threads=numthreads)
+        except (IOError, ValueError) as E:
+            sys.stderr.write('The merge ran into a problem: {}\n'.format(E))
+            sys.exit(1)
+    else:
+        #CombineVariants writes plain text, compressed afterwards.
+        compress = outfile.endswith('.gz')
+        gatk_outfile = re.sub(r'\.gz$', '', outfile)
+        cmd = ('java -jar {gatk} -T CombineVariants -R {ref}' 
+               ' -nt {threads} {{vcfs}} -o {outfile}'
+               ' -dt NONE --genotypemergeoption UNSORTED')
+        cmd = cmd.format(gatk=gatkpath, ref=reference, outfile=gatk_outfile,
+                         threads=max(1, numthreads))
+        #Use the basenames of the vcf files for more descriptive 'set='
+        #areas in the output VCF file.
+        vstring = ' '.join(map(lambda x: vformat(x) + x, path_vcfs))
+        try:
+            sp.check_output(cmd.format(vcfs=vstring).split())
+        except sp.CalledProcessError as cpe:
+            sys.stderr.write('CombineVariants ran into a problem: {}\n'
+                             .format(cpe))
+            sys.exit(1)
+        if compress:
+            project(gatk_outfile, outfile, *(select or (None, None, False)),
+                    threads=numthreads)
+            os.unlink(gatk_outfile)
+        elif without_nonecol and select == (None, NONE_COLUMNS, False):
+            rm_nonecol(outfile, 'newfile.vcf')
+        elif select is not None:
+            project(outfile, 'newfile.vcf', *select)
+            os.rename('newfile.vcf', outfile)
     if delete_input_vcfs:
         map(lambda x: os.unlink(x), path_vcfs)
-    if without_nonecol is True:
-        rm_nonecol(outfile, 'newfile.vcf')
 """
 Deletes the column called "none" in the resulting combined VCF.
 This results from tumor only samples being provided.
 Overwrites the vcf file with the new vcf file without the none column.
 """
 def rm_nonecol(infile, noneless):
-    with open(infile, 'r') as orig, open(noneless, 'w') as new:
-        none_pos = -1
-        new_line = []
-        vcf_match = re.compile('\s*#*[0-9_a-zA-Z/.:;,=-]+')
-        for line in orig:
-            if re.match('##', line):
-                new.write(line)
-            else:
-                new_line = re.findall(vcf_match, line)
-
-            if re.match('#CHROM', line) and not re.search('none', line):
-                sys.stderr.write(("I am sorry, but you don't"
-                                  " even need to use this switch, as your file"
-                                  " has no 'none' column in it.\n"))
-                sys.exit(1)
-            elif re.search('#CHROM.*none', line):
-                none_pos = map(lambda x: x.strip(), new_line).index('none')
-            if none_pos != -1:
-                new_str = ''.join([x for x in new_line 
-                                  if new_line.index(x) != none_pos])
-                #Portable newline catenation if the newline was removed.
-                if not new_str.endswith(os.linesep):
-                    new_str += os.linesep
-                new.write(new_str)
+    projection = project(infile, noneless, drop=NONE_COLUMNS)
+    if projection is None or projection.identity:
+        os.unlink(noneless)
+        sys.stderr.write(("I am sorry, but you don't"
+                          " even need to use this switch, as your file"
+                          " has no 'none' column in it.\n"))
+        sys.exit(1)
     #Replace the input file with the file omitting the none column.
     os.rename(noneless, infile)
-vcf_combine(**vars(args))
+
+if __name__ == '__main__':
+    parser = makeparser(('Combines all vcfs in a directory with'
+                         ' CombineVariants'), vcf_files=True)
+    parser.add_argument('-o', '--outfile', type=str,
+                        help=('The resulting combined output file. Bgzipped'
+                              ' and tabix indexed if it ends with .gz'),
+                        default='outfile.vcf')
+    parser.add_argument('-D', '--delete_input_vcfs', action='store_true',
+                        help=('If this is supplied, delete all vcfs in the'
+                        ' directory'))
+    parser.add_argument('-l', '--listing', type=str,
+                        help=('If this is supplied, combine VCF files in the'
+                              ' order given in the listing file.'))
+    parser.add_argument('-w', '--without_nonecol', action='store_true',
+                        help=('If this option is specified, the column'
+                              ' containing "none" will be omitted.'))
+    parser.add_argument('--native', action='store_true',
+                        help=('Merge the vcfs with a streaming merge instead'
+                              ' of CombineVariants. Uses little memory'
+                              ' however many vcfs there are.'))
+    parser.add_argument('-t', '--numthreads', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help=('The number of threads CombineVariants uses,'
+                              ' or with --native, the number of contigs'
+                              ' merged at once. Default: the # of cores on'
+                              ' your computer'))
+    parser.add_argument('--fan_in', type=int, default=0,
+                        help=('With --native, merge at most this many vcfs'
+                              ' at once, merging the results again in as'
+                              ' many rounds as needed. Default: no limit'))
+    parser.add_argument('--keep_columns', type=str, nargs='+',
+                        help=('Only keep the sample columns matching one of'
+                              ' these names or shell-style patterns.'))
+    parser.add_argument('--drop_columns', type=str, nargs='+',
+                        help=('Drop the sample columns matching one of'
+                              ' these names or shell-style patterns.'))
+    parser.add_argument('--drop_missing', action='store_true',
+                        help=('Drop the sites where none of the remaining'
+                              ' samples has a genotype.'))
+    args = parser.parse_args()
+    vcf_combine(**vars(args))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+    "fragments.py", by Sean Soderman
+    Cheap sanity checks for the VCF fragments MuTect writes, so that files
+    left truncated by a killed JVM are caught before they are catenated.
+    Also checks BGZF compressed VCFs.
+"""
+import gzip
+import os
+from bgzf import complete, is_gzip
+
+"""
+How much of the end of a fragment is read to find its last line.
+"""
+TAIL_BYTES = 65536
+
+
+"""
+Returns the contig of a VCF data line.
+"""
+def line_contig(line):
+    return line.split('\t', 1)[0]
+
+
+"""
+Validates a VCF fragment without reading all of it: the file must exist,
+start with a complete header (up to and including the #CHROM line), and
+end with a terminated line. If contigs is given, the first and last
+records must lie on one of them.
+Returns None for a valid fragment, otherwise a description of the problem.
+"""
+def validate(path, contigs=None):
+    if not os.path.exists(path):
+        return 'missing'
+    size = os.path.getsize(path)
+    if size == 0:
+        return 'empty'
+    if is_gzip(path):
+        return validate_bgzf(path, contigs)
+    first = None
+    with open(path, 'rb') as vcf:
+        if not vcf.readline().startswith(b'##fileformat=VCF'):
+            return 'not a VCF file'
+        header = False
+        for line in vcf:
+            if not line.startswith(b'#'):
+                first = line
+                break
+            if line.startswith(b'#CHROM'):
+                header = True
+        if not header:
+            return 'incomplete header'
+        vcf.seek(max(0, size - TAIL_BYTES))
+        tail = vcf.read()
+    if not tail.endswith(b'\n'):
+        return 'last line is not terminated'
+    if contigs is not None and first is not None:
+        last = tail.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+        for record in (first, last):
+            contig = line_contig(record.decode('ascii', 'replace'))
+            if contig not in contigs:
+                return 'record on unexpected contig {}'.format(contig)
+    return None
+
+
+"""
+validate, for BGZF compressed VCFs. A file cut short lacks the BGZF end
+of file block, so only the header and first record need decompressing.
+"""
+def validate_bgzf(path, contigs=None):
+    if not complete(path):
+        return 'missing its end of file block'
+    first = None
+    with gzip.open(path, 'rb') as vcf:
+        if not vcf.readline().startswith(b'##fileformat=VCF'):
+            return 'not a VCF file'
+        header = False
+        for line in iter(vcf.readline, b''):
+            if not line.startswith(b'#'):
+                first = line
+                break
+            if line.startswith(b'#CHROM'):
+                header = True
+    if not header:
+        return 'incomplete header'
+    if contigs is not None and first is not None:
+        contig = line_contig(first.decode('ascii', 'replace'))
+        if contig not in contigs:
+            return 'record on unexpected contig {}'.format(contig)
+    return None
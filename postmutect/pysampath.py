@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+    "pysampath.py", by Sean Soderman
+    Makes sure the installed pysam is the one imported. A pysam directory
+    that was never built (a source checkout in the working directory, say)
+    shadows the installed package when it comes first on sys.path, so the
+    entries holding one are moved to the end of sys.path. Only the entries
+    themselves are looked at, rather than everything below them, and this
+    is done once per process.
+"""
+import os
+import sys
+
+"""
+The sys.path entries moved to the end, once resolve_pysam has run.
+"""
+demoted = None
+
+
+"""
+Whether a pysam directory holds the compiled modules of a built pysam.
+"""
+def built(directory):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return False
+    return any('alignmentfile' in name and name.endswith(('.so', '.pyd'))
+               for name in names)
+
+
+"""
+Moves the sys.path entries holding an unbuilt pysam to its end. Returns
+the entries moved. Calls after the first return the same entries without
+looking again.
+"""
+def resolve_pysam():
+    global demoted
+    if demoted is not None:
+        return demoted
+    demoted = []
+    for entry in sys.path:
+        directory = os.path.join(entry or os.curdir, 'pysam')
+        if os.path.isdir(directory) and not built(directory):
+            demoted.append(entry)
+    for entry in demoted:
+        sys.path.remove(entry)
+        sys.path.append(entry)
+    return demoted
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+"""
+    "seqcache.py", by Sean Soderman
+    An on-disk cache of the sequence dictionaries (contig names and
+    lengths) and index statistics of BAM files, and of the contigs of
+    FASTA references, so that every tool doesn't open every BAM again.
+    Entries are keyed by the file's path and checked against its size and
+    modification time (and its index's), so a changed file is read anew.
+    The cache also tells when a BAM's contigs don't follow the reference.
+"""
+from collections import namedtuple
+import hashlib
+import json
+import os
+import re
+import sys
+from pysampath import resolve_pysam
+
+
+class SeqInfo(namedtuple('SeqInfo', ['references', 'lengths', 'mapped'])):
+    """
+    The contigs of a BAM file or reference, in order, their lengths and
+    (for indexed BAM files) a dictionary of contig: mapped reads, as kept
+    in the index. mapped is None when there are no counts.
+    """
+    __slots__ = ()
+
+
+"""
+Returns the directory the cache is kept in: $MUTOOLS_CACHE, or
+~/.cache/mutools.
+"""
+def default_directory():
+    return os.environ.get('MUTOOLS_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'mutools'))
+
+
+"""
+Returns the [size, mtime] of a file, or None if it doesn't exist.
+"""
+def stamp(path):
+    if path is None or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime]
+
+
+"""
+Returns the path of a BAM file's index, or None if it has none.
+"""
+def index_path(bam):
+    for candidate in (bam + '.bai', re.sub(r'\.bam$', '.bai', bam),
+                      bam + '.csi'):
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+"""
+Reads per-contig mapped read counts from the index of an open
+AlignmentFile. Returns a dictionary of contig: mapped reads, or None if
+the file has no index (or pysam is too old to read its statistics).
+"""
+def index_counts(bamfile):
+    try:
+        stats = bamfile.get_index_statistics()
+    except (AttributeError, ValueError):
+        return None
+    return dict((s.contig, s.mapped) for s in stats)
+
+
+"""
+Reads the header and index statistics of a BAM file with pysam.
+"""
+def read_bam(path):
+    resolve_pysam()
+    from pysam import AlignmentFile
+    with AlignmentFile(path, 'rb') as bam:
+        return SeqInfo(list(bam.references), list(bam.lengths),
+                       index_counts(bam))
+
+
+"""
+Reads the contigs of a reference from its FASTA index.
+"""
+def read_fai(path):
+    references, lengths = [], []
+    with open(path, 'r') as fai:
+        for line in fai:
+            fields = line.split('\t')
+            references.append(fields[0])
+            lengths.append(int(fields[1]))
+    return SeqInfo(references, lengths, None)
+
+
+"""
+Reads the contigs of a reference from its sequence dictionary.
+"""
+def read_dict(path):
+    references, lengths = [], []
+    with open(path, 'r') as sd:
+        for line in sd:
+            if line.startswith('@SQ'):
+                references.append(re.search(r'SN:([^\t\n]+)', line).group(1))
+                lengths.append(int(re.search(r'LN:(\d+)', line).group(1)))
+    return SeqInfo(references, lengths, None)
+
+
+"""
+Returns the index (.fai) or sequence dictionary (.dict) of a FASTA
+reference, and the function reading it, or None if it has neither.
+"""
+def reference_index(fasta):
+    for path, reader in ((fasta + '.fai', read_fai),
+                         (fasta + '.dict', read_dict),
+                         (os.path.splitext(fasta)[0] + '.dict', read_dict)):
+        if os.path.exists(path):
+            return path, reader
+    return None
+
+
+"""
+Checks that the contigs of a BAM file (or of any SeqInfo) follow those of
+a reference: each is in the reference, with the same length, and they
+come in the reference's order. Returns None if they do, otherwise a
+description of the first mismatch.
+"""
+def order_problem(info, reference):
+    ranks = dict((c, i) for i, c in enumerate(reference.references))
+    lengths = dict(zip(reference.references, reference.lengths))
+    last = -1
+    for contig, length in zip(info.references, info.lengths):
+        if contig not in ranks:
+            return 'contig {} is not in the reference'.format(contig)
+        if lengths[contig] != length:
+            return ('contig {} is {} bases long, but {} in the reference'
+                    .format(contig, length, lengths[contig]))
+        if ranks[contig] < last:
+            return ('contig {} is out of the reference\'s order'
+                    .format(contig))
+        last = ranks[contig]
+    return None
+
+
+class SeqCache(object):
+    """
+    The cache, kept in directory as one small JSON file per cached file,
+    written atomically so concurrent tools can share it. If the directory
+    can't be written, the cache just reads the files every time.
+    """
+    def __init__(self, directory=None):
+        self.directory = directory or default_directory()
+        self.writable = True
+        #Entries already looked up by this process.
+        self.memory = {}
+
+    def entry_path(self, path):
+        digest = hashlib.sha1(path.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    """
+    Returns the cached SeqInfo of a file if it was cached with the same
+    key, otherwise None.
+    """
+    def lookup(self, path, key):
+        entry = self.memory.get(path)
+        if entry is None:
+            try:
+                with open(self.entry_path(path), 'r') as entfile:
+                    entry = json.load(entfile)
+            except (IOError, OSError, ValueError):
+                return None
+        if entry.get('path') != path or entry.get('key') != key:
+            return None
+        self.memory[path] = entry
+        return SeqInfo(entry['references'], entry['lengths'],
+                       entry['mapped'])
+
+    def store(self, path, key, info):
+        entry = {'path': path, 'key': key, 'references': info.references,
+                 'lengths': info.lengths, 'mapped': info.mapped}
+        self.memory[path] = entry
+        if not self.writable:
+            return
+        entpath = self.entry_path(path)
+        temp = '{}.{}.tmp'.format(entpath, os.getpid())
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(temp, 'w') as entfile:
+                json.dump(entry, entfile)
+            os.rename(temp, entpath)
+        except (IOError, OSError) as E:
+            sys.stderr.write('Not caching sequence dictionaries in {}: {}\n'
+                             .format(self.directory, E))
+            self.writable = False
+
+    """
+    Returns the SeqInfo of a BAM file, reading it (with pysam) only if it
+    or its index changed since it was cached.
+    """
+    def bam(self, path):
+        path = os.path.realpath(path)
+        key = [stamp(path), stamp(index_path(path))]
+        info = self.lookup(path, key)
+        if info is None:
+            info = read_bam(path)
+            self.store(path, key, info)
+        return info
+
+    """
+    Returns the SeqInfo of a FASTA reference, from its index or sequence
+    dictionary, or None if it has neither.
+    """
+    def reference(self, fasta):
+        found = reference_index(fasta)
+        if found is None:
+            return None
+        path, reader = found
+        path = os.path.realpath(path)
+        key = [stamp(path)]
+        info = self.lookup(path, key)
+        if info is None:
+            info = reader(path)
+            self.store(path, key, info)
+        return info
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+    "vcfcat.py", by Sean Soderman
+    Concatenates VCF fragments without starting a JVM. The fragments of a
+    pair only differ in the records they hold, so catenation amounts to
+    writing the first header and copying every body after it, which is
+    done with the kernel's file to file copies where Python offers them.
+    Compressed (BGZF) fragments are copied block by block.
+"""
+import gzip
+import os
+import shutil
+from bgzf import (BgzfWriter, block_size, index, inflate, is_gzip,
+                  read_block)
+
+"""
+The size of the blocks copied at a time.
+"""
+BUFFER = 1 << 20
+
+
+"""
+Opens a VCF file, plain or compressed, for reading as bytes.
+"""
+def open_bytes(path):
+    if is_gzip(path):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+"""
+Reads the header of a VCF file. Returns its header lines, and the offset
+(in its uncompressed contents) at which its body (its first record)
+starts.
+"""
+def read_header(path):
+    lines = []
+    offset = 0
+    with open_bytes(path) as vcf:
+        for line in iter(vcf.readline, b''):
+            if not line.startswith(b'#'):
+                break
+            lines.append(line)
+            offset += len(line)
+    return lines, offset
+
+
+"""
+Checks that two headers are compatible: they are of the same VCF version
+and have the same columns (and thus samples). Raises a ValueError saying
+how path's header differs from the first one otherwise.
+"""
+def check_header(first, header, path):
+    if not header or not header[-1].startswith(b'#CHROM'):
+        raise ValueError('{} has an incomplete header'.format(path))
+    if header[0] != first[0]:
+        raise ValueError('{} is of another VCF version'.format(path))
+    if header[-1] != first[-1]:
+        raise ValueError('{} has different columns: {}'
+                         .format(path, header[-1].strip()))
+
+
+"""
+Copies the contents of infile past offset to the end of outfile, in the
+kernel when possible.
+"""
+def copy_body(infile, outfile, offset):
+    size = os.fstat(infile.fileno()).st_size
+    outfile.flush()
+    if hasattr(os, 'copy_file_range'):
+        copy = lambda left: os.copy_file_range(infile.fileno(),
+                                               outfile.fileno(), left, offset)
+    elif hasattr(os, 'sendfile'):
+        copy = lambda left: os.sendfile(outfile.fileno(), infile.fileno(),
+                                        offset, left)
+    else:
+        infile.seek(offset)
+        shutil.copyfileobj(infile, outfile, BUFFER)
+        return
+    try:
+        while offset < size:
+            copied = copy(min(size - offset, 1 << 30))
+            if copied == 0:
+                break
+            offset += copied
+    except OSError:
+        #Not supported between these files, copy the rest by hand.
+        infile.seek(offset)
+        shutil.copyfileobj(infile, outfile, BUFFER)
+        return
+    #The kernel copy wrote behind the file object's back.
+    outfile.seek(0, os.SEEK_END)
+
+
+"""
+Copies the body of a BGZF compressed VCF, which starts offset bytes into
+its uncompressed contents, to a BgzfWriter. Only the block holding the
+end of the header is recompressed; the blocks after it are copied as
+they are.
+"""
+def copy_blocks(path, writer, offset):
+    consumed = 0
+    with open(path, 'rb') as infile:
+        for block, start in iter(lambda: read_block(infile), None):
+            if consumed >= offset:
+                #The end of file block is written by the writer itself.
+                if block_size(block) > 0:
+                    writer.write_block(block)
+                continue
+            data = inflate(block, start)
+            if consumed + len(data) > offset:
+                writer.write(data[offset - consumed:])
+            consumed += len(data)
+
+
+"""
+Copies the body of a VCF, plain or compressed, which starts offset bytes
+into its uncompressed contents, to outfile.
+"""
+def copy_vcf(path, outfile, offset):
+    compressed = is_gzip(path)
+    if isinstance(outfile, BgzfWriter) and compressed:
+        copy_blocks(path, outfile, offset)
+    elif compressed or isinstance(outfile, BgzfWriter):
+        with open_bytes(path) as infile:
+            infile.read(offset)
+            shutil.copyfileobj(infile, outfile, BUFFER)
+    else:
+        with open(path, 'rb') as infile:
+            copy_body(infile, outfile, offset)
+
+
+"""
+Concatenates the VCF files in paths, in that order, into outpath. The
+header of the first file is written once, followed by the records of all
+of them. Raises a ValueError if the headers are not compatible.
+The files may be plain or BGZF compressed. If outpath ends with .gz, it
+is BGZF compressed (by threads threads) and indexed.
+"""
+def concatenate(paths, outpath, threads=1):
+    if not paths:
+        raise ValueError('there are no VCF files to concatenate')
+    headers = [read_header(p) for p in paths]
+    first = headers[0][0]
+    for path, (header, offset) in zip(paths, headers):
+        check_header(first, header, path)
+    compress = outpath.endswith('.gz')
+    if compress:
+        outfile = BgzfWriter(outpath, threads)
+    else:
+        outfile = open(outpath, 'wb')
+    with outfile:
+        outfile.writelines(first)
+        for path, (header, offset) in zip(paths, headers):
+            copy_vcf(path, outfile, offset)
+    if compress:
+        index(outpath)
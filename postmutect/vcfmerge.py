@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+"""
+    "vcfmerge.py", by Sean Soderman
+    Merges the VCF files of several pairs into a single multi-sample VCF
+    without a JVM. The inputs are read in step, a k-way merge over a heap
+    holding a single record per input, so memory use does not grow with
+    the size of the cohort's VCFs. Large cohorts can be merged contig by
+    contig on several cores, see scatter_merge.
+"""
+import heapq
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import tempfile
+from bgzf import index, is_gzip, open_output, open_vcf
+from seqcache import SeqCache
+from vcfcat import concatenate
+from vcfproject import Projection
+
+"""
+The fixed columns of a VCF file, up to and including FORMAT.
+"""
+FIXED = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO',
+         'FORMAT']
+
+"""
+Header line describing the set INFO field added to every merged record,
+as CombineVariants does.
+"""
+SET_INFO = ('##INFO=<ID=set,Number=1,Type=String,Description="Source VCF'
+            ' for the merged record in CombineVariants">\n')
+
+
+"""
+The name combine.py gives a VCF file: its base name up to the first dot,
+with hyphens replaced by underscores.
+"""
+def vname(filename):
+    base_filename = os.path.basename(filename).split('.')[0]
+    return re.sub('-', '_', base_filename)
+
+
+"""
+Reads the contig order of a reference sequence from its FASTA index
+(reference.fai) or sequence dictionary (reference.dict, or reference with
+its extension replaced by .dict), through the sequence cache. Returns a
+{contig: rank} dictionary, or None if neither exists.
+"""
+def contig_order(reference):
+    info = SeqCache().reference(reference)
+    if info is None:
+        return None
+    return dict((name, rank) for rank, name in enumerate(info.references))
+
+
+"""
+Reads the contig order from the ##contig lines of the headers of the VCF
+files in paths, for references without an index or dictionary.
+"""
+def header_order(paths):
+    order = {}
+    for path in paths:
+        with open(path, 'r') as vcf:
+            for line in iter(vcf.readline, ''):
+                if not line.startswith('##'):
+                    break
+                contig = re.match('##contig=<ID=([^,>]+)', line)
+                if contig and contig.group(1) not in order:
+                    order[contig.group(1)] = len(order)
+    return order
+
+
+"""
+Removes the set field from a record's INFO column. Returns the rest of
+the column ('' if nothing is left) and the value of the set field (None
+if there was none).
+"""
+def split_set(info):
+    rest = []
+    source = None
+    for field in info.split(';'):
+        if field.startswith('set='):
+            source = field[4:]
+        elif field != '.':
+            rest.append(field)
+    return ';'.join(rest), source
+
+
+class Input(object):
+    """
+    One of the VCF files being merged: its header, its samples and the
+    record it is positioned on (as a list of fields, or None at the end).
+    An input is either one of the VCFs given to merge, whose sample
+    columns are renamed <sample>.<name>, or (if name is a list, the names
+    of the VCFs merged into it) the result of an earlier merge, whose
+    columns are kept as they are. span restricts the input to the records
+    between two byte offsets of an uncompressed file, see contig_spans.
+    """
+    def __init__(self, path, name, span=None):
+        self.path = path
+        self.leaf = not isinstance(name, list)
+        self.name = name
+        self.members = [name] if self.leaf else name
+        self.vcf = open_vcf(path)
+        self.meta = []
+        self.samples = []
+        for line in iter(self.vcf.readline, ''):
+            if line.startswith('##'):
+                self.meta.append(line)
+            elif line.startswith('#CHROM'):
+                self.samples = line.rstrip('\n').split('\t')[len(FIXED):]
+                break
+        if self.leaf:
+            self.columns = ['{}.{}'.format(s, name) for s in self.samples]
+        else:
+            self.columns = self.samples
+        self.end = None
+        if span is not None:
+            self.vcf.seek(span[0])
+            self.end = span[1]
+        self.offset = self.vcf.tell()
+        self.fields = None
+        self.key = None
+
+    """
+    Moves on to the next record. Returns False at the end of the file (or
+    of its span). order gives the rank of each contig and is extended
+    with unseen ones.
+    """
+    def advance(self, order):
+        line = ''
+        if self.end is None or self.offset < self.end:
+            line = self.vcf.readline()
+            self.offset += len(line)
+        if not line:
+            self.fields = self.key = None
+            self.vcf.close()
+            return False
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] not in order:
+            order[fields[0]] = len(order)
+        key = (order[fields[0]], int(fields[1]), fields[3], fields[4])
+        if self.key is not None and key < self.key:
+            raise ValueError('{} is not sorted in reference order at {}:{}'
+                             .format(self.path, fields[0], fields[1]))
+        self.fields, self.key = fields, key
+        return True
+
+    def close(self):
+        self.vcf.close()
+
+    """
+    The names of the merged VCFs a record of this input came from.
+    """
+    def sources(self, fields):
+        if self.leaf:
+            return [self.name]
+        source = split_set(fields[7])[1]
+        if source is None or source == 'Intersection':
+            return self.members
+        return source.split('-')
+
+
+"""
+Merges the header lines of the inputs: every distinct meta-information
+line, in the order first seen, and the set INFO field.
+"""
+def merge_meta(inputs):
+    meta = []
+    seen = set([SET_INFO])
+    for line in [l for i in inputs for l in i.meta]:
+        if line not in seen:
+            seen.add(line)
+            meta.append(line)
+    return meta + [SET_INFO]
+
+
+"""
+Returns the value of a sample missing from a record, given the FORMAT
+keys of the merged record.
+"""
+def missing_sample(keys):
+    return ':'.join('./.' if k == 'GT' else '.' for k in keys)
+
+
+"""
+Builds the merged row of a site from the records of the inputs that have
+it (group, a {input position: fields} dictionary). The ID, QUAL and INFO
+come from the first input with the site; FILTER is PASS if any input
+passed it. Samples are laid out under the union of the inputs' FORMAT
+keys, inputs without the site getting missing values. Merging the
+results of earlier merges gives the same rows as merging all of their
+VCFs at once.
+"""
+def merge_row(inputs, group):
+    first = group[min(group)]
+    filters = [group[i][6] for i in sorted(group)]
+    keys = []
+    for i in sorted(group):
+        for k in group[i][8].split(':') if len(group[i]) > 8 else []:
+            if k not in keys:
+                keys.append(k)
+    sources = [s for i in sorted(group) for s in inputs[i].sources(group[i])]
+    if len(sources) == sum(len(vcf.members) for vcf in inputs):
+        source = 'Intersection'
+    else:
+        source = '-'.join(sources)
+    info = split_set(first[7])[0]
+    info = (info + ';' if info else '') + 'set=' + source
+    row = first[:6] + ['PASS' if 'PASS' in filters else first[6], info,
+                       ':'.join(keys)]
+    for position, vcf in enumerate(inputs):
+        fields = group.get(position)
+        if fields is None:
+            row.extend([missing_sample(keys)] * len(vcf.samples))
+            continue
+        own = fields[8].split(':')
+        for sample in fields[9:]:
+            values = dict(zip(own, sample.split(':')))
+            row.append(':'.join(values.get(k, './.' if k == 'GT' else '.')
+                                for k in keys))
+    return row
+
+
+"""
+Merges a list of Inputs into outpath, one row per site. If select is
+given, the rows are passed through a vcfproject.Projection built with
+select's (keep, drop, drop_missing) on their way out. outpath is
+compressed by threads threads if its name ends with .gz.
+"""
+def merge_inputs(inputs, outpath, order, select=None, threads=1):
+    heap = []
+    for position, vcf in enumerate(inputs):
+        if vcf.advance(order):
+            heap.append((vcf.key, position))
+    heapq.heapify(heap)
+    with open_output(outpath, threads) as outfile:
+        outfile.writelines(merge_meta(inputs))
+        columns = FIXED + [c for vcf in inputs for c in vcf.columns]
+        projection = None
+        if select is not None:
+            projection = Projection(columns, *select)
+            columns = projection.header()
+        outfile.write('\t'.join(columns) + '\n')
+        while heap:
+            key = heap[0][0]
+            group = {}
+            #An input holding the same site twice gives two rows.
+            while heap and heap[0][0] == key and heap[0][1] not in group:
+                position = heapq.heappop(heap)[1]
+                vcf = inputs[position]
+                group[position] = vcf.fields
+                if vcf.advance(order):
+                    heapq.heappush(heap, (vcf.key, position))
+            row = merge_row(inputs, group)
+            if projection is not None:
+                row = projection.apply(row)
+                if row is None:
+                    continue
+            outfile.write('\t'.join(row) + '\n')
+
+
+"""
+Merges the VCF files in paths into outpath, one row per site, where a
+site is a (contig, position, ref, alt) tuple. Sites are ordered by the
+contig order of the reference (see contig_order), then position, ref and
+alt; the inputs must already be in that order. names gives the name of
+each input (see vname), and the columns of its samples are named
+<sample>.<name>, so samples of the same name stay apart. select
+projects the merged columns as it goes, see merge_inputs. The inputs may
+be compressed; outpath is compressed (by threads threads) and indexed if
+its name ends with .gz.
+"""
+def merge(paths, outpath, reference, names=None, select=None, threads=1):
+    if names is None:
+        names = map(vname, paths)
+    order = contig_order(reference)
+    if order is None:
+        #Without an index, go by the contig lines of the headers.
+        order = header_order(paths)
+    merge_inputs([Input(p, n) for p, n in zip(paths, names)], outpath,
+                 order, select, threads)
+    if outpath.endswith('.gz'):
+        index(outpath)
+
+
+"""
+Finds where the records of each contig start in a VCF file sorted in
+reference order, by bisecting its byte offsets rather than reading it.
+ranks are the ranks of all of the contigs, in increasing order.
+Returns a {rank: (start, end)} dictionary of the byte offsets between
+which the records of each contig lie (start == end if there are none).
+"""
+def contig_spans(path, ranks, order):
+    with open(path, 'rb') as vcf:
+        body = 0
+        for line in iter(vcf.readline, b''):
+            if not line.startswith(b'#'):
+                break
+            body += len(line)
+        size = os.fstat(vcf.fileno()).st_size
+
+        #The rank of the first record starting at or after offset.
+        def rank_at(offset):
+            if offset > body:
+                vcf.seek(offset - 1)
+                vcf.readline()
+            else:
+                vcf.seek(body)
+            start = vcf.tell()
+            line = vcf.readline()
+            if not line:
+                return None, start
+            contig = line.split(b'\t', 1)[0].decode('ascii')
+            if contig not in order:
+                raise ValueError('{} has records on {}, which is not in the'
+                                 ' reference'.format(path, contig))
+            return order[contig], start
+
+        #The offset of the first record of a rank at least as high.
+        def first_of(rank):
+            low, high = body, size
+            while low < high:
+                middle = (low + high) // 2
+                found = rank_at(middle)[0]
+                if found is None or found >= rank:
+                    high = middle
+                else:
+                    low = middle + 1
+            return rank_at(low)[1]
+
+        starts = [first_of(r) for r in ranks]
+    #Each contig ends where the next one starts.
+    return dict((r, (s, e)) for r, s, e in zip(ranks, starts,
+                                                starts[1:] + [size]))
+
+
+"""
+Merges a group of inputs, given as (path, name, span) tuples (see Input),
+into outpath, opening them only for the merge.
+"""
+def merge_group(group, outpath, order, select=None):
+    inputs = []
+    try:
+        for path, name, span in group:
+            inputs.append(Input(path, name, span))
+        merge_inputs(inputs, outpath, order, select)
+    finally:
+        for vcf in inputs:
+            vcf.close()
+
+
+"""
+Merges the contig of the given rank of every VCF in paths (spans holds
+the span of the contig in each of them, see contig_spans) into outpath.
+With fan_in, no more than fan_in files are open and merged at once: the
+VCFs are merged in groups of fan_in, those results again in groups, and
+so on, bounding the records held in memory and the files open.
+Intermediate results are written to tmpdir. select only applies to the
+final merge.
+"""
+def merge_partition(paths, names, spans, rank, outpath, order, select=None,
+                    fan_in=0, tmpdir='.'):
+    inputs = list(zip(paths, names, spans))
+    level = 0
+    while fan_in > 1 and len(inputs) > fan_in:
+        merged = []
+        for first in range(0, len(inputs), fan_in):
+            group = inputs[first:first + fan_in]
+            path = os.path.join(tmpdir, 'part{}.{}.{}.vcf'
+                                .format(rank, level, first // fan_in))
+            merge_group(group, path, order)
+            members = [m for p, n, s in group
+                       for m in (n if isinstance(n, list) else [n])]
+            merged.append((path, members, None))
+        #The previous level's results are no longer needed.
+        for path, name, span in inputs:
+            if isinstance(name, list):
+                os.unlink(path)
+        inputs = merged
+        level += 1
+    merge_group(inputs, outpath, order, select)
+    for path, name, span in inputs:
+        if isinstance(name, list):
+            os.unlink(path)
+    return outpath
+
+
+"""
+Scatter-gather version of merge: the merge is split by contig, the
+contigs are merged by a pool of jobs processes (see merge_partition for
+fan_in), and the per-contig results are then concatenated in reference
+order. Gives the same result as merge. Compressed inputs can't be
+bisected, so they are merged by merge, in a single process.
+"""
+def scatter_merge(paths, outpath, reference, names=None, select=None, jobs=1,
+                  fan_in=0):
+    if names is None:
+        names = map(vname, paths)
+    if any(is_gzip(p) for p in paths):
+        sys.stderr.write('Some of the VCFs are compressed, merging them in'
+                         ' a single process\n')
+        merge(paths, outpath, reference, names, select, jobs)
+        return
+    order = contig_order(reference)
+    if order is None:
+        order = header_order(paths)
+    ranks = sorted(order.values())
+    spans = [contig_spans(p, ranks, order) for p in paths]
+    #Contigs without a single record are left out.
+    ranks = [r for r in ranks if any(s[r][0] < s[r][1] for s in spans)]
+    tmpdir = tempfile.mkdtemp(prefix='vcfmerge', dir=os.path.dirname(
+        os.path.abspath(outpath)))
+    try:
+        pool = multiprocessing.Pool(max(1, jobs))
+        results = [pool.apply_async(merge_partition, (
+            paths, names, [s[r] for s in spans], r,
+            os.path.join(tmpdir, '{}.vcf'.format(r)), order, select, fan_in,
+            tmpdir)) for r in ranks]
+        pool.close()
+        pool.join()
+        parts = [r.get() for r in results]
+        if not parts:
+            #Nothing to scatter, but the header is still wanted.
+            merge(paths, outpath, reference, names, select, jobs)
+        else:
+            concatenate(parts, outpath, jobs)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+    "vcfproject.py", by Sean Soderman
+    Keeps or drops the sample columns of a VCF file by name or pattern,
+    and optionally drops the sites where none of the remaining samples has
+    a genotype. The columns are resolved once from the #CHROM line, so each
+    record is split only once and rejoined from a list of indices.
+"""
+import fnmatch
+import shutil
+from bgzf import index, open_output, open_vcf
+
+"""
+The number of fixed columns (up to and including FORMAT) of a VCF file.
+"""
+NFIXED = 9
+
+"""
+The size of the buffers the files are read and written through.
+"""
+BUFFER = 1 << 20
+
+
+"""
+Whether a column name matches one of the given shell-style patterns.
+"""
+def matches(name, patterns):
+    return any(fnmatch.fnmatchcase(name, p) for p in patterns)
+
+
+"""
+Whether a genotype (the GT field of a sample) is missing, as in '.',
+'./.' or '.|.'.
+"""
+def missing_genotype(genotype):
+    return genotype.replace('/', '').replace('|', '').strip('.') == ''
+
+
+"""
+Returns the index-th field of a sample column, '.' if it is left out.
+"""
+def sample_field(sample, index):
+    values = sample.split(':')
+    return values[index] if index < len(values) else '.'
+
+
+class Projection(object):
+    """
+    A selection of the sample columns of a VCF, given the column names of
+    its #CHROM line. If keep is given, only the samples matching one of its
+    patterns are kept; samples matching one of the patterns in drop are
+    then left out. With drop_missing, sites where every kept sample's
+    genotype is missing are dropped.
+    """
+    def __init__(self, columns, keep=None, drop=None, drop_missing=False):
+        self.columns = columns
+        samples = list(range(NFIXED, len(columns)))
+        if keep:
+            samples = [i for i in samples if matches(columns[i], keep)]
+        if drop:
+            samples = [i for i in samples if not matches(columns[i], drop)]
+        self.samples = samples
+        self.indices = list(range(NFIXED)) + samples
+        self.drop_missing = drop_missing
+
+    """
+    Whether the projection leaves the columns as they are.
+    """
+    @property
+    def identity(self):
+        return (not self.drop_missing
+                and len(self.indices) == len(self.columns))
+
+    """
+    The projected column names.
+    """
+    def header(self):
+        return [self.columns[i] for i in self.indices]
+
+    """
+    Projects the fields of a record. Returns None if the record is
+    dropped.
+    """
+    def apply(self, fields):
+        if self.drop_missing and len(fields) > NFIXED:
+            keys = fields[8].split(':')
+            if 'GT' in keys:
+                gt = keys.index('GT')
+                if all(missing_genotype(sample_field(fields[i], gt))
+                       for i in self.samples):
+                    return None
+        return [fields[i] for i in self.indices]
+
+
+"""
+Copies the VCF infile to the VCF outfile through a Projection built from
+its #CHROM line with the given keep, drop and drop_missing (see
+Projection). Returns the projection. Files are read and written through
+large buffers. Either may be compressed; outfile is compressed (by
+threads threads) and indexed if its name ends with .gz.
+"""
+def project(infile, outfile, keep=None, drop=None, drop_missing=False,
+            threads=1):
+    projection = copy_projected(infile, outfile, keep, drop, drop_missing,
+                                threads)
+    if outfile.endswith('.gz'):
+        index(outfile)
+    return projection
+
+
+"""
+The copy done by project, without the indexing.
+"""
+def copy_projected(infile, outfile, keep, drop, drop_missing, threads):
+    with open_vcf(infile, BUFFER) as orig, \
+            open_output(outfile, threads, BUFFER) as new:
+        projection = None
+        #Read line by line, so the rest can be copied in blocks.
+        for line in iter(orig.readline, ''):
+            if line.startswith('##'):
+                new.write(line)
+                continue
+            projection = Projection(line.rstrip('\n').split('\t'), keep,
+                                    drop, drop_missing)
+            new.write('\t'.join(projection.header()) + '\n')
+            break
+        if projection is None:
+            return None
+        if projection.identity:
+            shutil.copyfileobj(orig, new, BUFFER)
+            return projection
+        apply = projection.apply
+        for line in orig:
+            fields = apply(line.rstrip('\n').split('\t'))
+            if fields is not None:
+                new.write('\t'.join(fields) + '\n')
+    return projection
@@ -5,51 +5,70 @@
 """
 import argparse
 import os
-import subprocess
 import sys
+from executor import (add_arguments, find_bams, java, jvm_jobs, run,
+                      run_all)
 
-
-parser = argparse.ArgumentParser(description=('Tool for adding read group'
-                                             ' information to all files within'
-                                             ' a directory'))
-parser.add_argument('-d', '--inputdir', type=str,
-                    help=('A directory containing the BAM files to add read'
-                         'groups to.'), required=True, metavar='input_dir')
-
-parser.add_argument('--info', type=str, 
-                    help=('Arguments for '
-                          ' AddOrReplaceReadGroups to use.'
-                          ' Inserts dummy data by default.'
-                          ' The arguments may be in any order you desire,'
-                          ' but must be in the form rg_field=value.'),
-                    nargs=5, 
-                    default=['rgid=group1', 'rglb=lib1', 'rgpl=illumina',
-                             'rgpu=unit1', 'rgsm=sample1'],
-                    metavar=('rgid', 'rglb', 'rgpl', 'rgpu', 'rgsm'))
-
-parser.add_argument('-p', '--picard_path', type=str,
-                    help=('The complete path to the picard jar file.'
-                          ' Default: a file called picard.jar in '
-                          ' the current working directory'),
-                    default='picard.jar', metavar='path_to_picard')
-args = parser.parse_args()
-
-picard_cmd = ('java -jar {picard_path} INPUT={{bam}} OUTPUT={{bam}}'
+picard_cmd = ('{java} INPUT={{bam}} OUTPUT={{out}}'
               ' RGID={rgid} RGLB={rglb} RGPL={rgpl} RGPU={rgpu}'
               ' RGSM={rgsm}')
-#Transform RG info from command line into dictionary after popping
-#it from the argument dict, then add it back to arg dict.
-argdict = vars(args)
-rgs = {opt: arg for opt, arg in [t.split('=') for t in argdict.pop('info')]}
 
-argdict.update(rgs)
 
-picard_cmd = picard_cmd.format(**argdict)
+"""
+Adds the read group of the Picard command cmd to a BAM file, through a
+temporary file next to it (Picard can't write over its own input), which
+then replaces it.
+"""
+def add_groups(bam, log, cmd):
+    temp = bam + '.addgroups.tmp.bam'
+    try:
+        run(cmd.format(bam=bam, out=temp), log)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    os.rename(temp, bam)
+    return 'read groups replaced'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=('Tool for adding read'
+                                                  ' group information to'
+                                                  ' all files within a'
+                                                  ' directory'))
+    parser.add_argument('-d', '--inputdir', type=str,
+                        help=('A directory containing the BAM files to add'
+                              ' read groups to.'), required=True,
+                        metavar='input_dir')
+
+    parser.add_argument('--info', type=str,
+                        help=('Arguments for '
+                              ' AddOrReplaceReadGroups to use.'
+                              ' Inserts dummy data by default.'
+                              ' The arguments may be in any order you'
+                              ' desire, but must be in the form'
+                              ' rg_field=value.'),
+                        nargs=5,
+                        default=['rgid=group1', 'rglb=lib1', 'rgpl=illumina',
+                                 'rgpu=unit1', 'rgsm=sample1'],
+                        metavar=('rgid', 'rglb', 'rgpl', 'rgpu', 'rgsm'))
+
+    parser.add_argument('-p', '--picard_path', type=str,
+                        help=('The complete path to the picard jar file.'
+                              ' Default: a file called picard.jar in '
+                              ' the current working directory'),
+                        default='picard.jar', metavar='path_to_picard')
+    add_arguments(parser, jvm=True)
+    args = parser.parse_args()
 
-#I use a generator just in case this is a massive directory...
-bams = (os.path.join(args.inputdir, x) for x in 
-        os.listdir(args.inputdir) if x.endswith('bam'))
+    if not os.path.isdir(args.inputdir):
+        sys.stderr.write('Please specify an existent directory of BAM'
+                         ' files.\n')
+        sys.exit(1)
+    #Transform RG info from command line into a dictionary.
+    rgs = dict(t.split('=', 1) for t in args.info)
+    jobs = jvm_jobs(max(1, args.jobs), args.mem, args.mem_budget)
+    cmd = picard_cmd.format(java=java(args.picard_path, args.mem), **rgs)
 
-for bam in bams:
-    #print(picard_cmd.format(bam=bam)) #Just for testing..
-    subprocess.check_output(picard_cmd.format(bam=bam).split())
+    if run_all('addgroups', add_groups, find_bams(args.inputdir), (cmd,),
+               jobs, args.logdir, rgs, args.force):
+        sys.exit(1)
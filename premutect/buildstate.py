@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+    "buildstate.py", by Sean Soderman
+    Remembers the premutect steps run on each BAM file, and with which
+    parameters, in a state file next to it (<file>.bam.state.json), so
+    that a step run again only processes the files it hasn't processed
+    with the same parameters since they last changed. Like make, a step is
+    also redone when a step before it (in STEPS) was run after it, or when
+    the file was changed by anything else, as told by its size and
+    modification time.
+"""
+import json
+import os
+import sys
+#The file stamps are shared with the sequence cache.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'postmutect'))
+from seqcache import index_path, stamp
+
+"""
+The steps in the order they are meant to be run. Each depends on all of
+those before it.
+"""
+STEPS = ['addgroups', 'reorder_all', 'prepare', 'mapqto0', 'reindex']
+
+"""
+The steps whose output is the BAM file's index, so they are also redone
+when the index changed.
+"""
+INDEXING = set(['reindex'])
+
+
+"""
+Returns the path of a BAM file's state file.
+"""
+def state_path(bam):
+    return bam + '.state.json'
+
+
+"""
+Reads a BAM file's state: the stamp of the file when a step last finished
+with it, the number of steps run so far, and for each step run, its
+parameters and its number in that sequence.
+"""
+def load(bam):
+    try:
+        with open(state_path(bam), 'r') as statefile:
+            return json.load(statefile)
+    except (IOError, OSError, ValueError):
+        return {'bam': None, 'serial': 0, 'steps': {}}
+
+
+"""
+Writes a BAM file's state atomically, so an interrupted step never leaves
+half of it behind.
+"""
+def save(bam, state):
+    temp = state_path(bam) + '.tmp'
+    with open(temp, 'w') as statefile:
+        json.dump(state, statefile)
+    os.rename(temp, state_path(bam))
+
+
+"""
+Puts parameters in the form they take in a state file (tuples become
+lists, and so on), so they can be compared to those read back.
+"""
+def normalize(params):
+    return json.loads(json.dumps(params))
+
+
+"""
+Whether a BAM file is as its state last recorded it, that is, nothing but
+the steps changed it.
+"""
+def current(bam):
+    return load(bam)['bam'] == stamp(bam)
+
+
+"""
+Whether a step was already run on a BAM file with the same parameters, and
+neither the file nor the steps before it changed since.
+"""
+def up_to_date(bam, step, params):
+    state = load(bam)
+    record = state['steps'].get(step)
+    if record is None or record['params'] != normalize(params):
+        return False
+    if state['bam'] != stamp(bam):
+        return False
+    for earlier in STEPS[:STEPS.index(step)]:
+        other = state['steps'].get(earlier)
+        if other is not None and other['serial'] > record['serial']:
+            return False
+    if step in INDEXING and record.get('index') != stamp(index_path(bam)):
+        return False
+    return True
+
+
+"""
+Records that a step finished with a BAM file, with the given parameters.
+If the file wasn't current (see current) when the step started, the other
+steps' records no longer describe it, so they are forgotten.
+"""
+def record(bam, step, params, was_current=True):
+    state = load(bam)
+    if not was_current:
+        state['steps'] = {}
+    state['serial'] += 1
+    entry = {'params': normalize(params), 'serial': state['serial']}
+    if step in INDEXING:
+        entry['index'] = stamp(index_path(bam))
+    state['steps'][step] = entry
+    state['bam'] = stamp(bam)
+    save(bam, state)
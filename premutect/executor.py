@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""
+    "executor.py", by Sean Soderman
+    Runs a premutect step over the BAM files of a directory, several files
+    at a time. Each file's output goes to its own log, a file that fails
+    doesn't stop the others, and a summary of the successes and failures
+    is printed at the end. Steps running a JVM are limited to as many
+    files at once as their heaps fit in memory. Files a step already
+    processed, with the same parameters, are skipped (see buildstate.py).
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+#The memory accounting is shared with multimutect's scheduler.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'multimutect'))
+from scheduler import JVM_OVERHEAD, available_memory, jvm_caps
+from buildstate import current, record, up_to_date
+
+
+"""
+Adds the executor's options to an argparse parser: the number of files
+processed at once, the directory of the logs, whether to process files
+that are up to date and, for steps running a JVM, the heap of each JVM and
+the memory all of them may use.
+"""
+def add_arguments(parser, jvm=False):
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help=('The number of BAM files processed at once.'
+                              ' Default: the number of cores'))
+
+    parser.add_argument('--logdir', type=str,
+                        help=('The directory of the log of each BAM file.'
+                              ' Default: next to each BAM file'))
+
+    parser.add_argument('--force', action='store_true',
+                        help=('Process every BAM file, even those already'
+                              ' processed with the same parameters since'
+                              ' they last changed.'))
+    if not jvm:
+        return
+    parser.add_argument('--mem', type=int, default=2,
+                        help=('The heap of each JVM, in gigabytes.'
+                              ' Default: 2'))
+
+    parser.add_argument('--mem_budget', type=int,
+                        help=('The memory all JVMs together may use, in'
+                              ' gigabytes, limiting the number of files'
+                              ' processed at once. Default: the memory'
+                              ' available'))
+
+
+"""
+Returns the paths of the BAM files in a directory (and its subdirectories
+if recursive), leaving out the temporary files of interrupted steps.
+"""
+def find_bams(directory, recursive=False):
+    bams = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        bams.extend(os.path.join(dirpath, f) for f in sorted(filenames)
+                    if f.endswith('.bam') and not f.endswith('.tmp.bam'))
+        if not recursive:
+            break
+    return bams
+
+
+"""
+Returns the number of JVMs with a heap of heap gigabytes to run at once:
+at most jobs, and no more than fit in budget gigabytes (by default, the
+memory available now), as each also uses JVM_OVERHEAD megabytes beyond
+its heap.
+"""
+def jvm_jobs(jobs, heap, budget=None):
+    budget = available_memory() if budget is None else budget * 1024
+    return max(1, min(jobs, budget // (heap * 1024 + JVM_OVERHEAD)))
+
+
+"""
+Returns the start of a command running a jar with a heap of heap
+gigabytes, and its garbage collector and compiler sized to threads CPUs.
+"""
+def java(jar, heap, threads=1):
+    return 'java -Xmx{}g {} -jar {}'.format(heap, jvm_caps(threads), jar)
+
+
+"""
+Returns the path of the log of a step on a BAM file: <bam>.<step>.log, in
+logdir or next to the BAM file.
+"""
+def log_path(bam, step, logdir=None):
+    directory = logdir if logdir is not None else os.path.dirname(bam)
+    return os.path.join(directory, '{}.{}.log'.format(os.path.basename(bam),
+                                                      step))
+
+
+"""
+Runs a command (split on whitespace) with its output appended to the file
+log. Raises a CalledProcessError if it fails.
+"""
+def run(cmd, log):
+    with open(log, 'a') as logfile:
+        status = subprocess.call(cmd.split(), stdout=logfile,
+                                 stderr=subprocess.STDOUT)
+    if status != 0:
+        raise subprocess.CalledProcessError(status, cmd)
+
+
+"""
+Runs a step's function on a single file in a worker process. If params is
+given, the file is skipped when its state says the step is up to date
+(unless force is set), and the step is recorded in its state once done.
+Returns the file's path, along with the function's result or the error
+that stopped it (which is also written to the log).
+"""
+def work(task):
+    step, function, bam, log, extra, params, force = task
+    try:
+        if params is not None:
+            if not force and up_to_date(bam, step, params):
+                return bam, 'up to date', None
+            was_current = current(bam)
+        result = function(bam, log, *extra)
+        if params is not None:
+            record(bam, step, params, was_current)
+        return bam, result, None
+    except (IOError, OSError, ValueError, subprocess.CalledProcessError) as E:
+        with open(log, 'a') as logfile:
+            logfile.write('Error: {}\n'.format(E))
+        return bam, None, str(E)
+
+
+"""
+Runs function(bam, log, *extra) on each of bams, in up to jobs worker
+processes at a time. log is the path of the file's log (see log_path),
+for the function to run its commands with (see run). The function returns
+a description of what it did, which is printed. Prints a summary of the
+files that failed, along with their logs, once all are done. If params
+(the step's parameters, anything JSON can hold) is given, files the step
+already processed with the same parameters are skipped unless force is
+set (see buildstate.up_to_date). Returns the paths of the files that
+failed.
+"""
+def run_all(step, function, bams, extra=(), jobs=1, logdir=None,
+            params=None, force=False):
+    if logdir is not None and not os.path.isdir(logdir):
+        os.makedirs(logdir)
+    tasks = [(step, function, bam, log_path(bam, step, logdir),
+              tuple(extra), params, force) for bam in bams]
+    failed = []
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap_unordered(work, tasks)
+    else:
+        results = (work(task) for task in tasks)
+    logs = dict((task[2], task[3]) for task in tasks)
+    try:
+        for bam, result, error in results:
+            if error is not None:
+                sys.stderr.write('{}: {} failed: {}\n'
+                                 .format(step, bam, error))
+                failed.append(bam)
+            else:
+                print('{}: {}: {}'.format(step, bam, result))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print('{}: {} of {} files succeeded'.format(step,
+                                                len(tasks) - len(failed),
+                                                len(tasks)))
+    for bam in failed:
+        sys.stderr.write('{}: failed: {} (log: {})\n'
+                         .format(step, bam, logs[bam]))
+    return failed
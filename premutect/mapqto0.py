@@ -4,59 +4,299 @@
 Sets the MAPQ value of all unmapped reads to zero for each bam file in the
 specified directory.
 """
+import argparse
+import bisect
+import re
+import shutil
+import struct
 import sys
 import os
-#Some preamble code:
-#Check for packages that have pysam as a subdirectory and push them to
-#the end of sys.path to avoid any possibility of the wrong pysam version
-#being used.
-for i in range(0, len(sys.path)):
-    traversed = []
-    for dirpath, dirnames, filenames in os.walk(sys.path[i]):
-        for dir in dirnames:
-            if 'pysam' == dir and not dirpath.endswith('site-packages'):
-                if dirpath not in traversed:
-                    sys.path.append(sys.path.pop(i))
-                    traversed.append(dirpath)
+from multiprocessing.pool import ThreadPool
+#The BGZF routines live with the postprocessing tools.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'postmutect'))
+#Avoid any possibility of the wrong pysam version being used.
+from pysampath import resolve_pysam
+resolve_pysam()
 try:
+    import pysam
     from pysam import AlignmentFile
+    from bgzf import compress_block, inflate, read_block
+    from executor import add_arguments, find_bams, run_all
+    from prepare import has_mapqs
 except ImportError as I:
     sys.stderr.write('Please install the necessary packages: {}'
                      .format(I))
     sys.exit(1)
-    
 
-if len(sys.argv) < 2:
-    usestr = "Usage: {} <bamdir> \n"
-    sys.stderr.write(usestr.format(sys.argv[0]))
-    sys.exit(1)
 
-def umappedq2zero(bamdir):
+"""
+The flag bit of unmapped reads.
+"""
+UNMAPPED = 4
+
+"""
+The start of a BAM record: its block_size, and (skipping the fields in
+between) its MAPQ and flag. The MAPQ is the 14th byte of the record.
+"""
+RECORD = struct.Struct('<i9xB4xH')
+MAPQ_OFFSET = 13
+
+
+class BlockPatcher(object):
+    """
+    Copies a BGZF file to outfile block by block, giving access to its
+    uncompressed contents by offset in between. Blocks are written out
+    as they were read, without recompressing them, unless one of their
+    bytes was patched. Blocks are read and written in batches, which
+    threads threads inflate and deflate at once (zlib lets go of the
+    interpreter while it works).
+    """
+    def __init__(self, infile, outfile, threads=1):
+        self.infile = infile
+        self.outfile = outfile
+        self.pool = ThreadPool(threads) if threads > 1 else None
+        self.batch = 4 * max(1, threads)
+        #[block, uncompressed data, patched] lists, and where each
+        #block's data starts in the uncompressed file.
+        self.blocks = []
+        self.starts = []
+        self.end = 0
+        #Blocks inflated ahead of being needed, in the same form.
+        self.ahead = []
+        #Released blocks waiting to be written: (block, data, patched).
+        self.released = []
+
+    """
+    Applies function to each of items, by the pool if there is one.
+    """
+    def map(self, function, items):
+        if self.pool is not None:
+            return self.pool.map(function, items)
+        return [function(item) for item in items]
+
+    """
+    Reads the next block, inflating a batch of them when none are left
+    from the last. Returns False at the end of the file.
+    """
+    def read(self):
+        if not self.ahead:
+            found = []
+            while len(found) < self.batch:
+                block = read_block(self.infile)
+                if block is None:
+                    break
+                found.append(block)
+            datas = self.map(lambda f: inflate(*f), found)
+            self.ahead = [[f[0], bytearray(d), False]
+                          for f, d in zip(found, datas)]
+            self.ahead.reverse()
+        if not self.ahead:
+            return False
+        entry = self.ahead.pop()
+        self.blocks.append(entry)
+        self.starts.append(self.end)
+        self.end += len(entry[1])
+        return True
+
+    """
+    Returns size bytes of uncompressed data from offset, or None if offset
+    is the end of the file.
+    """
+    def get(self, offset, size):
+        while offset + size > self.end:
+            if not self.read():
+                if offset == self.end:
+                    return None
+                raise ValueError('{} is truncated'.format(self.infile.name))
+        i = bisect.bisect_right(self.starts, offset) - 1
+        chunk = self.blocks[i][1][offset - self.starts[i]:][:size]
+        while len(chunk) < size:
+            i += 1
+            chunk += self.blocks[i][1][:size - len(chunk)]
+        return bytes(chunk)
+
+    """
+    Sets the uncompressed byte at offset to value.
+    """
+    def patch(self, offset, value):
+        i = bisect.bisect_right(self.starts, offset) - 1
+        self.blocks[i][1][offset - self.starts[i]] = value
+        self.blocks[i][2] = True
+
+    """
+    Releases the blocks ending at or before offset, writing them out once
+    a batch of them is gathered.
+    """
+    def release(self, offset):
+        done = 0
+        while (done < len(self.blocks)
+               and self.starts[done] + len(self.blocks[done][1]) <= offset):
+            done += 1
+        if not done:
+            return
+        self.released.extend(self.blocks[:done])
+        del self.blocks[:done]
+        del self.starts[:done]
+        if len(self.released) >= self.batch:
+            self.flush()
+
+    """
+    Writes out the released blocks, deflating the patched ones.
+    """
+    def flush(self):
+        patched = [data for block, data, changed in self.released if changed]
+        compressed = iter(self.map(lambda d: compress_block(bytes(d)),
+                                   patched))
+        for block, data, changed in self.released:
+            self.outfile.write(next(compressed) if changed else block)
+        self.released = []
+
+    """
+    Writes out the blocks left and copies the rest of the file.
+    """
+    def close(self):
+        self.release(self.end)
+        self.released.extend(self.ahead[::-1])
+        self.ahead = []
+        self.flush()
+        shutil.copyfileobj(self.infile, self.outfile)
+        if self.pool is not None:
+            self.pool.close()
+
+
+"""
+Sets the MAPQ of the unmapped reads of a BAM file to zero through a
+BlockPatcher, reading only the start of each record (no read is decoded).
+Returns the number of reads changed.
+"""
+def patch_mapqs(patcher):
+    magic, l_text = struct.unpack('<4si', patcher.get(0, 8))
+    if magic != b'BAM\1':
+        raise ValueError('{} is not a BAM file'.format(patcher.infile.name))
+    position = 8 + l_text
+    n_ref = struct.unpack('<i', patcher.get(position, 4))[0]
+    position += 4
+    for i in range(n_ref):
+        l_name = struct.unpack('<i', patcher.get(position, 4))[0]
+        position += 8 + l_name
+    get, release, unpack = patcher.get, patcher.release, RECORD.unpack
+    changed = 0
+    while True:
+        start = get(position, RECORD.size)
+        if start is None:
+            break
+        size, mapq, flag = unpack(start)
+        if flag & UNMAPPED and mapq:
+            patcher.patch(position + MAPQ_OFFSET, 0)
+            changed += 1
+        position += 4 + size
+        release(position)
+    patcher.close()
+    return changed
+
+
+"""
+Whether a BAM file has an unmapped read with a nonzero MAPQ (see
+prepare.has_mapqs).
+"""
+def check(bam, threads=1):
+    with AlignmentFile(bam, 'rb', threads=threads) as inbam:
+        return has_mapqs(inbam)
+
+
+def mapq2zero(bam, threads=1):
     """
     Reads in a BAM file, setting the MAPQ value for an alignment segment
     to zero if it is unmapped.
-    Opens up both infile and outfile and outputs these modified
-    reads to outfile.
+    Indexed files are checked first (see check), and left alone if
+    no unmapped read has a nonzero MAPQ. Otherwise the file is copied block
+    by block to a temporary file next to it, which then replaces it: only
+    the blocks holding such reads are recompressed, the rest are copied
+    as they are. If the BAM file was indexed, the index is rebuilt.
+    threads threads decompress the file while checking it, and inflate and
+    deflate its blocks while copying it.
+    Returns the number of reads changed.
+    """
+    temp = bam + '.mapqto0.tmp'
+    indexes = [bam + '.bai', re.sub(r'\.bam$', '.bai', bam)]
+    indexed = any(os.path.exists(path) for path in indexes)
+    if indexed and not check(bam, threads):
+        return 0
+    try:
+        with open(bam, 'rb') as infile, open(temp, 'wb') as outfile:
+            changed = patch_mapqs(BlockPatcher(infile, outfile,
+                                                threads))
+        if changed and indexed:
+            pysam.index(temp, temp + '.bai')
+    except:
+        for path in (temp, temp + '.bai'):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    #Unindexed files are only found to be clean once copied.
+    if not changed:
+        os.remove(temp)
+        return 0
+    #Overwrite the original with the new file with MAPQs set to zero.
+    os.rename(temp, bam)
+    if indexed:
+        if os.path.exists(indexes[1]):
+            os.remove(indexes[1])
+        os.rename(temp + '.bai', indexes[0])
+    return changed
+
+
+"""
+The executor's step: runs mapq2zero on a BAM file (or check, with
+check_only) and describes the outcome.
+"""
+def mapq2zero_step(bam, log, threads=1, check_only=False):
+    if check_only:
+        return 'needs rewriting' if check(bam, threads) else 'clean'
+    changed = mapq2zero(bam, threads)
+    if changed:
+        return 'set the MAPQ of {} unmapped reads to 0'.format(changed)
+    return 'clean, left alone'
+
+
+def umappedq2zero(bamdir, jobs=1, threads=1, check_only=False, logdir=None,
+                  force=False):
+    """
+    Sets the MAPQ of the unmapped reads of each BAM file in bamdir to zero
+    with mapq2zero, in up to jobs worker processes at a time, each using
+    threads threads for decompression and compression. With check_only,
+    only reports which files need it. Files already done since they last
+    changed are skipped unless force is set. Returns the paths of the
+    files that could not be rewritten (or checked).
     """
     if not os.path.exists(bamdir):
         sys.stderr.write('Sorry, but the specified directory does not exist.')
         sys.exit(1)
-
-    bamfiles = os.listdir(bamdir)
-    bampaths = filter(lambda x: x.endswith('.bam'), bamfiles)
-    bampaths = map(lambda x: os.path.join(bamdir, x), bampaths)
-    for bam in bampaths:
-        inbam = AlignmentFile(bam, 'rb')
-        #Template is specified to maintain the same header information.
-        outbam = AlignmentFile('temp.bam', 'wb', template = inbam)
-        #Construct reads iterator using fetch.
-        reads = inbam.fetch(until_eof = True)
-        for read in reads:
-            if read.is_unmapped == True:
-                read.mapping_quality = 0
-            outbam.write(read) #Don't omit any reads!
-        #Overwrite the original with the new file with MAPQs set to zero.
-        os.rename('temp.bam', bam)
+    #Checking changes nothing, so it isn't recorded.
+    params = None if check_only else {}
+    return run_all('mapqto0', mapq2zero_step, find_bams(bamdir),
+                   (threads, check_only), jobs, logdir, params, force)
 
 if __name__ == '__main__':
-    umappedq2zero(sys.argv[1])
+    parser = argparse.ArgumentParser(description=('Sets the MAPQ of all'
+                                                  ' unmapped reads to zero'
+                                                  ' for each BAM file in a'
+                                                  ' directory'))
+    parser.add_argument('bamdir', type=str,
+                        help='The directory of BAM files to rewrite')
+
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help=('The number of threads decompressing (and'
+                              ' recompressing) each BAM file while checking'
+                              ' and rewriting it. Default: 1'))
+
+    parser.add_argument('--check', action='store_true',
+                        help=('Only report which BAM files have unmapped'
+                              ' reads with a nonzero MAPQ, without'
+                              ' rewriting them.'))
+    add_arguments(parser)
+    args = parser.parse_args()
+    if umappedq2zero(args.bamdir, max(1, args.jobs), max(1, args.threads),
+                     args.check, args.logdir, args.force):
+        sys.exit(1)
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+    "prepare.py", by Sean Soderman
+    Prepares all BAM files in a directory for MuTect in a single pass per
+    file: read groups are added or replaced (as addgroups.py does), contigs
+    are put in the order of the FASTA reference (as reorder_all.py does),
+    the MAPQ of unmapped reads is set to zero (as mapqto0.py does), and the
+    result is indexed (as reindex.py does). Each file is decompressed and
+    recompressed once, by several threads, instead of once per step.
+"""
+import argparse
+import os
+import re
+import sys
+#The sequence cache lives with the postprocessing tools.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir, 'postmutect'))
+from pysampath import resolve_pysam
+resolve_pysam()
+try:
+    import pysam
+    from pysam import AlignmentFile
+    from seqcache import SeqCache
+    from executor import add_arguments, find_bams, run_all
+except ImportError as I:
+    sys.stderr.write('Please install the necessary packages: {}\n'
+                     .format(I))
+    sys.exit(1)
+
+
+"""
+Turns addgroups.py style read group arguments (rgid=group1 rglb=lib1 ...)
+into the fields of an @RG header line ({'ID': 'group1', 'LB': 'lib1'...}).
+"""
+def parse_groups(info):
+    fields = {}
+    for arg in info:
+        opt, value = arg.split('=', 1)
+        fields[re.sub('^rg', '', opt.lower()).upper()] = value
+    if 'ID' not in fields:
+        raise ValueError('read group arguments need an rgid')
+    return fields
+
+
+"""
+Builds the header of a prepared BAM file from the header of the original
+(as a dictionary) and the SeqInfo of the reference: the contigs of the
+original that are in the reference, in the reference's order, and group
+as its only read group if given. Also returns a list mapping each contig
+(reference ID) of the original to the one it becomes, or -1 if it is
+dropped. Raises a ValueError if a contig's length differs from the
+reference's.
+"""
+def reorder_header(header, reference, group=None):
+    header = dict(header)
+    contigs = header.get('SQ', [])
+    ranks = dict((c, i) for i, c in enumerate(reference.references))
+    lengths = dict(zip(reference.references, reference.lengths))
+    for sq in contigs:
+        if sq['SN'] in lengths and sq['LN'] != lengths[sq['SN']]:
+            raise ValueError('contig {} is {} bases long, but {} in the'
+                             ' reference'.format(sq['SN'], sq['LN'],
+                                                 lengths[sq['SN']]))
+    kept = sorted((sq for sq in contigs if sq['SN'] in ranks),
+                  key=lambda sq: ranks[sq['SN']])
+    new_tid = dict((sq['SN'], tid) for tid, sq in enumerate(kept))
+    tidmap = [new_tid.get(sq['SN'], -1) for sq in contigs]
+    header['SQ'] = kept
+    if group is not None:
+        header['RG'] = [group]
+    return header, tidmap
+
+
+"""
+Whether the contigs kept by a tidmap (see reorder_header) are already in
+the reference's order, so the reads can be copied as they come.
+"""
+def in_order(tidmap):
+    kept = [tid for tid in tidmap if tid >= 0]
+    return kept == sorted(kept)
+
+
+"""
+Returns the reference ID of the last contig with any reads in an indexed
+BAM file, or None if no read is placed on a contig.
+"""
+def last_placed(inbam):
+    last = None
+    for stat in inbam.get_index_statistics():
+        if stat.total > 0:
+            last = inbam.get_tid(stat.contig)
+    return last
+
+
+"""
+Yields the unplaced unmapped reads (those without a contig), which come
+last in a sorted BAM file. offset is the virtual file offset just past the
+last placed read, if known; otherwise it is found by reading the last
+contig with reads, found through the index.
+"""
+def unplaced(inbam, offset=None):
+    if offset is None:
+        last = last_placed(inbam)
+        if last is None:
+            inbam.reset()
+        else:
+            tell = inbam.tell
+            for read in inbam.fetch(inbam.references[last]):
+                offset = tell()
+    if offset is not None:
+        inbam.seek(offset)
+    for read in inbam.fetch(until_eof=True):
+        if read.reference_id < 0:
+            yield read
+
+
+"""
+Whether any unmapped read of an indexed BAM file has a nonzero MAPQ. Only
+the contigs the index counts unmapped reads on are read, along with the
+unplaced reads at the end of the file, and reading stops at the first
+such read.
+"""
+def needs_rewrite(inbam):
+    for stat in inbam.get_index_statistics():
+        if stat.unmapped:
+            for read in inbam.fetch(stat.contig):
+                if read.is_unmapped and read.mapping_quality:
+                    return True
+    for read in unplaced(inbam):
+        if read.mapping_quality:
+            return True
+    return False
+
+
+"""
+Whether a BAM file has an unmapped read with a nonzero MAPQ, through its
+index if it has one (see needs_rewrite), otherwise by reading it to the
+first such read. Leaves the file to be read again from its start.
+"""
+def has_mapqs(inbam):
+    found = False
+    if inbam.has_index():
+        found = needs_rewrite(inbam)
+    else:
+        for read in inbam.fetch(until_eof=True):
+            if read.is_unmapped and read.mapping_quality:
+                found = True
+                break
+    inbam.reset()
+    return found
+
+
+"""
+Yields the reads of an indexed, sorted BAM file with its contigs in the
+order given by a tidmap (see reorder_header), fetching them contig by
+contig, followed by the unplaced reads. Reads on dropped contigs are left
+out. No sorting is needed, as each contig is already sorted.
+"""
+def reordered(inbam, tidmap):
+    order = sorted((tid for tid in range(len(tidmap)) if tidmap[tid] >= 0),
+                   key=lambda tid: tidmap[tid])
+    last = last_placed(inbam)
+    offset = None
+    for tid in order:
+        reads = inbam.fetch(inbam.references[tid])
+        if tid != last:
+            for read in reads:
+                yield read
+            continue
+        #Remember where the unplaced reads start, to jump back there.
+        tell = inbam.tell
+        for read in reads:
+            yield read
+            offset = tell()
+    #If the last contig was dropped, unplaced finds its end anew.
+    for read in unplaced(inbam, offset):
+        yield read
+
+
+"""
+Writes reads to outbam with their contigs (and their mates') renumbered
+through tidmap, the MAPQ of unmapped reads set to zero (unless zero_mapq
+is False) and, if rgid is given, their read group set to it. Reads on
+dropped contigs are left out. Returns the number of reads written and the
+number left out.
+"""
+def rewrite(reads, outbam, tidmap, rgid=None, zero_mapq=True):
+    write = outbam.write
+    written = dropped = 0
+    for read in reads:
+        tid = read.reference_id
+        if tid >= 0:
+            tid = tidmap[tid]
+            if tid < 0:
+                dropped += 1
+                continue
+            read.reference_id = tid
+        mate = read.next_reference_id
+        if mate >= 0:
+            mate = tidmap[mate]
+            read.next_reference_id = mate
+            if mate < 0:
+                read.next_reference_start = -1
+        if zero_mapq and read.is_unmapped:
+            read.mapping_quality = 0
+        if rgid is not None:
+            read.set_tag('RG', rgid, 'Z')
+        write(read)
+        written += 1
+    return written, dropped
+
+
+"""
+Returns the header of an open AlignmentFile as a dictionary.
+"""
+def header_dict(inbam):
+    header = inbam.header
+    if hasattr(header, 'to_dict'):
+        return header.to_dict()
+    return dict(header)
+
+
+"""
+Prepares a single BAM file for MuTect in one pass (see the module's
+description), replacing it and its index. reference is the SeqInfo of the
+FASTA reference, group the fields of the read group to give every read
+(or None to leave read groups alone), and threads the number of threads
+compressing and decompressing the file. With zero_mapq False, MAPQs are
+left alone, so the file is only reordered. BAM files whose contigs are
+out of the reference's order must be indexed, so they can be read contig
+by contig. The result is written to a temporary file next to the
+original, which is only replaced once it is complete. Returns the number
+of reads written and the number dropped (for contigs missing from the
+reference), or None if the file was left alone (only indexed, if it
+wasn't), as it already had its contigs in the reference's order, no read
+group to set and (with zero_mapq) no unmapped read with a nonzero MAPQ.
+"""
+def prepare(bam, reference, group=None, threads=1, zero_mapq=True):
+    temp = re.sub(r'\.bam$', '', bam) + '.prepare.tmp.bam'
+    rgid = group['ID'] if group is not None else None
+    try:
+        with AlignmentFile(bam, 'rb', threads=threads) as inbam:
+            header, tidmap = reorder_header(header_dict(inbam), reference,
+                                            group)
+            if (tidmap == list(range(len(tidmap))) and group is None
+                    and not (zero_mapq and has_mapqs(inbam))):
+                if not inbam.has_index():
+                    pysam.index(bam)
+                return None
+            #Reads on dropped contigs aren't even read when reordering.
+            skipped = 0
+            if in_order(tidmap):
+                reads = inbam.fetch(until_eof=True)
+            elif inbam.has_index():
+                reads = reordered(inbam, tidmap)
+                skipped = sum(s.total for s in inbam.get_index_statistics()
+                              if tidmap[inbam.get_tid(s.contig)] < 0)
+            else:
+                raise ValueError('contigs are out of the reference\'s order'
+                                 ' and there is no index to reorder them'
+                                 ' with; run reorder_all.py first')
+            with AlignmentFile(temp, 'wb', header=header,
+                               threads=threads) as outbam:
+                written, dropped = rewrite(reads, outbam, tidmap, rgid,
+                                           zero_mapq)
+        #Index the new file before it replaces the original, so the
+        #original's index is never left describing the wrong file.
+        pysam.index(temp, temp + '.bai')
+    except:
+        for path in (temp, temp + '.bai'):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    stale = re.sub(r'\.bam$', '.bai', bam)
+    if stale != bam and os.path.exists(stale):
+        os.remove(stale)
+    os.rename(temp, bam)
+    os.rename(temp + '.bai', bam + '.bai')
+    return written, dropped + skipped
+
+
+"""
+The executor's step: runs prepare on a BAM file and describes the outcome.
+"""
+def prepare_step(bam, log, reference, group=None, threads=1):
+    prepared = prepare(bam, reference, group, threads)
+    if prepared is None:
+        return 'already prepared, left alone'
+    written, dropped = prepared
+    if dropped:
+        return ('{} reads, dropped {} on contigs missing from the reference'
+                .format(written, dropped))
+    return '{} reads'.format(written)
+
+
+"""
+Prepares every BAM file in a directory with prepare, up to jobs files at a
+time. Files already prepared for the same reference and read group since
+they last changed are skipped, unless force is set. Returns the paths of
+the files that could not be prepared.
+"""
+def prepare_all(directory, fasta, group=None, threads=1, jobs=1,
+                logdir=None, force=False):
+    reference = SeqCache().reference(fasta)
+    if reference is None:
+        raise ValueError('{} has no FASTA index (.fai) or sequence'
+                         ' dictionary (.dict)'.format(fasta))
+    params = {'contigs': reference.references, 'group': group}
+    return run_all('prepare', prepare_step, find_bams(directory),
+                   (reference, group, threads), jobs, logdir, params, force)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=('Prepares all BAM files'
+                                                  ' in a directory for'
+                                                  ' MuTect in a single'
+                                                  ' pass per file'))
+    parser.add_argument('-d', '--inputdir', type=str, required=True,
+                        help='A directory containing the BAM files to'
+                             ' prepare.', metavar='input_dir')
+
+    parser.add_argument('-f', '--fasta', type=str, required=True,
+                        help=('The FASTA reference to order the contigs'
+                              ' by. Must have a .fai or .dict index.'))
+
+    parser.add_argument('--info', type=str, nargs=5,
+                        help=('Read group information, as for'
+                              ' addgroups.py, in the form rg_field=value.'
+                              ' Read groups are left alone by default.'),
+                        metavar=('rgid', 'rglb', 'rgpl', 'rgpu', 'rgsm'))
+
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help=('The number of threads compressing and'
+                              ' decompressing each file. Default: 1'))
+    add_arguments(parser)
+    args = parser.parse_args()
+    if not os.path.isdir(args.inputdir):
+        sys.stderr.write('Please specify an existent directory of BAM'
+                         ' files.\n')
+        sys.exit(1)
+    try:
+        group = parse_groups(args.info) if args.info else None
+        failed = prepare_all(args.inputdir, args.fasta, group,
+                             max(1, args.threads), max(1, args.jobs),
+                             args.logdir, args.force)
+    except ValueError as E:
+        sys.stderr.write('Error: {}\n'.format(E))
+        sys.exit(1)
+    if failed:
+        sys.exit(1)
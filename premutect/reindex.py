@@ -3,21 +3,28 @@
     "reindex.py", by Sean Soderman
     Reindexes an entire directory of BAM files.
 """
-import os
+import argparse
 import sys
-from subprocess import check_output
+from executor import add_arguments, find_bams, run, run_all
 
-if len(sys.argv) < 2:
-    sys.stderr.write('Usage: {} <bamdir>\n'.format(sys.argv[0]))
-    sys.exit(1)
 
-directory = sys.argv[1]
-for dirpath, dirnames, filenames in os.walk(directory):
-    for f in filenames:
-        if f.endswith('.bam'):
-            filepath = os.path.join(dirpath, f)
-            try:
-                check_output(['samtools', 'index', filepath])
-            except subprocess.CalledProcessError as cpe:
-                sys.stderr.write("Error: Samtools messed up: {}".format(cpe))
-                sys.exit(1)
+"""
+Indexes a BAM file with samtools.
+"""
+def reindex(bam, log):
+    run('samtools index {}'.format(bam), log)
+    return 'indexed'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=('Reindexes an entire'
+                                                  ' directory of BAM files'))
+    parser.add_argument('bamdir', type=str,
+                        help=('The directory of BAM files to index,'
+                              ' including its subdirectories'))
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if run_all('reindex', reindex, find_bams(args.bamdir, recursive=True),
+               jobs=max(1, args.jobs), logdir=args.logdir, params={},
+               force=args.force):
+        sys.exit(1)
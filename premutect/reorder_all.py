@@ -7,60 +7,162 @@
 
 import argparse
 import os
-import subprocess as sp
 import sys
+from buildstate import up_to_date
+from executor import (add_arguments, find_bams, java, jvm_jobs, run,
+                      run_all)
+try:
+    #prepare makes sure the right pysam is imported.
+    from prepare import header_dict, in_order, prepare, reorder_header
+    from pysam import AlignmentFile
+    from seqcache import SeqCache
+except ImportError as I:
+    sys.stderr.write('Please install the necessary packages: {}\n'
+                     .format(I))
+    sys.exit(1)
 
-parser = argparse.ArgumentParser(description='BAM file re-orderer')
-parser.add_argument('-f', '--fasta', type=str, 
-                    help=('The FASTA file to' 
-                    'be used for reordering'), required=True)
+#The command template to be used for invoking picard on files that can't
+#be reordered natively. Uses double brace trick for later formatting.
+picard_cmd = ('{java} INPUT={{inbam}} REFERENCE={ref}'
+              ' OUTPUT={{outbam}}')
 
-parser.add_argument('-d', '--directory', type=str, 
-                    help='Directory of BAM files to reorder', required=True)
 
-parser.add_argument('-p', '--picard_path', type=str, 
-                    help=('The full path of the Picard jarfile. Defaults to a file'
-                    'named "picard.jar" in the current working directory'), 
-                    default='picard.jar')
+"""
+Whether a BAM file needs Picard's ReorderSam: when its contigs are out of
+the reference's order and it has no index to read them contig by contig.
+"""
+def needs_picard(bam, reference):
+    with AlignmentFile(bam, 'rb') as inbam:
+        if inbam.has_index():
+            return False
+        header, tidmap = reorder_header(header_dict(inbam), reference)
+        return not in_order(tidmap)
 
-args = parser.parse_args()
 
-fasta = args.fasta
-directory = args.directory
+"""
+Reorders a BAM file with ReorderSam into a temporary file next to it,
+which then replaces it. Picard's output goes to log.
+"""
+def picard_reorder(bam, cmd, log):
+    temp = bam + '.reorder.tmp.bam'
+    try:
+        run(cmd.format(inbam=bam, outbam=temp), log)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    os.rename(temp, bam)
 
-#The command template to be used for invoking picard on all files in the
-#directory. Uses double brace trick for later formatting.
-cmd = 'java -jar {path} INPUT={{inbam}} REFERENCE={ref} OUTPUT={{outbam}}'
 
-#Validate command line arguments.
-if not os.path.exists(args.picard_path):
-    sys.stderr.write(('Please specify an existent path to a picard jar file'
-                    'or ensure picard.jar is in your working directory.\n'))
-    sys.exit(1)
-elif not os.path.exists(fasta):
-    sys.stderr.write('Please specify a path to an existent FASTA file\n')
-    sys.exit(1)
-elif not os.path.exists(directory):
-    sys.stderr.write(('Please specify a path to an existent directory of BAM'
-                      'files.\n'))
-    sys.exit(1)
+"""
+Reorders a single BAM file by the contigs of reference (a SeqInfo):
+natively (see prepare.prepare) if it is in order already or indexed,
+otherwise with the Picard command cmd, which is also used for every file
+with use_picard. threads threads compress and decompress the file.
+Returns how it was reordered.
+"""
+def reorder(bam, log, reference, cmd, threads=1, use_picard=False):
+    if use_picard or needs_picard(bam, reference):
+        picard_reorder(bam, cmd, log)
+        return 'ReorderSam'
+    prepared = prepare(bam, reference, threads=threads, zero_mapq=False)
+    if prepared is None:
+        return 'already in order, left alone'
+    written, dropped = prepared
+    if dropped:
+        return ('natively, dropping {} reads on contigs missing from the'
+                ' reference'.format(dropped))
+    return 'natively'
 
-cmd = cmd.format(path=args.picard_path, ref=fasta)
 
 """
-Walk through the directory tree, invoking ReorderSam on each BAM file with
-the supplied FASTA file.
+Walk through the directory tree, reordering each BAM file with the
+supplied FASTA file, in up to jobs worker processes at a time (fewer when
+Picard is needed, so its JVMs, each with a heap of mem gigabytes, fit in
+mem_budget gigabytes). Files already reordered by the same reference since
+they last changed are skipped, unless force is set. Returns the paths of
+the files that could not be reordered.
 """
-def bamwalk(cmd, directory):
-    for dirpath, dirnames, filenames in os.walk(directory):
-        for f in filenames:
-            if f.endswith('.bam'):
-                filepath = os.path.join(dirpath, f)
-                command = cmd.format(inbam=path, outbam=path)
-                try:
-                    sp.check_output(command.split())
-                except sp.CalledProcessError as cpe:
-                    sys.stderr.write('Issue executing ReorderSam: {}'
-                                     .format(cpe))
-                    sys.exit(1)
-bamwalk(cmd, directory)
+def bamwalk(directory, fasta, picard_path, jobs=1, threads=1,
+            use_picard=False, mem=2, mem_budget=None, logdir=None,
+            force=False):
+    reference = SeqCache().reference(fasta)
+    if reference is None and not use_picard:
+        raise ValueError('{} has no FASTA index (.fai) or sequence'
+                         ' dictionary (.dict)'.format(fasta))
+    bams = find_bams(directory, recursive=True)
+    params = {'fasta': os.path.realpath(fasta),
+              'contigs': reference.references if reference else None}
+    picard = use_picard
+    for bam in bams:
+        if not force and up_to_date(bam, 'reorder_all', params):
+            continue
+        try:
+            picard = picard or needs_picard(bam, reference)
+        except (IOError, OSError, ValueError):
+            #The file's error is reported when it is reordered.
+            pass
+    if picard:
+        if not os.path.exists(picard_path):
+            sys.stderr.write('Some files need Picard, but {} does not'
+                             ' exist\n'.format(picard_path))
+        jobs = jvm_jobs(jobs, mem, mem_budget)
+    cmd = picard_cmd.format(java=java(picard_path, mem), ref=fasta)
+    return run_all('reorder_all', reorder, bams,
+                   (reference, cmd, threads, use_picard), jobs, logdir,
+                   params, force)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='BAM file re-orderer')
+    parser.add_argument('-f', '--fasta', type=str,
+                        help=('The FASTA file to'
+                        ' be used for reordering'), required=True)
+
+    parser.add_argument('-d', '--directory', type=str,
+                        help='Directory of BAM files to reorder',
+                        required=True)
+
+    parser.add_argument('-p', '--picard_path', type=str,
+                        help=('The full path of the Picard jarfile, used'
+                        ' for unindexed files out of order. Defaults to a'
+                        ' file named "picard.jar" in the current working'
+                        ' directory'),
+                        default='picard.jar')
+
+    parser.add_argument('--use_picard', action='store_true',
+                        help='Reorder every file with Picard\'s ReorderSam')
+
+    parser.add_argument('-t', '--threads', type=int, default=1,
+                        help=('The number of threads compressing and'
+                              ' decompressing each BAM file reordered'
+                              ' natively. Default: 1'))
+    add_arguments(parser, jvm=True)
+    args = parser.parse_args()
+
+    fasta = args.fasta
+    directory = args.directory
+
+    #Validate command line arguments.
+    if args.use_picard and not os.path.exists(args.picard_path):
+        sys.stderr.write(('Please specify an existent path to a picard jar'
+                          ' file or ensure picard.jar is in your working'
+                          ' directory.\n'))
+        sys.exit(1)
+    elif not os.path.exists(fasta):
+        sys.stderr.write('Please specify a path to an existent FASTA file\n')
+        sys.exit(1)
+    elif not os.path.exists(directory):
+        sys.stderr.write(('Please specify a path to an existent directory of'
+                          ' BAM files.\n'))
+        sys.exit(1)
+
+    try:
+        failed = bamwalk(directory, fasta, args.picard_path,
+                         max(1, args.jobs), max(1, args.threads),
+                         args.use_picard, args.mem, args.mem_budget,
+                         args.logdir, args.force)
+    except ValueError as E:
+        sys.stderr.write('Error: {}\n'.format(E))
+        sys.exit(1)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,116 @@
+"""
+    "test_buildstate.py", by Sean Soderman
+    Runs stand-in premutect steps through the executor on a stand-in BAM
+    file, and checks from its state file which reruns are skipped: a step
+    done with the same parameters is, unless the file changed, a step
+    before it ran since, or the parameters differ.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'premutect'))
+import buildstate
+from executor import run_all
+
+"""
+The steps the stand-in step function ran, in order, as (step, file).
+"""
+ran = []
+
+
+"""
+Stands in for a step that leaves the file as it is.
+"""
+def keep(bam, log, step):
+    ran.append((step, bam))
+    return 'kept'
+
+
+"""
+Stands in for a step that rewrites the file.
+"""
+def rewrite(bam, log, step):
+    ran.append((step, bam))
+    with open(bam, 'ab') as bamfile:
+        bamfile.write(b'rewritten')
+    return 'rewritten'
+
+
+class StateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='buildstate_test')
+        self.bam = os.path.join(self.directory, 'sample.bam')
+        with open(self.bam, 'wb') as bamfile:
+            bamfile.write(b'BAM\1')
+        del ran[:]
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    """
+    Runs a step on the BAM file, and returns whether it was run rather
+    than skipped.
+    """
+    def step(self, step, params=None, function=keep, force=False):
+        count = len(ran)
+        failed = run_all(step, function, [self.bam], (step,),
+                         params={} if params is None else params,
+                         force=force)
+        self.assertEqual(failed, [])
+        return len(ran) > count
+
+    def test_rerun_skipped(self):
+        self.assertTrue(self.step('mapqto0'))
+        self.assertFalse(self.step('mapqto0'))
+        self.assertTrue(self.step('mapqto0', force=True))
+        self.assertTrue(os.path.exists(buildstate.state_path(self.bam)))
+
+    def test_own_changes_kept(self):
+        #A step's own rewrite doesn't make it, or the steps before, stale.
+        self.assertTrue(self.step('addgroups', function=rewrite))
+        self.assertTrue(self.step('prepare', function=rewrite))
+        self.assertFalse(self.step('prepare', function=rewrite))
+        self.assertFalse(self.step('addgroups', function=rewrite))
+
+    def test_parameters(self):
+        self.assertTrue(self.step('addgroups', {'group': ['a']}))
+        self.assertFalse(self.step('addgroups', {'group': ('a',)}))
+        self.assertTrue(self.step('addgroups', {'group': ['b']}))
+
+    def test_earlier_step_reruns_later(self):
+        self.assertTrue(self.step('prepare'))
+        self.assertTrue(self.step('mapqto0'))
+        self.assertTrue(self.step('prepare', {'reference': 'other.fa'}))
+        self.assertTrue(self.step('mapqto0'))
+        #A later step running again doesn't affect the earlier ones.
+        self.assertFalse(self.step('prepare', {'reference': 'other.fa'}))
+
+    def test_outside_change(self):
+        self.assertTrue(self.step('prepare'))
+        self.assertTrue(self.step('mapqto0'))
+        with open(self.bam, 'ab') as bamfile:
+            bamfile.write(b'changed')
+        self.assertTrue(self.step('mapqto0'))
+        #Changed by something else, the file has no history left.
+        self.assertTrue(self.step('prepare'))
+
+    def test_index_change(self):
+        index = self.bam + '.bai'
+        with open(index, 'wb') as indexfile:
+            indexfile.write(b'BAI\1')
+        self.assertTrue(self.step('reindex'))
+        self.assertFalse(self.step('reindex'))
+        with open(index, 'ab') as indexfile:
+            indexfile.write(b'changed')
+        self.assertTrue(self.step('reindex'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+"""
+    "test_mapqto0.py", by Sean Soderman
+    Runs mapqto0 on a small synthetic BAM file, whose reads straddle many
+    BGZF blocks, and checks that only the unmapped reads' MAPQs change:
+    the file still reads with pysam, with every other field as it was, and
+    its index is rebuilt. Needs pysam.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'premutect'))
+try:
+    import pysam
+except ImportError:
+    pysam = None
+else:
+    import mapqto0
+
+"""
+The contigs of the test BAM, and the number of reads on each. Every fifth
+read is unmapped (placed by its mate), and a few more are unplaced.
+"""
+CONTIGS = [('chr1', 100000), ('chr2', 50000)]
+READS = 3000
+UNPLACED = 10
+LENGTH = 100
+
+
+"""
+Writes a coordinate sorted BAM file of random reads to path, indexing it
+if index is set. The MAPQ of the unmapped reads is nonzero, except for
+some that already have MAPQ 0.
+"""
+def write_bam(path, index=True):
+    rng = random.Random(0)
+    header = {'HD': {'VN': '1.6', 'SO': 'coordinate'},
+              'SQ': [{'SN': c, 'LN': l} for c, l in CONTIGS]}
+    with pysam.AlignmentFile(path, 'wb', header=header) as bam:
+        def read(name, tid, start, flag, mapq):
+            segment = pysam.AlignedSegment(bam.header)
+            segment.query_name = name
+            segment.query_sequence = ''.join(rng.choice('ACGT')
+                                             for _ in range(LENGTH))
+            segment.flag = flag
+            segment.reference_id = tid
+            segment.reference_start = start
+            segment.mapping_quality = mapq
+            if not flag & mapqto0.UNMAPPED:
+                segment.cigarstring = '{}M'.format(LENGTH)
+            segment.query_qualities = pysam.qualitystring_to_array(
+                ''.join(rng.choice('#-5?I') for _ in range(LENGTH)))
+            bam.write(segment)
+        for tid, (contig, length) in enumerate(CONTIGS):
+            starts = sorted(rng.randrange(length - LENGTH)
+                            for _ in range(READS))
+            for number, start in enumerate(starts):
+                if number % 5:
+                    read('m{}.{}'.format(tid, number), tid, start, 0,
+                         rng.choice([0, 20, 60]))
+                else:
+                    read('u{}.{}'.format(tid, number), tid, start,
+                         mapqto0.UNMAPPED, rng.choice([0, 37]))
+        for number in range(UNPLACED):
+            read('p{}'.format(number), -1, -1, mapqto0.UNMAPPED, 25)
+    if index:
+        pysam.index(path)
+
+
+"""
+Returns the reads of a BAM file as (MAPQ, the read's SAM line with the
+MAPQ left out) tuples.
+"""
+def reads(path):
+    found = []
+    with pysam.AlignmentFile(path, 'rb') as bam:
+        for read in bam.fetch(until_eof=True):
+            fields = read.to_string().split('\t')
+            found.append((read.mapping_quality, fields[:4] + fields[5:]))
+    return found
+
+
+@unittest.skipIf(pysam is None, 'pysam is not installed')
+class MapqTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='mapqto0_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def bam(self, name, index=True):
+        path = os.path.join(self.directory, name)
+        write_bam(path, index)
+        return path
+
+    def check_patched(self, path, before):
+        after = reads(path)
+        self.assertEqual([fields for mapq, fields in after],
+                         [fields for mapq, fields in before])
+        for (old, fields), (new, _) in zip(before, after):
+            unmapped = int(fields[1]) & mapqto0.UNMAPPED
+            self.assertEqual(new, 0 if unmapped else old)
+
+    def test_patch(self):
+        path = self.bam('reads.bam')
+        before = reads(path)
+        expected = sum(1 for mapq, fields in before
+                       if int(fields[1]) & mapqto0.UNMAPPED and mapq)
+        self.assertTrue(mapqto0.check(path))
+        self.assertEqual(mapqto0.mapq2zero(path), expected)
+        self.check_patched(path, before)
+        #The index was rebuilt, and finds the reads of each contig.
+        with pysam.AlignmentFile(path, 'rb') as bam:
+            self.assertTrue(bam.has_index())
+            self.assertEqual(sum(s.total for s in
+                                 bam.get_index_statistics()),
+                             len(CONTIGS) * READS)
+        self.assertFalse(mapqto0.check(path))
+        #A clean file is left alone.
+        stat = os.stat(path)
+        self.assertEqual(mapqto0.mapq2zero(path), 0)
+        self.assertEqual(os.stat(path).st_mtime, stat.st_mtime)
+
+    def test_threads(self):
+        one = self.bam('one.bam', index=False)
+        before = reads(one)
+        three = os.path.join(self.directory, 'three.bam')
+        shutil.copy(one, three)
+        self.assertEqual(mapqto0.mapq2zero(one, 1),
+                         mapqto0.mapq2zero(three, 3))
+        self.check_patched(three, before)
+        with open(one, 'rb') as first, open(three, 'rb') as second:
+            self.assertEqual(first.read(), second.read())
+        #Unindexed files are left that way.
+        self.assertFalse(os.path.exists(three + '.bai'))
+
+if __name__ == '__main__':
+    unittest.main()
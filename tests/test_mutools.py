@@ -0,0 +1,63 @@
+"""
+    "test_mutools.py", by Sean Soderman
+    Keeps the startup of the mutools entry point within its budget: a
+    tool's --help must not pay for loading the other tools (or pysam).
+"""
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+MUTOOLS = os.path.join(ROOT, 'mutools.py')
+
+"""
+Seconds a tool's --help may take through mutools, interpreter startup
+included. Measured at under 0.1s on a desktop; the rest is headroom for
+loaded CI machines.
+"""
+BUDGET = 0.5
+
+"""
+Tools whose --help is timed. They're the ones that don't need pysam or
+python 2 just to parse their arguments.
+"""
+TOOLS = ['catenate', 'combine', 'reindex', 'addgroups', 'workqueue',
+         'accounting']
+
+
+"""
+Returns the wall time of the fastest of tries runs of mutools with the
+given arguments, failing the test if any run fails.
+"""
+def startup(args, tries=3):
+    best = None
+    with open(os.devnull, 'w') as null:
+        for _ in range(tries):
+            start = time.time()
+            subprocess.check_call([sys.executable, MUTOOLS] + args,
+                                  stdout=null)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class StartupTest(unittest.TestCase):
+    def test_help_within_budget(self):
+        for tool in TOOLS:
+            elapsed = startup([tool, '--help'])
+            self.assertLess(elapsed, BUDGET,
+                            '{} --help took {:.2f}s, over the {}s budget'
+                            .format(tool, elapsed, BUDGET))
+
+    def test_usage_within_budget(self):
+        self.assertLess(startup(['--help']), BUDGET)
+
+    def test_import_leaves_pysam_alone(self):
+        code = ('import sys; sys.path.insert(0, {!r}); import mutools;'
+                ' sys.exit("pysam" in sys.modules)'.format(ROOT))
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
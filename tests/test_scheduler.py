@@ -0,0 +1,70 @@
+"""
+    "test_scheduler.py", by Sean Soderman
+    Checks that the scheduler retries a job that ran out of memory, and
+    only judges each attempt by its own part of the job's log.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'multimutect'))
+from job import Job
+from scheduler import Scheduler, out_of_memory
+
+"""
+Stands in for MuTect: runs out of memory on its first attempt, then fails
+for another reason, counting its attempts in the file named by its
+argument.
+"""
+STUB = """import sys
+with open(sys.argv[1], 'a') as counter:
+    counter.write('.')
+with open(sys.argv[1], 'r') as counter:
+    attempt = len(counter.read())
+if attempt == 1:
+    print('Exception in thread "main" java.lang.OutOfMemoryError')
+else:
+    print('ERROR MESSAGE: Invalid command line argument')
+sys.exit(1)
+"""
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='scheduler_test')
+        self.stub = os.path.join(self.directory, 'stub.py')
+        with open(self.stub, 'w') as stub:
+            stub.write(STUB)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_out_of_memory_after_offset(self):
+        log = os.path.join(self.directory, 'job.log')
+        with open(log, 'w') as logfile:
+            logfile.write('Attempt 1\njava.lang.OutOfMemoryError\n')
+            offset = logfile.tell()
+            logfile.write('Attempt 2\nsomething else\n')
+        self.assertTrue(out_of_memory(1, log))
+        self.assertFalse(out_of_memory(1, log, offset))
+        #Killed by the OOM killer, whatever the log says.
+        self.assertTrue(out_of_memory(-9, log, offset))
+
+    def test_retried_only_for_memory(self):
+        counter = os.path.join(self.directory, 'attempts')
+        vcf = os.path.join(self.directory, 'job.vcf')
+        job = Job('{} {} {}'.format(sys.executable, self.stub, counter),
+                  ('tumor.bam', 'normal.bam'), [], vcf)
+        scheduler = Scheduler(1, 1, poll=0.05, retries=2, max_mem=4)
+        results = list(scheduler.run([(0, job)]))
+        self.assertEqual(results, [(0, job, 1)])
+        #Retried once for running out of memory, not again for the
+        #other failure that followed it in the same log.
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.heap, 2048)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+"""
+    "test_vcfcat.py", by Sean Soderman
+    Round trips through the native concatenation and the BGZF writer: a
+    concatenation holds the first fragment's header and every fragment's
+    records, whichever way the bodies are copied, and compressed output
+    decompresses with gzip (and indexes with tabix, where pysam is there).
+"""
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'postmutect'))
+import bgzf
+import vcfcat
+from vcfdata import CONTIGS, contents, vcf_lines
+
+"""
+The number of fragments concatenated, one per contig, and the records
+the VCFs they are cut from hold: enough for the compressed fragments to
+span several blocks.
+"""
+FRAGMENTS = 3
+SITES = 6000
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+
+class Without(object):
+    """
+    Stands in for the os module, without the functions named in missing,
+    so the fallbacks of copy_body can be tried.
+    """
+    def __init__(self, missing):
+        self.missing = missing
+
+    def __getattr__(self, name):
+        if name in self.missing:
+            raise AttributeError(name)
+        return getattr(os, name)
+
+
+"""
+Returns the contents of a file, decompressed if it is gzipped.
+"""
+def plain_contents(path):
+    if bgzf.is_gzip(path):
+        with gzip.open(path, 'rb') as infile:
+            return infile.read()
+    return contents(path)
+
+
+class ConcatenateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vcfcat_test')
+        self.fragments = []
+        for rank in range(FRAGMENTS):
+            lines = [l.encode('ascii') for l in
+                     vcf_lines(['TUMOR', 'NORMAL'], rank, SITES, 1000)]
+            contig = CONTIGS[rank][0].encode('ascii') + b'\t'
+            self.fragments.append([l for l in lines if l.startswith(b'#')
+                                   or l.startswith(contig)])
+        self.header = [l for l in self.fragments[0] if l.startswith(b'#')]
+        #What cat gives, but with the header only once.
+        self.expected = b''.join(self.header + [
+            l for f in self.fragments for l in f if not l.startswith(b'#')])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    """
+    Writes the fragments, plain or BGZF compressed, and returns their
+    paths.
+    """
+    def write_fragments(self, compressed):
+        paths = []
+        for number, lines in enumerate(self.fragments):
+            path = self.path('fragment{}.vcf'.format(number))
+            if compressed:
+                path += '.gz'
+                with bgzf.BgzfWriter(path) as writer:
+                    writer.writelines(lines)
+            else:
+                with open(path, 'wb') as vcf:
+                    vcf.writelines(lines)
+            paths.append(path)
+        return paths
+
+    def test_plain(self):
+        paths = self.write_fragments(False)
+        for missing in ([], ['copy_file_range'],
+                        ['copy_file_range', 'sendfile']):
+            vcfcat.os = Without(missing)
+            try:
+                vcfcat.concatenate(paths, self.path('out.vcf'))
+            finally:
+                vcfcat.os = os
+            self.assertEqual(contents(self.path('out.vcf')), self.expected,
+                             'copying without {}'.format(missing))
+
+    def test_compressed(self):
+        paths = self.write_fragments(True)
+        out = self.path('out.vcf.gz')
+        vcfcat.concatenate(paths, out, threads=2)
+        self.assertEqual(plain_contents(out), self.expected)
+        self.assertTrue(bgzf.complete(out))
+        #The blocks after each header were copied as they were.
+        with open(out, 'rb') as outfile:
+            blocks = set(iter(lambda: bgzf.read_block(outfile), None))
+        for path in paths[1:]:
+            with open(path, 'rb') as infile:
+                copied = list(iter(lambda: bgzf.read_block(infile), None))
+            self.assertGreater(len(copied), 2)
+            self.assertTrue(set(copied[1:-1]) <= blocks)
+
+    def test_mixed(self):
+        plain = self.write_fragments(False)
+        compressed = self.write_fragments(True)
+        paths = [plain[0], compressed[1], plain[2]]
+        vcfcat.concatenate(paths, self.path('out.vcf'))
+        self.assertEqual(contents(self.path('out.vcf')), self.expected)
+        vcfcat.concatenate(paths, self.path('out.vcf.gz'))
+        self.assertEqual(plain_contents(self.path('out.vcf.gz')),
+                         self.expected)
+
+    @unittest.skipIf(pysam is None, 'pysam is not installed')
+    def test_tabix_index(self):
+        out = self.path('out.vcf.gz')
+        vcfcat.concatenate(self.write_fragments(True), out)
+        self.assertTrue(os.path.exists(out + '.tbi'))
+        records = [l for l in self.expected.split(b'\n')
+                   if l.startswith(CONTIGS[1][0].encode('ascii') + b'\t')]
+        with pysam.TabixFile(out) as tabix:
+            fetched = [r.encode('ascii') for r in tabix.fetch(CONTIGS[1][0])]
+        self.assertEqual(fetched, records)
+
+    def test_mismatched_columns(self):
+        paths = self.write_fragments(False)
+        with open(paths[1], 'wb') as vcf:
+            vcf.writelines(l.replace(b'NORMAL', b'OTHER')
+                           for l in self.fragments[1])
+        self.assertRaises(ValueError, vcfcat.concatenate, paths,
+                          self.path('out.vcf'))
+
+
+class BgzfWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='bgzf_test')
+        self.data = b''.join(l.encode('ascii') for l in
+                             vcf_lines(['TUMOR'], 0, SITES, 1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        for threads in (1, 3):
+            path = os.path.join(self.directory,
+                                'out{}.vcf.gz'.format(threads))
+            with bgzf.BgzfWriter(path, threads) as writer:
+                #Writes of all sizes, across the block boundaries.
+                for start in range(0, len(self.data), 7919):
+                    writer.write(self.data[start:start + 7919])
+            self.assertEqual(plain_contents(path), self.data)
+            self.assertTrue(bgzf.complete(path))
+            with open(path, 'rb') as infile:
+                blocks = list(iter(lambda: bgzf.read_block(infile), None))
+            sizes = [bgzf.block_size(b) for b, start in blocks]
+            self.assertEqual(sizes[-1], 0)
+            self.assertTrue(all(0 < s <= bgzf.MAX_BLOCK for s in sizes[:-1]))
+            self.assertEqual(b''.join(bgzf.inflate(*b) for b in blocks),
+                             self.data)
+
+    def test_not_bgzf(self):
+        path = os.path.join(self.directory, 'plain.gz')
+        with gzip.open(path, 'wb') as outfile:
+            outfile.write(self.data)
+        with open(path, 'rb') as infile:
+            self.assertRaises(ValueError, bgzf.read_block, infile)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+"""
+    "test_vcfmerge.py", by Sean Soderman
+    Checks the rows of the native merge against those worked out by hand,
+    that contig_spans finds each contig's records, and that merging
+    contig by contig (with or without a bounded fan-in) gives the same
+    file as a plain merge, without opening more than fan_in of the inputs
+    at once.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'postmutect'))
+import vcfmerge
+from vcfdata import CONTIGS, META, contents, write_reference, write_vcf
+
+"""
+The number of VCFs merged, and the fan-in they're merged with.
+"""
+INPUTS = 5
+FAN_IN = 2
+
+"""
+vcfmerge's Input, which the tests swap for a CountingInput.
+"""
+Input = vcfmerge.Input
+
+
+class CountingInput(Input):
+    """
+    An Input keeping track of how many inputs are open at once.
+    """
+    open_now = 0
+    most_open = 0
+
+    def __init__(self, *args):
+        Input.__init__(self, *args)
+        CountingInput.open_now += 1
+        CountingInput.most_open = max(CountingInput.most_open,
+                                      CountingInput.open_now)
+        self.counted = True
+
+    def close(self):
+        if self.counted:
+            CountingInput.open_now -= 1
+            self.counted = False
+        Input.close(self)
+
+
+"""
+Two small VCFs, and the rows merging them gives, worked out by hand: a
+site in both takes its ID, QUAL and INFO from the first, passes if either
+passed it and gets missing values for the FORMAT keys an input lacks.
+"""
+FIRST = ['chr1\t100\t.\tA\tG\t.\tPASS\tDP=10\tGT:AD\t0/1:5,5\t0/0:10,0\n',
+         'chr2\t50\t.\tC\tT\t.\tREJECT\t.\tGT:AD\t0/1:3,2\t0/0:9,0\n']
+SECOND = ['chr1\t100\trs1\tA\tG\t9\tREJECT\tDP=12\tGT\t0/1\t0/0\n',
+          'chr1\t200\t.\tC\tA\t.\tPASS\t.\tGT:AD\t0/1:1,1\t0/0:5,0\n']
+MERGED = [('chr1\t100\t.\tA\tG\t.\tPASS\tDP=10;set=Intersection\tGT:AD'
+           '\t0/1:5,5\t0/0:10,0\t0/1:.\t0/0:.\n'),
+          ('chr1\t200\t.\tC\tA\t.\tPASS\tset=second\tGT:AD'
+           '\t./.:.\t./.:.\t0/1:1,1\t0/0:5,0\n'),
+          ('chr2\t50\t.\tC\tT\t.\tREJECT\tset=first\tGT:AD'
+           '\t0/1:3,2\t0/0:9,0\t./.:.\t./.:.\n')]
+
+COLUMNS = '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT'
+
+
+class MergeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vcfmerge_test')
+        self.cache = os.environ.get('MUTOOLS_CACHE')
+        os.environ['MUTOOLS_CACHE'] = os.path.join(self.directory, 'cache')
+        self.reference = write_reference(self.directory)
+        self.paths = [write_vcf(os.path.join(self.directory,
+                                             'pair{}.vcf'.format(i)),
+                                ['TUMOR', 'NORMAL'], i)
+                      for i in range(INPUTS)]
+
+    def tearDown(self):
+        if self.cache is None:
+            del os.environ['MUTOOLS_CACHE']
+        else:
+            os.environ['MUTOOLS_CACHE'] = self.cache
+        shutil.rmtree(self.directory)
+
+    def output(self, name):
+        return os.path.join(self.directory, name)
+
+
+class MergeTest(MergeTestCase):
+    """
+    Writes a VCF of the given records, with the samples TUMOR and NORMAL,
+    and returns its path.
+    """
+    def write(self, name, records):
+        path = self.output(name + '.vcf')
+        with open(path, 'w') as vcf:
+            vcf.writelines(META + [COLUMNS + '\tTUMOR\tNORMAL\n'] + records)
+        return path
+
+    def test_rows(self):
+        paths = [self.write('first', FIRST), self.write('second', SECOND)]
+        vcfmerge.merge(paths, self.output('merged.vcf'), self.reference)
+        header = (META + [vcfmerge.SET_INFO] +
+                  [COLUMNS + '\tTUMOR.first\tNORMAL.first'
+                   '\tTUMOR.second\tNORMAL.second\n'])
+        with open(self.output('merged.vcf'), 'r') as merged:
+            self.assertEqual(merged.readlines(), header + MERGED)
+
+    def test_unsorted(self):
+        paths = [self.write('first', FIRST[::-1])]
+        self.assertRaises(ValueError, vcfmerge.merge, paths,
+                          self.output('merged.vcf'), self.reference)
+
+    def test_contig_spans(self):
+        order = vcfmerge.contig_order(self.reference)
+        ranks = sorted(order.values())
+        data = contents(self.paths[0])
+        spans = vcfmerge.contig_spans(self.paths[0], ranks, order)
+        self.assertEqual(sorted(spans), ranks)
+        for contig, length in CONTIGS:
+            start, end = spans[order[contig]]
+            records = [l for l in data.splitlines(True)
+                       if l.startswith(contig.encode('ascii') + b'\t')]
+            self.assertEqual(data[start:end], b''.join(records))
+
+    def test_scatter_matches_merge(self):
+        #Keeps the tumors, and drops the sites where none has a genotype.
+        for select in (None, (['TUMOR.*'], None, True)):
+            vcfmerge.merge(self.paths, self.output('merged.vcf'),
+                           self.reference, select=select)
+            vcfmerge.scatter_merge(self.paths, self.output('scattered.vcf'),
+                                   self.reference, select=select, jobs=2)
+            self.assertEqual(contents(self.output('scattered.vcf')),
+                             contents(self.output('merged.vcf')))
+
+
+class FanInTest(MergeTestCase):
+    def test_fan_in_matches_merge(self):
+        vcfmerge.merge(self.paths, self.output('merged.vcf'), self.reference)
+        vcfmerge.scatter_merge(self.paths, self.output('fanned.vcf'),
+                               self.reference, fan_in=FAN_IN)
+        self.assertEqual(contents(self.output('fanned.vcf')),
+                         contents(self.output('merged.vcf')))
+
+    def test_fan_in_bounds_open_inputs(self):
+        order = vcfmerge.contig_order(self.reference)
+        ranks = sorted(order.values())
+        spans = [vcfmerge.contig_spans(p, ranks, order)[0]
+                 for p in self.paths]
+        names = [vcfmerge.vname(p) for p in self.paths]
+        vcfmerge.Input = CountingInput
+        try:
+            vcfmerge.merge_partition(self.paths, names, spans, 0,
+                                     self.output('chr1.vcf'), order,
+                                     fan_in=FAN_IN, tmpdir=self.directory)
+        finally:
+            vcfmerge.Input = Input
+        self.assertEqual(CountingInput.open_now, 0)
+        self.assertEqual(CountingInput.most_open, FAN_IN)
+        #Only the result is left behind.
+        self.assertEqual([f for f in os.listdir(self.directory)
+                          if f.startswith('part')], [])
+
+if __name__ == '__main__':
+    unittest.main()
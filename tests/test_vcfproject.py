@@ -0,0 +1,88 @@
+"""
+    "test_vcfproject.py", by Sean Soderman
+    Checks the column projection: which samples keep and drop patterns
+    leave, the sites drop_missing drops, and that project copies a file
+    it leaves as it is byte for byte.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'postmutect'))
+from vcfproject import Projection, missing_genotype, project
+from vcfdata import COLUMNS, META, contents, write_vcf
+
+"""
+The columns of a merged VCF, with the normal of a tumor only sample.
+"""
+MERGED = COLUMNS + ['TUMOR.a', 'NORMAL.a', 'TUMOR.b', 'none.b']
+
+"""
+A record of MERGED's columns, with the genotypes given.
+"""
+def record(*genotypes):
+    return (['chr1', '100', '.', 'A', 'G', '.', 'PASS', '.', 'AD:GT']
+            + ['3,4:' + g for g in genotypes])
+
+
+class ProjectionTest(unittest.TestCase):
+    def test_missing_genotype(self):
+        for genotype in ('.', './.', '.|.'):
+            self.assertTrue(missing_genotype(genotype))
+        for genotype in ('0/1', '1|.', '0'):
+            self.assertFalse(missing_genotype(genotype))
+
+    def test_columns(self):
+        self.assertTrue(Projection(MERGED).identity)
+        projection = Projection(MERGED, drop=['none', 'none.*'])
+        self.assertEqual(projection.header(), MERGED[:-1])
+        projection = Projection(MERGED, keep=['TUMOR.*'], drop=['*.b'])
+        self.assertEqual(projection.header(), COLUMNS + ['TUMOR.a'])
+        self.assertFalse(projection.identity)
+        self.assertEqual(projection.apply(record('0/1', '0/0', '.', '.')),
+                         record('0/1'))
+
+    def test_drop_missing(self):
+        projection = Projection(MERGED, keep=['TUMOR.*'], drop_missing=True)
+        self.assertFalse(projection.identity)
+        self.assertEqual(projection.apply(record('./.', '0/0', '0/1', '.')),
+                         record('./.', '0/1'))
+        #Only the kept samples count.
+        self.assertEqual(projection.apply(record('./.', '0/0', '.', '0/1')),
+                         None)
+        #A sample with its trailing fields left out has no genotype.
+        row = record('0/1', '0/0', '0/1', '.')
+        row[9] = '3,4'
+        row[11] = '.'
+        self.assertEqual(projection.apply(row), None)
+
+
+class ProjectTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vcfproject_test')
+        self.vcf = write_vcf(os.path.join(self.directory, 'in.vcf'),
+                             ['TUMOR', 'NORMAL'], 0)
+        self.out = os.path.join(self.directory, 'out.vcf')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_identity(self):
+        self.assertTrue(project(self.vcf, self.out).identity)
+        self.assertEqual(contents(self.out), contents(self.vcf))
+
+    def test_drop(self):
+        project(self.vcf, self.out, drop=['NORMAL'])
+        with open(self.vcf, 'r') as vcf:
+            expected = [l if l.startswith('##') else
+                        '\t'.join(l.rstrip('\n').split('\t')[:-1]) + '\n'
+                        for l in vcf]
+        with open(self.out, 'r') as out:
+            self.assertEqual(out.readlines(), expected)
+        self.assertEqual(expected[:len(META)], META)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+    "test_workqueue.py", by Sean Soderman
+    Runs a coordinator and two workers on a temporary spool, with a stub in
+    place of MuTect, and checks that every job is run and reported once,
+    and that a result reported after its lease expired is discarded.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, os.path.join(ROOT, 'multimutect'))
+from job import Job
+from workqueue import Coordinator, spool_paths, write_record
+
+WORKQUEUE = os.path.join(ROOT, 'multimutect', 'workqueue.py')
+
+"""
+Stands in for MuTect: writes the VCF named by its argument, after a
+moment, so that both workers get a share of the jobs.
+"""
+STUB = """import sys, time
+time.sleep(0.2)
+with open(sys.argv[1], 'w') as vcf:
+    vcf.write('##fileformat=VCFv4.1\\n')
+"""
+
+"""
+The number of jobs queued, and the seconds the workers are given to run
+them all and exit.
+"""
+JOBS = 8
+DEADLINE = 60
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='workqueue_test')
+        self.spool = os.path.join(self.directory, 'spool')
+        self.stub = os.path.join(self.directory, 'stub.py')
+        with open(self.stub, 'w') as stub:
+            stub.write(STUB)
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.workers = []
+
+    def tearDown(self):
+        for worker in self.workers:
+            if worker.poll() is None:
+                worker.kill()
+                worker.wait()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def job(self, tid):
+        vcf = os.path.join(self.directory, 'job{}.vcf'.format(tid))
+        return Job('{} {} {}'.format(sys.executable, self.stub, vcf),
+                   ('tumor.bam', 'normal.bam'), [], vcf)
+
+    def test_two_workers(self):
+        coordinator = Coordinator(self.spool, JOBS, poll=0.1)
+        with open(os.devnull, 'w') as null:
+            for _ in range(2):
+                self.workers.append(subprocess.Popen(
+                    [sys.executable, WORKQUEUE, self.spool,
+                     '--numthreads', '1', '--mem', '1'],
+                    stdout=null, stderr=null))
+        jobs = [(tid, self.job(tid)) for tid in range(JOBS)]
+        results = {}
+        for tid, job, status in coordinator.run(iter(jobs)):
+            self.assertNotIn(tid, results, 'job {} reported twice'
+                             .format(tid))
+            results[tid] = status
+        self.assertEqual(results, dict((tid, 0) for tid in range(JOBS)))
+        for tid, job in jobs:
+            self.assertTrue(os.path.exists(job.vcf))
+        paths = spool_paths(self.spool)
+        self.assertTrue(os.path.exists(paths['finished']))
+        #Every result was collected, and none came in twice.
+        self.assertEqual(os.listdir(paths['done']), [])
+        deadline = time.time() + DEADLINE
+        for worker in self.workers:
+            while worker.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            self.assertEqual(worker.poll(), 0)
+
+    def test_late_result_discarded(self):
+        coordinator = Coordinator(self.spool, JOBS, lease=60, poll=0.1)
+        paths = spool_paths(self.spool)
+        coordinator.submit(0, self.job(0))
+        #A worker claims the job, then stops renewing its lease.
+        lease = os.path.join(paths['leased'], '0.quiet.json')
+        os.rename(os.path.join(paths['queue'], '0.json'), lease)
+        stale = time.time() - 120
+        os.utime(lease, (stale, stale))
+        coordinator.expire()
+        self.assertEqual(os.listdir(paths['leased']), [])
+        with open(os.path.join(paths['queue'], '0.json'), 'r') as recfile:
+            self.assertEqual(json.load(recfile)['generation'], 1)
+        result = {'tid': 0, 'status': 0, 'attempts': 1, 'heap': None,
+                  'wall': 1.0, 'timed_out': False}
+        done = os.path.join(paths['done'], '0.json')
+        #The quiet worker finishes after all: too late to count.
+        write_record(done, dict(result, worker='quiet', generation=0))
+        self.assertEqual(coordinator.collect(), [])
+        self.assertIn(0, coordinator.jobs)
+        write_record(done, dict(result, worker='other', generation=1))
+        self.assertEqual([r[0] for r in coordinator.collect()], [0])
+        self.assertEqual(coordinator.jobs, {})
+
+if __name__ == '__main__':
+    unittest.main()
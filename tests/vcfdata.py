@@ -0,0 +1,83 @@
+"""
+    "vcfdata.py", by Sean Soderman
+    Writes the small synthetic VCF files and reference index the
+    postmutect tests run on.
+"""
+import os
+import random
+
+"""
+The contigs of the test reference, in order, with their lengths. The
+last one never has any records.
+"""
+CONTIGS = [('chr1', 5000), ('chr2', 3000), ('chr3', 2000), ('chr4', 1000)]
+
+"""
+The header lines of every test VCF, before the #CHROM line.
+"""
+META = (['##fileformat=VCFv4.1\n',
+         '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">\n',
+         '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n',
+         '##FORMAT=<ID=AD,Number=.,Type=Integer,Description="Depths">\n']
+        + ['##contig=<ID={},length={}>\n'.format(c, l) for c, l in CONTIGS])
+
+COLUMNS = ['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO',
+           'FORMAT']
+
+
+"""
+Writes the FASTA index of the test reference into directory, and returns
+the path of the reference it stands for.
+"""
+def write_reference(directory):
+    fasta = os.path.join(directory, 'ref.fa')
+    offset = 6
+    with open(fasta + '.fai', 'w') as fai:
+        for contig, length in CONTIGS:
+            fai.write('{}\t{}\t{}\t60\t61\n'.format(contig, length, offset))
+            offset += len(contig) + 2 + length + length // 60 + 1
+    return fasta
+
+
+"""
+Returns the lines of a VCF file with the given samples, holding sites
+records picked with the given seed from a set of sites (positions per
+contig and allele), small by default so that the files of different seeds
+share some. Records are in reference order.
+"""
+def vcf_lines(samples, seed, sites=30, positions=40):
+    rng = random.Random(seed)
+    records = set()
+    while len(records) < sites:
+        rank = rng.randrange(len(CONTIGS) - 1)
+        records.add((rank, rng.randrange(1, positions) * 50,
+                     rng.choice('AC'), rng.choice('GT')))
+    lines = META + ['\t'.join(COLUMNS + samples) + '\n']
+    for rank, position, ref, alt in sorted(records):
+        fields = [CONTIGS[rank][0], str(position), '.', ref, alt, '.',
+                  rng.choice(['PASS', 'REJECT']),
+                  rng.choice(['.', 'DP={}'.format(rng.randrange(10, 99))]),
+                  'GT:AD']
+        for sample in samples:
+            fields.append('{}:{},{}'.format(rng.choice(['0/0', '0/1', '.']),
+                                            rng.randrange(30),
+                                            rng.randrange(30)))
+        lines.append('\t'.join(fields) + '\n')
+    return lines
+
+
+"""
+Writes a VCF file (see vcf_lines) to path, and returns path.
+"""
+def write_vcf(path, samples, seed, sites=30, positions=40):
+    with open(path, 'w') as vcf:
+        vcf.writelines(vcf_lines(samples, seed, sites, positions))
+    return path
+
+
+"""
+Returns the contents of a file, as bytes.
+"""
+def contents(path):
+    with open(path, 'rb') as infile:
+        return infile.read()